@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.embedding_index import EmbeddingIndex
+from utils.ann_index import IVFFlatIndex, FaissHNSWIndex, faiss
+
+
+def synthetic_embeddings(n, dim, clusters, seed):
+    """Clustered vectors, which resemble CLIP embeddings better than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    vectors = centers[labels] + 1.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors.astype(np.float32)
+
+
+def build_index(vectors):
+    index = EmbeddingIndex()
+    index.load((i, f"{i}.jpg", "", vectors[i].tobytes()) for i in range(vectors.shape[0]))
+    return index
+
+
+def run_queries(index, queries, k, **params):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        matches = index.search(query, k=k, **params)
+        latencies.append(time.perf_counter() - start)
+        results.append([image_id for _, image_id, _, _ in matches])
+    return results, np.array(latencies) * 1000
+
+
+def recall(results, truth, k):
+    hits = sum(len(set(found[:k]) & set(expected[:k])) for found, expected in zip(results, truth))
+    return hits / (k * len(truth))
+
+
+def report(label, results, latencies, truth, k):
+    print(f"{label:<28} recall@{k}={recall(results, truth, k):.3f}  "
+          f"mean={latencies.mean():.2f}ms  p95={np.percentile(latencies, 95):.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of ANN search against exact search")
+    parser.add_argument("--size", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = synthetic_embeddings(args.size + args.queries, args.dim, 1000, args.seed)
+    queries, vectors = vectors[:args.queries], vectors[args.queries:]
+    index = build_index(vectors)
+
+    truth, latencies = run_queries(index, queries, args.k, exact=True)
+    report("exact", truth, latencies, truth, args.k)
+
+    start = time.perf_counter()
+    index.attach_ann(IVFFlatIndex(nlist=args.nlist or None))
+    print(f"IVF build: {time.perf_counter() - start:.1f}s, nlist={index.ann.nlist}")
+    for nprobe in (1, 2, 4, 8, 16, 32, 64):
+        results, latencies = run_queries(index, queries, args.k, nprobe=nprobe)
+        report(f"ivf nprobe={nprobe}", results, latencies, truth, args.k)
+
+    if faiss is None:
+        print("faiss not installed, skipping HNSW")
+        return
+    index = build_index(vectors)
+    start = time.perf_counter()
+    index.attach_ann(FaissHNSWIndex())
+    print(f"HNSW build: {time.perf_counter() - start:.1f}s")
+    for ef_search in (16, 32, 64, 128, 256):
+        results, latencies = run_queries(index, queries, args.k, ef_search=ef_search)
+        report(f"hnsw ef_search={ef_search}", results, latencies, truth, args.k)
+
+
+if __name__ == "__main__":
+    main()
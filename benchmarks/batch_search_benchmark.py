@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from ann_benchmark import synthetic_embeddings
+from utils.embedding_index import EmbeddingIndex
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def scoring_benchmark(args):
+    """N sequential EmbeddingIndex.search calls against one search_batch call."""
+    vectors = synthetic_embeddings(args.size + max(args.batch), args.dim, 1000, args.seed)
+    queries, vectors = vectors[:max(args.batch)], vectors[max(args.batch):]
+    index = EmbeddingIndex()
+    index.load((i, f"{i}.jpg", "", vectors[i].tobytes()) for i in range(vectors.shape[0]))
+    print(f"Scoring {args.size} vectors, dim {args.dim}, k={args.k}")
+    for n in args.batch:
+        batch = queries[:n]
+        sequential, sequential_seconds = timed(lambda: [index.search(query, k=args.k, exact=True) for query in batch])
+        batched, batched_seconds = timed(lambda: index.search_batch(batch, k=args.k, exact=True))
+        same = all([m[1] for m in a] == [m[1] for m in b] for a, b in zip(sequential, batched))
+        print(f"  {n:>4} queries: sequential {n / sequential_seconds:>8.1f} QPS, "
+              f"batched {n / batched_seconds:>8.1f} QPS ({sequential_seconds / batched_seconds:.1f}x), same results: {same}")
+
+
+def api_benchmark(args):
+    """N sequential GET /search/ requests against one POST /search/batch on a running API."""
+    import requests
+    token = requests.post(f"{args.url}/token", data={"username": args.username, "password": args.password}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    print(f"End to end against {args.url}, k={args.k} (unique queries, so the text cache misses)")
+    for n in args.batch:
+        # A fresh suffix per run keeps every query out of the text embedding cache
+        queries = [f"photo number {i} of a scene {time.time_ns()}" for i in range(n)]
+        _, sequential_seconds = timed(lambda: [
+            requests.get(f"{args.url}/search/", params={"query": query, "k": args.k}, headers=headers).raise_for_status()
+            for query in queries
+        ])
+        queries = [f"photo number {i} of a scene {time.time_ns()}" for i in range(n)]
+        _, batched_seconds = timed(lambda: requests.post(
+            f"{args.url}/search/batch", params={"k": args.k}, json={"queries": queries}, headers=headers
+        ).raise_for_status())
+        print(f"  {n:>4} queries: sequential {n / sequential_seconds:>8.1f} QPS, "
+              f"batched {n / batched_seconds:>8.1f} QPS ({sequential_seconds / batched_seconds:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of /search/batch against the same queries searched one by one")
+    parser.add_argument("--size", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="also time a running API end to end, including CLIP text encoding")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    args = parser.parse_args()
+
+    scoring_benchmark(args)
+    if args.url:
+        api_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
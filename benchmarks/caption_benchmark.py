@@ -0,0 +1,78 @@
+import argparse
+import glob
+import os
+import sys
+import time
+import torch
+from PIL import Image
+from transformers import BlipProcessor, BlipForConditionalGeneration
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.decoding import decoding_config
+
+BLIP_MODEL = os.getenv("BLIP_MODEL", "Salesforce/blip-image-captioning-base")
+
+
+def load_images(pattern):
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise SystemExit(f"No images match {pattern}")
+    return [Image.open(path).convert('RGB') for path in paths]
+
+
+def captions_per_second(model, processor, images, batch_size, runs, **generate_kwargs):
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    inputs = [processor(images=batch, return_tensors="pt") for batch in batches]
+    captions = []
+    with torch.no_grad():
+        model.generate(**inputs[0], **generate_kwargs)
+        start = time.perf_counter()
+        for _ in range(runs):
+            captions = []
+            for batch in inputs:
+                captions += processor.batch_decode(model.generate(**batch, **generate_kwargs), skip_special_tokens=True)
+    return runs * len(images) / (time.perf_counter() - start), captions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BLIP captions per second for each decoding strategy")
+    parser.add_argument("--images", default=os.path.join(os.path.dirname(__file__), '..', 'sample_data', '*.jpg'))
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--num-beams", type=int, default=5)
+    parser.add_argument("--length-penalty", type=float, default=1.5)
+    parser.add_argument("--max-length", type=int, default=50)
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    processor = BlipProcessor.from_pretrained(BLIP_MODEL)
+    model = BlipForConditionalGeneration.from_pretrained(BLIP_MODEL).eval()
+    configs = [
+        ("greedy", decoding_config("greedy", max_length=args.max_length), True),
+        ("greedy, no KV cache", decoding_config("greedy", max_length=args.max_length), False),
+        (f"beam ({args.num_beams})", decoding_config("beam", args.num_beams, max_length=args.max_length), True),
+        (f"beam ({args.num_beams}), length_penalty={args.length_penalty}",
+         decoding_config("length_penalty", args.num_beams, args.length_penalty, args.max_length), True),
+    ]
+
+    print(f"{len(images)} images, batch size {args.batch_size}, {torch.get_num_threads()} threads")
+    results = {}
+    for name, config, use_cache in configs:
+        rate, captions = captions_per_second(model, processor, images, args.batch_size, args.runs, use_cache=use_cache, **config)
+        results[name] = captions
+        mean_words = sum(len(caption.split()) for caption in captions) / len(captions)
+        print(f"{name:<40} {rate:>8.2f} captions/s   {mean_words:.1f} words/caption")
+
+    baseline = results["greedy"]
+    assert results["greedy, no KV cache"] == baseline, "greedy captions differ with and without the KV cache"
+    for name, captions in results.items():
+        if name.startswith("beam"):
+            changed = sum(a != b for a, b in zip(baseline, captions))
+            print(f"{name}: {changed}/{len(captions)} captions differ from greedy")
+            for original, other in list(zip(baseline, captions))[:3]:
+                print(f"  greedy: {original!r}\n  {name}: {other!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from ann_benchmark import synthetic_embeddings, recall
+from utils.embedding_index import EmbeddingIndex
+from utils.embedding_store import EmbeddingStore
+from utils.ann_index import IVFPQIndex
+
+
+def store_index(vectors, path, dtype):
+    store = EmbeddingStore(path, dtype)
+    for start in range(0, vectors.shape[0], 65536):
+        stop = min(start + 65536, vectors.shape[0])
+        store.append(list(range(start, stop)), vectors[start:stop])
+    index = EmbeddingIndex()
+    index.attach_store(store, ((i, f"{i}.jpg", "") for i in range(vectors.shape[0])))
+    return index
+
+
+def run_queries(index, queries, k, **params):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append([image_id for _, image_id, _, _ in index.search(query, k=k, **params)])
+    return results, len(queries) / (time.perf_counter() - start)
+
+
+def report(label, bytes_per_vector, results, qps, truth, k):
+    print(f"{label:<36} {bytes_per_vector:>6} B/vector  {qps:>8.1f} QPS  recall@{k}={recall(results, truth, k):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per vector, QPS and recall of IVF-PQ search against exact search")
+    parser.add_argument("--size", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--m", type=int, nargs="+", default=[32, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = synthetic_embeddings(args.size + args.queries, args.dim, 1000, args.seed)
+    queries, vectors = vectors[:args.queries], vectors[args.queries:]
+    resident = EmbeddingIndex()
+    resident.load((i, f"{i}.jpg", "", vectors[i].tobytes()) for i in range(vectors.shape[0]))
+    truth, qps = run_queries(resident, queries, args.k, exact=True)
+    print(f"{args.size} vectors, dim {args.dim}, {args.queries} queries, nprobe={args.nprobe}")
+    report("exact float32 (resident)", 4 * args.dim, truth, qps, truth, args.k)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for dtype, bytes_per_vector in (("float16", 2 * args.dim + 12), ("int8", args.dim + 12)):
+            index = store_index(vectors, os.path.join(directory, f"bench.{dtype}.embeddings"), dtype)
+            results, qps = run_queries(index, queries, args.k, exact=True)
+            report(f"exact {dtype} (memmap)", bytes_per_vector, results, qps, truth, args.k)
+
+        # Re-ranking reads the float16 store from disk, as on a search node
+        index = store_index(vectors, os.path.join(directory, "rerank.float16.embeddings"), "float16")
+        for m in args.m:
+            for opq in (False, True):
+                ann = IVFPQIndex(nlist=args.nlist or None, nprobe=args.nprobe, m=m, opq=opq)
+                index.ann = None
+                start = time.perf_counter()
+                index.attach_ann(ann)
+                name = f"ivf{'-opq' if opq else ''}-pq m={m}"
+                print(f"{name} build: {time.perf_counter() - start:.1f}s, nlist={ann.nlist}")
+                for rerank in (0, 50, 200):
+                    results, qps = run_queries(index, queries, args.k, rerank=rerank)
+                    report(f"{name} rerank={rerank}", ann.bytes_per_vector, results, qps, truth, args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+import numpy as np
+import torch
+from PIL import Image
+from transformers import BlipProcessor, BlipForConditionalGeneration, CLIPProcessor, CLIPModel
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.precision import PRECISIONS, cpu_supports_bf16, apply_precision, cast_inputs
+
+BLIP_MODEL = os.getenv("BLIP_MODEL", "Salesforce/blip-image-captioning-base")
+CLIP_MODEL = os.getenv("CLIP_MODEL", "openai/clip-vit-base-patch32")
+
+
+def model_megabytes(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
+
+
+def load_images(pattern):
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise SystemExit(f"No images match {pattern}")
+    return [Image.open(path).convert('RGB') for path in paths]
+
+
+def timed(fn, runs):
+    fn()
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = fn()
+    return result, 1000 * (time.perf_counter() - start) / runs
+
+
+def run_mode(precision, images, runs):
+    blip_processor = BlipProcessor.from_pretrained(BLIP_MODEL)
+    blip_model = apply_precision(BlipForConditionalGeneration.from_pretrained(BLIP_MODEL).eval(), precision)
+    clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL)
+    clip_model = apply_precision(CLIPModel.from_pretrained(CLIP_MODEL).eval(), precision)
+
+    def caption():
+        inputs = cast_inputs(blip_processor(images=images, return_tensors="pt"), blip_model)
+        with torch.no_grad():
+            out = blip_model.generate(**inputs, max_length=50, num_beams=5)
+        return blip_processor.batch_decode(out, skip_special_tokens=True)
+
+    def embed():
+        inputs = cast_inputs(clip_processor(images=images, return_tensors="pt"), clip_model)
+        with torch.no_grad():
+            features = clip_model.get_image_features(**inputs)
+        return features.float().numpy()
+
+    captions, caption_ms = timed(caption, runs)
+    embeddings, embed_ms = timed(embed, runs)
+    return {
+        "captions": captions,
+        "embeddings": embeddings,
+        "caption_ms_per_image": caption_ms / len(images),
+        "embed_ms_per_image": embed_ms / len(images),
+        "blip_mb": model_megabytes(blip_model),
+        "clip_mb": model_megabytes(clip_model),
+    }
+
+
+def cosine(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency, memory and output drift of each inference precision mode")
+    parser.add_argument("--images", default=os.path.join(os.path.dirname(__file__), '..', 'sample_data', '*.jpg'))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    images = load_images(args.images)
+    modes = [mode for mode in PRECISIONS if mode != "bf16" or cpu_supports_bf16()]
+    results = {mode: run_mode(mode, images, args.runs) for mode in modes}
+    baseline = results["fp32"]
+
+    print(f"{len(images)} images, {args.runs} runs, {torch.get_num_threads()} threads")
+    print(f"{'mode':<6} {'caption ms/img':>15} {'embed ms/img':>13} {'BLIP MB':>8} {'CLIP MB':>8} "
+          f"{'same caption':>13} {'min cos':>8} {'mean cos':>9}")
+    for mode, result in results.items():
+        same = np.mean([a == b for a, b in zip(result["captions"], baseline["captions"])])
+        similarity = cosine(result["embeddings"], baseline["embeddings"])
+        print(f"{mode:<6} {result['caption_ms_per_image']:>15.1f} {result['embed_ms_per_image']:>13.1f} "
+              f"{result['blip_mb']:>8.0f} {result['clip_mb']:>8.0f} {same:>13.0%} "
+              f"{similarity.min():>8.4f} {similarity.mean():>9.4f}")
+    for mode, result in results.items():
+        if mode != "fp32":
+            for original, changed in zip(baseline["captions"], result["captions"]):
+                if original != changed:
+                    print(f"  {mode}: '{original}' -> '{changed}'")
+
+
+if __name__ == "__main__":
+    main()
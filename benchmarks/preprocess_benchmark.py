@@ -0,0 +1,96 @@
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from utils.preprocessing import load_image, pixel_values
+
+BLIP_MODEL = os.getenv("BLIP_MODEL", "Salesforce/blip-image-captioning-base")
+CLIP_MODEL = os.getenv("CLIP_MODEL", "openai/clip-vit-base-patch32")
+
+
+def synthetic_photo(width, height):
+    """A noisy gradient JPEG about the size of a phone camera photo."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=2) + rng.normal(0, 20, (height, width, 3))
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def run_mode(mode, image_data, runs):
+    """Per-upload latency and peak RSS growth for one preprocessing path, in this process."""
+    from transformers import BlipImageProcessor, CLIPImageProcessor
+    blip_processor = BlipImageProcessor.from_pretrained(BLIP_MODEL)
+    clip_processor = CLIPImageProcessor.from_pretrained(CLIP_MODEL)
+
+    def full_decode():
+        image = Image.open(io.BytesIO(image_data)).convert('RGB')
+        return (blip_processor(images=[image], return_tensors="np")["pixel_values"],
+                clip_processor(images=[image], return_tensors="np")["pixel_values"])
+
+    def shared():
+        image = load_image(image_data, min_side=384)
+        return pixel_values([image], blip_processor), pixel_values([image], clip_processor)
+
+    fn = full_decode if mode == "full" else shared
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    fn()
+    start = time.perf_counter()
+    for _ in range(runs):
+        blip_pixels, clip_pixels = fn()
+    latency_ms = 1000 * (time.perf_counter() - start) / runs
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"latency_ms": latency_ms, "peak_mb": (peak_kb - baseline_kb) / 1024,
+            "blip": blip_pixels[:, :, ::4, ::4].tolist(), "clip": clip_pixels[:, :, ::4, ::4].tolist()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and peak memory of upload preprocessing, full decode vs shared draft() decode")
+    parser.add_argument("--image", help="JPEG to use instead of a synthetic photo")
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--mode", choices=["full", "shared"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            image_data = f.read()
+    else:
+        image_data = synthetic_photo(args.width, args.height)
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, image_data, args.runs)))
+        return
+
+    # Each path runs in a fresh process so its peak RSS is not hidden by the other's
+    results = {}
+    for mode in ("full", "shared"):
+        command = [sys.executable, __file__, "--mode", mode, "--runs", str(args.runs),
+                   "--width", str(args.width), "--height", str(args.height)]
+        if args.image:
+            command += ["--image", args.image]
+        results[mode] = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+
+    width, height = Image.open(io.BytesIO(image_data)).size
+    print(f"{width}x{height} JPEG, {len(image_data) / 2 ** 20:.1f} MB, {args.runs} runs")
+    for mode, result in results.items():
+        print(f"{mode:<7} {result['latency_ms']:>8.1f} ms/upload   peak +{result['peak_mb']:.0f} MB")
+    blip_diff = np.abs(np.array(results["full"]["blip"]) - np.array(results["shared"]["blip"])).mean()
+    clip_diff = np.abs(np.array(results["full"]["clip"]) - np.array(results["shared"]["clip"])).mean()
+    print(f"mean abs pixel difference (normalized units): BLIP {blip_diff:.4f}, CLIP {clip_diff:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'src', 'models', 'onnx')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the CLIP and BLIP models to ONNX for INFERENCE_BACKEND=onnx")
+    parser.add_argument("--blip-model", default=os.getenv("BLIP_MODEL", "Salesforce/blip-image-captioning-base"))
+    parser.add_argument("--clip-model", default=os.getenv("CLIP_MODEL", "openai/clip-vit-base-patch32"))
+    parser.add_argument("--output-dir", default=os.getenv("ONNX_MODEL_DIR", DEFAULT_OUTPUT_DIR))
+    args = parser.parse_args()
+
+    try:
+        from transformers import BlipForConditionalGeneration, CLIPModel
+        from utils.onnx_export import export_blip, export_clip
+    except ImportError as e:
+        print(f"Export needs torch, transformers and onnx: {e}")
+        return 1
+
+    print(f"Exporting {args.clip_model}...")
+    clip_model = CLIPModel.from_pretrained(args.clip_model).eval()
+    paths = export_clip(clip_model, args.output_dir, image_size=clip_model.config.vision_config.image_size)
+    print(f"Exporting {args.blip_model}...")
+    blip_model = BlipForConditionalGeneration.from_pretrained(args.blip_model).eval()
+    paths += export_blip(blip_model, args.output_dir, image_size=blip_model.config.vision_config.image_size)
+    for path in paths:
+        print(f"  {path} ({os.path.getsize(path) / 2 ** 20:.0f} MB)")
+    print(f"Set INFERENCE_BACKEND=onnx and ONNX_MODEL_DIR={args.output_dir} to use them")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
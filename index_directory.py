@@ -0,0 +1,202 @@
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+from utils.dedup import content_hash as compute_content_hash, dhash
+from utils.preprocessing import load_image, image_metadata
+from utils.thumbnails import generate_thumbnails
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff'}
+
+
+def find_images(root):
+    """Image paths under root relative to it, in a stable sorted order so checkpoints stay valid."""
+    paths = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.relpath(os.path.join(directory, name), root))
+    return paths
+
+
+def upload_filename(relative_path):
+    return relative_path.replace(os.sep, "_")
+
+
+# Content hashes already in the database, handed to each worker process once by init_worker
+indexed_hashes = set()
+
+
+def init_worker(hashes):
+    global indexed_hashes
+    indexed_hashes = hashes
+
+
+def prepare_image(task):
+    """Runs in a worker process: read and hash, then for new images decode at model size and write
+    thumbnails and the original copy. Images already in the database return image None and cost one read."""
+    root, relative_path, min_side, perceptual, upload_dir = task
+    try:
+        with open(os.path.join(root, relative_path), "rb") as f:
+            image_data = f.read()
+        content_hash = compute_content_hash(image_data)
+        if content_hash in indexed_hashes:
+            return relative_path, content_hash, None, None, None, None
+        image = load_image(image_data, min_side)
+        if upload_dir:
+            destination = os.path.join(upload_dir, upload_filename(relative_path))
+            if not os.path.exists(destination):
+                shutil.copyfile(os.path.join(root, relative_path), destination)
+        generate_thumbnails(image_data, content_hash)
+        return relative_path, content_hash, dhash(image) if perceptual else None, image_metadata(image_data), image, None
+    except Exception as e:
+        return relative_path, None, None, None, None, str(e)
+
+
+def ordered_results(pool, function, tasks, window):
+    """pool.imap(function, tasks) that keeps at most window tasks submitted but not yet consumed.
+
+    imap feeds every task to the workers at once, so with a slow consumer the decoded images pile up in
+    this process; here a new task is only submitted when a result is taken.
+    """
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def load_checkpoint(path, root):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("root") != root:
+        print(f"Checkpoint {path} is for {checkpoint.get('root')}, starting from the beginning")
+        return 0
+    return checkpoint["done"]
+
+
+def save_checkpoint(path, root, done, total):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"root": root, "done": done, "total": total, "updated_at": time.time()}, f)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caption, embed and index every image under a directory")
+    parser.add_argument("directory")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="decode processes")
+    parser.add_argument("--batch-size", type=int, default=32, help="images per BLIP/CLIP forward pass")
+    parser.add_argument("--commit-every", type=int, default=1000, help="rows per database transaction")
+    parser.add_argument("--prefetch", type=int, help="images decoded ahead of inference (default 2 x batch size)")
+    parser.add_argument("--tier", default="fast", help="caption tier (fast or quality)")
+    parser.add_argument("--checkpoint", default="index_checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--no-copy", action="store_true", help="do not copy originals into UPLOAD_DIR")
+    parser.add_argument("--uploader", help="username recorded as the uploader of every indexed image")
+    parser.add_argument("--progress-every", type=float, default=10.0, help="seconds between progress lines (0 = every file)")
+    args = parser.parse_args()
+
+    # Importing main loads the model configuration and initializes the database
+    import main as app
+
+    if args.tier not in app.CAPTION_TIERS:
+        print(f"--tier must be one of: {', '.join(app.CAPTION_TIERS)}")
+        return 1
+    if not app.load_models():
+        print(f"Could not load models: {app.model_status['error']}")
+        return 1
+
+    root = os.path.abspath(args.directory)
+    paths = find_images(root)
+    start = 0 if args.restart else load_checkpoint(args.checkpoint, root)
+    with app.read_connection() as conn:
+        indexed = {row[0] for row in conn.execute("SELECT content_hash FROM images WHERE content_hash IS NOT NULL")}
+    upload_dir = None if args.no_copy else app.UPLOAD_DIR
+    if upload_dir:
+        os.makedirs(upload_dir, exist_ok=True)
+    print(f"{len(paths)} images under {root}, resuming at {start}, {len(indexed)} already in the database")
+
+    prefetch = args.prefetch or 2 * args.batch_size
+    counts = {"indexed": 0, "skipped": 0, "failed": 0}
+    batch, rows = [], []
+    done = start
+    started = time.perf_counter()
+    last_report = started
+
+    def run_batch():
+        images = [image for _, _, _, _, image in batch]
+        captions = app.generate_captions(images, args.tier)
+        embeddings = app.generate_embeddings(images)
+        for (relative_path, content_hash, perceptual_hash, metadata, _), caption, embedding in zip(batch, captions, embeddings):
+            if caption.startswith("Error") or not embedding:
+                # Not inserted, so the content hash stays unknown and a later run retries the file
+                counts["failed"] += 1
+                indexed.discard(content_hash)
+                print(f"Skipping {relative_path}: {caption if caption.startswith('Error') else 'Error generating embedding'}")
+                continue
+            rows.append((upload_filename(relative_path), caption, embedding, content_hash, perceptual_hash, args.uploader, *metadata))
+        batch.clear()
+
+    def commit():
+        if batch:
+            run_batch()
+        if rows:
+            if app.insert_images(rows) is None:
+                raise RuntimeError("Database insert failed, stopping; rerun to resume from the last checkpoint")
+            counts["indexed"] += len(rows)
+            rows.clear()
+        save_checkpoint(args.checkpoint, root, done, len(paths))
+        report("committed")
+
+    def report(state):
+        """One progress line; state is "committed" after a checkpoint, else how many rows await the next commit."""
+        nonlocal last_report
+        last_report = time.perf_counter()
+        elapsed = last_report - started
+        rate = (done - start) / elapsed if elapsed else 0.0
+        eta = (len(paths) - done) / rate if rate else 0.0
+        print(f"{done}/{len(paths)} files  {counts['indexed']} indexed  {counts['skipped']} skipped  "
+              f"{counts['failed']} failed  {rate:.1f} files/s  ETA {eta / 60:.1f} min  ({state})", flush=True)
+
+    tasks = ((root, path, app.PREPROCESS_MIN_SIDE, app.DEDUP_MODE == "dhash", upload_dir) for path in paths[start:])
+    # spawn keeps the decode workers free of the parent's torch threads and loaded models
+    with multiprocessing.get_context("spawn").Pool(args.workers, initializer=init_worker, initargs=(indexed,)) as pool:
+        for relative_path, content_hash, perceptual_hash, metadata, image, error in ordered_results(pool, prepare_image, tasks, prefetch):
+            done += 1
+            if error is not None:
+                counts["failed"] += 1
+                print(f"Skipping {relative_path}: {error}")
+            elif image is None or content_hash in indexed:
+                counts["skipped"] += 1
+            else:
+                indexed.add(content_hash)
+                batch.append((relative_path, content_hash, perceptual_hash, metadata, image))
+                if len(batch) >= args.batch_size:
+                    run_batch()
+            if len(rows) + len(batch) >= args.commit_every:
+                commit()
+            elif time.perf_counter() - last_report >= args.progress_every:
+                # Reported per file, so a large --commit-every does not look like a hang
+                report(f"{len(rows) + len(batch)} pending commit")
+    commit()
+    if counts["failed"]:
+        print(f"{counts['failed']} files failed; rerun with --restart to retry them (indexed files are skipped by hash)")
+    print(f"Done in {(time.perf_counter() - started) / 60:.1f} min; restart the API to load the new images into the search index")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+import argparse
+import os
+import sqlite3
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+from utils.database import DB_PATH
+from utils.embedding_store import STORE_DTYPES, EmbeddingStore, default_store_path, migrate_sqlite_embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move float32 embedding BLOBs out of images.db into the sidecar embedding store")
+    parser.add_argument("--dtype", choices=list(STORE_DTYPES), default=os.getenv("EMBEDDING_STORE") if os.getenv("EMBEDDING_STORE") in STORE_DTYPES else "float16")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--store", help="store file (default: EMBEDDING_STORE_PATH or next to the database)")
+    parser.add_argument("--keep-blobs", action="store_true", help="copy only; leave the BLOBs in the database")
+    parser.add_argument("--no-vacuum", action="store_true", help="do not VACUUM after clearing the BLOBs")
+    parser.add_argument("--compact", action="store_true",
+                        help="drop store rows with no images row (from failed transactions) and superseded duplicates")
+    args = parser.parse_args()
+
+    path = args.store or os.getenv("EMBEDDING_STORE_PATH") or default_store_path(args.db, args.dtype)
+    size_before = os.path.getsize(args.db)
+    store = EmbeddingStore(path, args.dtype)
+    # VACUUM needs the database to itself, so run this with the API stopped
+    copied, cleared = migrate_sqlite_embeddings(store, args.db, clear=not args.keep_blobs, vacuum=not args.no_vacuum)
+    print(f"Copied {copied} embeddings into {path} ({len(store)} rows, {store.dtype}, dim {store.dim})")
+    if args.compact:
+        # Rows of uncommitted transactions look orphaned too, so no indexer may be running
+        conn = sqlite3.connect(args.db)
+        try:
+            valid_ids = [row[0] for row in conn.execute("SELECT id FROM images")]
+        finally:
+            conn.close()
+        print(f"Compacted the store: dropped {store.compact(valid_ids)} orphaned or superseded rows")
+    if not args.keep_blobs:
+        print(f"Cleared {cleared} BLOBs; {args.db} went from {size_before / 2 ** 20:.1f} MB "
+              f"to {os.path.getsize(args.db) / 2 ** 20:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
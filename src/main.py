@@ -1,21 +1,122 @@
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Body, File, UploadFile, Depends, HTTPException, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from uvicorn import run
-from utils.database import initialize_db, connection
+from utils.database import initialize_db, read_connection, write, write_queue, DB_PATH
+from utils.embedding_index import EmbeddingIndex, normalize
+from utils.embedding_store import EmbeddingStore, default_store_path, migrate_sqlite_embeddings
+from utils.ann_index import create_ann_index
+from utils.batching import BatchScheduler
+from utils.decoding import decoding_config, check_kv_cache
+from utils.inference import InferencePool, InferenceQueueFull, torch_threads_per_worker
+from utils.cache import LRUCache
+from utils.thumbnails import THUMBNAIL_SIZES, thumbnail_path, generate_thumbnails, schedule_thumbnails
+from utils.preprocessing import load_image, pixel_values, image_metadata
+from utils.filters import metadata_filter, utc_timestamp
+from utils.jobs import JobQueue, webhook_allowed
+from utils.text_search import keyword_search
+from utils.fusion import FUSION_METHODS, fuse
+from utils.dedup import content_hash as compute_content_hash, dhash, PerceptualHashIndex, DedupStats
+from utils.logs import configure_logging
+from utils.metrics import stage_timer, count_error, register_cache, register_queue, render as render_metrics
 from auth import authenticate_user, create_access_token, get_current_user, User
 from PIL import Image
+from typing import List, Optional
+import asyncio
 import io
+import json
+import logging
 import numpy as np
 import os
 import hashlib
+import threading
+import time
+import uuid
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 
 USE_ML_MODELS = True
 
+configure_logging()
+logger = logging.getLogger("image_api")
+
+UPLOAD_DIR = "data/raw"
+
+ANN_BACKEND = os.getenv("ANN_BACKEND", "exact")
+ANN_MIN_SIZE = int(os.getenv("ANN_MIN_SIZE", "10000"))
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0")) or None
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_EF_SEARCH = int(os.getenv("ANN_EF_SEARCH", "64"))
+ANN_RETRAIN_GROWTH = float(os.getenv("ANN_RETRAIN_GROWTH", "4"))
+ANN_PQ_M = int(os.getenv("ANN_PQ_M", "64"))
+ANN_PQ_RERANK = int(os.getenv("ANN_PQ_RERANK", "100"))
+ANN_PQ_OPQ = os.getenv("ANN_PQ_OPQ", "true").lower() == "true"
+SEARCH_FUSION = os.getenv("SEARCH_FUSION", "rrf").lower()
+SEARCH_VECTOR_WEIGHT = float(os.getenv("SEARCH_VECTOR_WEIGHT", "0.5"))
+SEARCH_VECTOR_CANDIDATES = int(os.getenv("SEARCH_VECTOR_CANDIDATES", "50"))
+SEARCH_KEYWORD_CANDIDATES = int(os.getenv("SEARCH_KEYWORD_CANDIDATES", "50"))
+SEARCH_RRF_K = int(os.getenv("SEARCH_RRF_K", "60"))
+SEARCH_MAX_K = int(os.getenv("SEARCH_MAX_K", "100"))
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "256"))
+SEARCH_FILTER_MAX_IDS = int(os.getenv("SEARCH_FILTER_MAX_IDS", "50000"))
+SEARCH_FILTER_OVERFETCH = int(os.getenv("SEARCH_FILTER_OVERFETCH", "10"))
+BLIP_MODEL = os.getenv("BLIP_MODEL", "Salesforce/blip-image-captioning-base")
+CLIP_MODEL = os.getenv("CLIP_MODEL", "openai/clip-vit-base-patch32")
+TEXT_CACHE_SIZE = int(os.getenv("TEXT_CACHE_SIZE", "4096"))
+TEXT_CACHE_TTL = int(os.getenv("TEXT_CACHE_TTL", "0")) or None
+TEXT_CACHE_PREWARM_FILE = os.getenv("TEXT_CACHE_PREWARM_FILE", "")
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "500"))
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "true").lower() == "true"
+DEDUP_MODE = os.getenv("DEDUP_MODE", "sha256").lower()
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "4"))
+PREPROCESS_MIN_SIDE = int(os.getenv("PREPROCESS_MIN_SIDE", "384"))
+UPLOAD_MODE = os.getenv("UPLOAD_MODE", "sync").lower()
+UPLOAD_BATCH_MAX_FILES = int(os.getenv("UPLOAD_BATCH_MAX_FILES", "64"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", "data/jobs")
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+JOB_WEBHOOK_TIMEOUT = float(os.getenv("JOB_WEBHOOK_TIMEOUT", "5"))
+JOB_WEBHOOK_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()]
+CAPTION_MAX_BATCH_SIZE = int(os.getenv("CAPTION_MAX_BATCH_SIZE", "8"))
+CAPTION_MAX_WAIT_MS = int(os.getenv("CAPTION_MAX_WAIT_MS", "20"))
+CAPTION_MAX_LENGTH = int(os.getenv("CAPTION_MAX_LENGTH", "50"))
+CAPTION_NUM_BEAMS = int(os.getenv("CAPTION_NUM_BEAMS", "5"))
+CAPTION_LENGTH_PENALTY = float(os.getenv("CAPTION_LENGTH_PENALTY", "1.0"))
+CAPTION_TIERS = {
+    "fast": decoding_config(os.getenv("CAPTION_FAST_DECODING", "greedy"), CAPTION_NUM_BEAMS, CAPTION_LENGTH_PENALTY, CAPTION_MAX_LENGTH),
+    "quality": decoding_config(os.getenv("CAPTION_QUALITY_DECODING", "beam"), CAPTION_NUM_BEAMS, CAPTION_LENGTH_PENALTY, CAPTION_MAX_LENGTH),
+}
+CAPTION_DEFAULT_TIER = os.getenv("CAPTION_DEFAULT_TIER", "fast")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "32"))
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "1"))
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0")) or torch_threads_per_worker(INFERENCE_WORKERS)
+ANN_INDEX_PATH = os.path.splitext(DB_PATH)[0] + f".{ANN_BACKEND.lower()}.index"
+EMBEDDING_STORE = os.getenv("EMBEDDING_STORE", "sqlite").lower()
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", default_store_path(DB_PATH, EMBEDDING_STORE))
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join(os.path.dirname(DB_PATH), "models", "onnx"))
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0")) or TORCH_NUM_THREADS
+ONNX_INTER_OP_THREADS = int(os.getenv("ONNX_INTER_OP_THREADS", "1"))
+
 if USE_ML_MODELS:
-    from transformers import BlipProcessor, BlipForConditionalGeneration, CLIPProcessor, CLIPModel
-    import torch
+    from transformers import BlipProcessor, CLIPProcessor
+    if INFERENCE_BACKEND == "onnx":
+        # Only the processors come from transformers here, so PyTorch is never imported
+        from utils.onnx_backend import OnnxBlip, OnnxClip
+        INFERENCE_PRECISION = None
+    else:
+        from transformers import BlipForConditionalGeneration, CLIPModel
+        import torch
+        from utils.precision import resolve_precision, apply_precision, cast_inputs
+        torch.set_num_threads(TORCH_NUM_THREADS)
+        INFERENCE_PRECISION = resolve_precision(os.getenv("INFERENCE_PRECISION", "fp32"))
 
 app = FastAPI()
 
@@ -37,101 +138,572 @@ app.add_middleware(
 
 initialize_db()
 
+embedding_index = EmbeddingIndex()
+# With EMBEDDING_STORE=float16/int8 embeddings go to the memory-mapped sidecar store instead of BLOBs
+embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH, EMBEDDING_STORE) if USE_ML_MODELS and EMBEDDING_STORE != "sqlite" else None
+perceptual_index = PerceptualHashIndex()
+dedup_stats = DedupStats()
+text_embedding_cache = LRUCache(TEXT_CACHE_SIZE, TEXT_CACHE_TTL)
+
 blip_processor = None
 blip_model = None
 clip_processor = None
 clip_model = None
 models_loaded = False
+models_ready = False
+loaded_clip_model = None
+models_lock = threading.Lock()
+model_status = {
+    "backend": INFERENCE_BACKEND if USE_ML_MODELS else None,
+    "precision": INFERENCE_PRECISION if USE_ML_MODELS else None,
+    "blip": {"model": BLIP_MODEL, "loaded": False, "load_seconds": None, "warmup_seconds": None, "kv_cache": None},
+    "clip": {"model": CLIP_MODEL, "loaded": False, "load_seconds": None, "warmup_seconds": None},
+    "error": None,
+}
 
 def load_models():
-    global blip_processor, blip_model, clip_processor, clip_model, models_loaded    
     if not USE_ML_MODELS:
         return True    
+    if models_loaded:
+        return True
+    with models_lock:
+        return _load_models()
+
+def load_blip():
+    global blip_processor, blip_model
+    start = time.perf_counter()
+    logger.info("Loading BLIP model", extra={"model": BLIP_MODEL})
+    blip_processor = BlipProcessor.from_pretrained(BLIP_MODEL)
+    if INFERENCE_BACKEND == "onnx":
+        blip_model = OnnxBlip(ONNX_MODEL_DIR, ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS)
+    else:
+        blip_model = apply_precision(BlipForConditionalGeneration.from_pretrained(BLIP_MODEL).eval(), INFERENCE_PRECISION)
+    model_status["blip"].update(loaded=True, load_seconds=round(time.perf_counter() - start, 2))
+    logger.info("BLIP model loaded", extra={"seconds": model_status["blip"]["load_seconds"]})
+
+def load_clip():
+    global clip_processor, clip_model, loaded_clip_model
+    start = time.perf_counter()
+    logger.info("Loading CLIP model", extra={"model": CLIP_MODEL})
+    clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL)
+    if INFERENCE_BACKEND == "onnx":
+        clip_model = OnnxClip(ONNX_MODEL_DIR, ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS)
+    else:
+        clip_model = apply_precision(CLIPModel.from_pretrained(CLIP_MODEL).eval(), INFERENCE_PRECISION)
+    if loaded_clip_model != CLIP_MODEL:
+        text_embedding_cache.clear()
+        loaded_clip_model = CLIP_MODEL
+    model_status["clip"].update(loaded=True, load_seconds=round(time.perf_counter() - start, 2))
+    logger.info("CLIP model loaded", extra={"seconds": model_status["clip"]["load_seconds"]})
+
+def _load_models():
+    global models_loaded
     if models_loaded:
         return True
     try:
-        print("Loading BLIP model...")
-        blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-        blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-        
-        print("Loading CLIP model...")
-        clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-        clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-loader") as loader:
+            for future in [loader.submit(load_blip), loader.submit(load_clip)]:
+                future.result()
         
         models_loaded = True
-        print("All models loaded successfully!")
+        logger.info("All models loaded")
         return True
     except Exception as e:
-        print(f"Error loading models: {e}")
+        model_status["error"] = str(e)
+        count_error("model_load")
+        logger.exception("Error loading models")
         return False
 
-def generate_caption(image):
+def blip_generate(images, **generate_kwargs):
+    """BLIP output token ids for a batch of images on the configured backend."""
+    pixels = pixel_values(images, blip_processor.image_processor)
+    if INFERENCE_BACKEND == "onnx":
+        return blip_model.generate(pixels, **generate_kwargs)
+    inputs = cast_inputs({"pixel_values": torch.from_numpy(pixels)}, blip_model)
+    generate_kwargs.setdefault("use_cache", True)
+    with torch.no_grad():
+        return blip_model.generate(**inputs, **generate_kwargs)
+
+def clip_image_features(images):
+    """Unnormalized float32 CLIP image embeddings as a NumPy array."""
+    pixels = pixel_values(images, clip_processor.image_processor)
+    if INFERENCE_BACKEND == "onnx":
+        return clip_model.image_features(pixels)
+    inputs = cast_inputs({"pixel_values": torch.from_numpy(pixels)}, clip_model)
+    with torch.no_grad():
+        return clip_model.get_image_features(**inputs).float().cpu().numpy()
+
+def clip_text_features(texts):
+    """Unnormalized float32 CLIP text embeddings as a NumPy array."""
+    if INFERENCE_BACKEND == "onnx":
+        inputs = clip_processor(text=texts, return_tensors="np", padding=True)
+        return clip_model.text_features(inputs["input_ids"], inputs["attention_mask"])
+    inputs = clip_processor(text=texts, return_tensors="pt", padding=True)
+    with torch.no_grad():
+        return clip_model.get_text_features(**inputs).float().cpu().numpy()
+
+def warm_up_blip():
+    start = time.perf_counter()
+    blip_generate([Image.new('RGB', (384, 384))], max_length=5)
+    model_status["blip"]["warmup_seconds"] = round(time.perf_counter() - start, 2)
+    if INFERENCE_BACKEND != "onnx":
+        verify_kv_cache()
+
+def verify_kv_cache():
+    """Check that cached decoding reproduces uncached decoding, so each step only runs the newest token."""
+    image = Image.new('RGB', (384, 384), color=(120, 160, 200))
+    result = check_kv_cache(lambda **kwargs: blip_generate([image], **kwargs).tolist())
+    model_status["blip"]["kv_cache"] = result
+    if not result["matches"]:
+        logger.warning("BLIP output differs with and without the KV cache", extra={"kv_cache": result})
+
+def warm_up_clip():
+    start = time.perf_counter()
+    clip_image_features([Image.new('RGB', (224, 224))])
+    clip_text_features(["warm up"])
+    model_status["clip"]["warmup_seconds"] = round(time.perf_counter() - start, 2)
+
+def prepare_models():
+    """Load both models concurrently, run a dummy forward pass through each, then mark the service ready.
+
+    Load and warm-up errors are recorded in model_status for /readyz; the service only becomes ready
+    once the models have actually loaded.
+    """
+    global models_ready
+    if not load_models():
+        return False
+    try:
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-warmup") as warmer:
+            for future in [warmer.submit(warm_up_blip), warmer.submit(warm_up_clip)]:
+                future.result()
+    except Exception as e:
+        model_status["error"] = f"Warm-up failed: {e}"
+        logger.exception("Model warm-up failed")
+    models_ready = models_loaded
+    logger.info("Models ready", extra={"models": model_status})
+    prewarm_text_cache()
+    return True
+
+def generate_captions(images, tier=CAPTION_DEFAULT_TIER):
     if USE_ML_MODELS:
         try:
             if not load_models():
-                return "Error: Models not loaded"
+                return ["Error: Models not loaded"] * len(images)
             
-            inputs = blip_processor(image, return_tensors="pt")
-            out = blip_model.generate(**inputs, max_length=50, num_beams=5)
-            caption = blip_processor.decode(out[0], skip_special_tokens=True)
-            return caption
+            with stage_timer("caption"):
+                out = blip_generate(images, **CAPTION_TIERS[tier])
+                return blip_processor.batch_decode(out, skip_special_tokens=True)
         except Exception as e:
-            return f"Error generating caption: {str(e)}"
+            count_error("caption")
+            logger.exception("Error generating captions", extra={"images": len(images)})
+            return [f"Error generating caption: {str(e)}"] * len(images)
     else:
-        width, height = image.size
-        return f"An image with dimensions {width}x{height} pixels"
+        return [f"An image with dimensions {width}x{height} pixels" for width, height in (image.size for image in images)]
 
-def generate_embedding(image):
+def generate_caption(image):
+    return generate_captions([image])[0]
+
+inference_pool = InferencePool(INFERENCE_WORKERS, INFERENCE_MAX_PENDING, INFERENCE_RETRY_AFTER)
+
+caption_batchers = {
+    tier: BatchScheduler(partial(generate_captions, tier=tier), CAPTION_MAX_BATCH_SIZE, CAPTION_MAX_WAIT_MS, inference_pool.executor)
+    for tier in CAPTION_TIERS
+}
+
+async def caption_image(image, tier=CAPTION_DEFAULT_TIER):
+    return await caption_batchers[tier].submit(image)
+
+def generate_embeddings(images):
     if USE_ML_MODELS:
         try:
             if not load_models():
-                return b""            
-            inputs = clip_processor(images=image, return_tensors="pt")
-            with torch.no_grad():
-                image_features = clip_model.get_image_features(**inputs)
-            embedding = image_features.cpu().numpy().tobytes()
-            return embedding
-        except Exception as e:
-            print(f"Error generating embedding: {e}")
-            return b""
+                return [b""] * len(images)
+            with stage_timer("embed"):
+                return [row.tobytes() for row in clip_image_features(images)]
+        except Exception:
+            count_error("embed")
+            logger.exception("Error generating embeddings", extra={"images": len(images)})
+            return [b""] * len(images)
     else:
-        img_bytes = io.BytesIO()
-        image.save(img_bytes, format='JPEG')
-        img_data = img_bytes.getvalue()
-        hash_obj = hashlib.md5(img_data)
-        return hash_obj.digest()
+        embeddings = []
+        for image in images:
+            img_bytes = io.BytesIO()
+            image.save(img_bytes, format='JPEG')
+            img_data = img_bytes.getvalue()
+            hash_obj = hashlib.md5(img_data)
+            embeddings.append(hash_obj.digest())
+        return embeddings
+
+def generate_embedding(image):
+    return generate_embeddings([image])[0]
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
 
-def insert_image(filename, caption, embedding):
+def text_cache_key(query):
+    return (CLIP_MODEL, normalize_query(query))
+
+def encode_texts(queries):
+    """L2-normalized CLIP text embeddings for a batch of queries, filling the text cache."""
+    normalized = [normalize_query(query) for query in queries]
+    with stage_timer("text_encode"):
+        embeddings = normalize(clip_text_features(normalized))
+    for query, embedding in zip(normalized, embeddings):
+        text_embedding_cache.put((CLIP_MODEL, query), embedding)
+    return embeddings
+
+def prewarm_text_cache():
+    if not TEXT_CACHE_PREWARM_FILE or not os.path.exists(TEXT_CACHE_PREWARM_FILE):
+        return
+    with open(TEXT_CACHE_PREWARM_FILE, encoding="utf-8") as f:
+        queries = list(dict.fromkeys(line.strip() for line in f if line.strip()))[:TEXT_CACHE_SIZE]
+    if not queries or not load_models():
+        return
+    for start in range(0, len(queries), 64):
+        encode_texts(queries[start:start + 64])
+    logger.info("Pre-warmed text embedding cache", extra={"queries": len(queries)})
+
+def decode_image(image_data):
+    """Decode once at the smallest size both models need; BLIP and CLIP inputs are both cut from this buffer."""
+    with stage_timer("decode"):
+        return load_image(image_data, PREPROCESS_MIN_SIDE if USE_ML_MODELS else None)
+
+def inspect_upload(image_data):
+    """(content_hash, (width, height, mime_type)) of an upload; both read the whole upload, so run it in the threadpool."""
+    return compute_content_hash(image_data), image_metadata(image_data)
+
+def save_upload(filename, image_data):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    
+    file_location = f"{UPLOAD_DIR}/{filename}"
+    with open(file_location, "wb") as f:
+        f.write(image_data)
+
+async def store_upload(filename, image_data, content_hash):
+    await run_in_threadpool(save_upload, filename, image_data)
+    schedule_thumbnails(image_data, content_hash)
+
+def insert_image(filename, caption, embedding, content_hash=None, perceptual_hash=None, uploader=None, metadata=(None, None, None)):
+    image_ids = insert_images([(filename, caption, embedding, content_hash, perceptual_hash, uploader, *metadata)])
+    return image_ids[0] if image_ids else None
+
+def insert_images(rows):
+    """Insert rows in a single transaction and return their ids.
+
+    Rows are (filename, caption, embedding, content_hash, perceptual_hash, uploader, width, height, mime_type).
+    """
+    def insert(conn):
+        uploaded_at = time.time()
+        image_ids = [
+            conn.execute("""
+                INSERT INTO images (filename, caption, embedding, content_hash, perceptual_hash,
+                                    uploader, uploaded_at, width, height, mime_type)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (filename, caption, embedding if embedding_store is None else b"", content_hash, perceptual_hash,
+                  uploader, uploaded_at, width, height, mime_type)).lastrowid
+            for filename, caption, embedding, content_hash, perceptual_hash, uploader, width, height, mime_type in rows
+        ]
+        if embedding_store is not None:
+            store_embeddings(image_ids, [row[2] for row in rows])
+        return image_ids
     try:
-        conn = connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO images (filename, caption, embedding)
-            VALUES (?, ?, ?)
-        """, (filename, caption, embedding))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"Database error: {e}")
-        return False
+        with stage_timer("db_insert"):
+            return write(insert)
+    except Exception:
+        count_error("database")
+        logger.exception("Database error inserting images", extra={"rows": len(rows)})
+        return None
+
+def store_embeddings(image_ids, embeddings):
+    """Append float32 embedding bytes to the sidecar store, skipping ones that do not fit it."""
+    ids, vectors = [], []
+    for image_id, embedding in zip(image_ids, embeddings):
+        if not embedding or len(embedding) % 4:
+            continue
+        vector = np.frombuffer(embedding, dtype=np.float32)
+        if embedding_store.dim is not None and vector.shape[0] != embedding_store.dim:
+            continue
+        ids.append(image_id)
+        vectors.append(vector)
+    if ids:
+        embedding_store.append(ids, np.stack(vectors))
 
-def fetch_images():
+def find_cached_result(content_hash=None, image_id=None):
+    """Caption, embedding and perceptual hash of a previous successful upload, or None."""
     try:
-        conn = connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM images")
-        rows = cursor.fetchall()
-        conn.close()
-        return rows
-    except Exception as e:
-        print(f"Database error: {e}")
+        column, value = ("content_hash", content_hash) if content_hash is not None else ("id", image_id)
+        with read_connection() as conn:
+            rows = conn.execute(f"""
+                SELECT id, caption, embedding, perceptual_hash FROM images
+                WHERE {column} = ? AND caption NOT LIKE 'Error%'
+                ORDER BY id
+            """, (value,)).fetchall()
+        for row_id, caption, embedding, perceptual_hash in rows:
+            if not embedding and embedding_store is not None and row_id in embedding_store:
+                embedding = embedding_store.get(row_id).tobytes()
+            if embedding:
+                return caption, embedding, perceptual_hash
+        return None
+    except Exception:
+        count_error("database")
+        logger.exception("Database error")
+        return None
+
+def find_near_duplicate(perceptual_hash):
+    image_id = perceptual_index.find(perceptual_hash, DEDUP_MAX_DISTANCE)
+    if image_id is None:
+        return None
+    return find_cached_result(image_id=image_id)
+
+def fetch_perceptual_hashes():
+    try:
+        with read_connection() as conn:
+            return conn.execute("SELECT id, perceptual_hash FROM images WHERE perceptual_hash IS NOT NULL").fetchall()
+    except Exception:
+        count_error("database")
+        logger.exception("Database error")
         return []
 
+def search_captions(query, limit=3, where="", params=()):
+    with stage_timer("keyword"), read_connection() as conn:
+        return keyword_search(conn, query, limit, where=where, params=params)
+
+def filtered_ids(where, params, limit):
+    """Ids of the images matching a metadata_filter() condition, answered from the metadata indexes.
+
+    None when more than limit images match, so a broad filter never pulls the whole catalog into memory.
+    """
+    with read_connection() as conn:
+        ids = np.fromiter(
+            (row[0] for row in conn.execute(f"SELECT id FROM images WHERE {where} LIMIT ?", (*params, limit + 1))),
+            dtype=np.int64
+        )
+    return ids if len(ids) <= limit else None
+
+def matching_ids(ids, where, params, chunk_size=500):
+    """The subset of ids whose images match a metadata_filter() condition."""
+    ids = list(dict.fromkeys(ids))
+    matched = set()
+    with read_connection() as conn:
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+            matched.update(row[0] for row in conn.execute(
+                f"SELECT id FROM images WHERE id IN ({', '.join('?' for _ in chunk)}) AND {where}", (*chunk, *params)
+            ))
+    return matched
+
+def filtered_search(search, queries, k, where, params, **search_params):
+    """search(queries, k=k, ...) restricted to the images matching a metadata_filter() condition.
+
+    A selective filter (at most SEARCH_FILTER_MAX_IDS matches) scores exactly those rows. A broader one
+    searches the whole index for SEARCH_FILTER_OVERFETCH times k candidates and keeps the matching ones,
+    so the work per request stays bounded; a query can then return fewer than k results.
+    """
+    ids = filtered_ids(where, params, SEARCH_FILTER_MAX_IDS)
+    if ids is not None:
+        with stage_timer("scoring"):
+            return search(queries, k=k, ids=ids, **search_params)
+    with stage_timer("scoring"):
+        candidates = search(queries, k=k * SEARCH_FILTER_OVERFETCH, **search_params)
+    allowed = matching_ids([match[1] for matches in candidates for match in matches], where, params)
+    return [[match for match in matches if match[1] in allowed][:k] for matches in candidates]
+
+def fetch_image_record(image_id):
+    try:
+        with read_connection() as conn:
+            return conn.execute("SELECT id, filename, content_hash FROM images WHERE id = ?", (image_id,)).fetchone()
+    except Exception:
+        count_error("database")
+        logger.exception("Database error")
+        return None
+
+def fetch_history_page(cursor=0, limit=50):
+    """Up to limit (id, filename, caption) rows with id > cursor, oldest first."""
+    try:
+        with read_connection() as conn:
+            return conn.execute(
+                "SELECT id, filename, caption FROM images WHERE id > ? ORDER BY id LIMIT ?",
+                (cursor, limit)
+            ).fetchall()
+    except Exception:
+        count_error("database")
+        logger.exception("Database error")
+        return []
+
+def fetch_embeddings():
+    try:
+        with read_connection() as conn:
+            return conn.execute("SELECT id, filename, caption, embedding FROM images ORDER BY id").fetchall()
+    except Exception:
+        count_error("database")
+        logger.exception("Database error")
+        return []
+
+def fetch_image_names():
+    """(id, filename, caption) of every image, or None when the table cannot be read."""
+    try:
+        with read_connection() as conn:
+            return conn.execute("SELECT id, filename, caption FROM images ORDER BY id").fetchall()
+    except Exception:
+        count_error("database")
+        logger.exception("Database error")
+        return None
+
+def load_embedding_store():
+    """Bring BLOB embeddings into the sidecar store and serve searches from it.
+
+    Store rows with no images row are not compacted here: they may belong to a transaction another
+    process (index_directory.py) has not committed yet. They are never searched, since only ids from
+    the images table are registered, and migrate_embeddings.py --compact drops them offline.
+    """
+    rows = fetch_image_names()
+    if rows is None:
+        return
+    # Rows written with EMBEDDING_STORE=sqlite (or before the store existed) still carry BLOBs
+    copied, _ = migrate_sqlite_embeddings(embedding_store, DB_PATH)
+    if copied:
+        logger.info("Copied database embeddings into the store", extra={"copied": copied})
+    embedding_index.attach_store(embedding_store, rows)
+
+ann_build_lock = threading.Lock()
+
+def build_ann_index():
+    if embedding_index.ann is not None or not ann_build_lock.acquire(blocking=False):
+        return
+    try:
+        _build_ann_index()
+    finally:
+        ann_build_lock.release()
+    if ann_outgrown():
+        # The saved index was trained on a much smaller catalog
+        threading.Thread(target=retrain_ann_index, name="ann-retrain", daemon=True).start()
+
+def retrain_ann_index():
+    """Retrain the ANN index on the current catalog; searches use the old one until the new one is attached."""
+    if not ann_build_lock.acquire(blocking=False):
+        return
+    try:
+        _build_ann_index(retrain=True)
+    finally:
+        ann_build_lock.release()
+
+def ann_outgrown():
+    ann = embedding_index.ann
+    return ann is not None and ann.outgrown(ANN_RETRAIN_GROWTH) and not ann_build_lock.locked()
+
+def _build_ann_index(retrain=False):
+    ann = create_ann_index(
+        ANN_BACKEND, nlist=ANN_NLIST, nprobe=ANN_NPROBE, ef_search=ANN_EF_SEARCH,
+        pq_m=ANN_PQ_M, rerank=ANN_PQ_RERANK, opq=ANN_PQ_OPQ
+    )
+    if ann is None:
+        return
+    state = embedding_index.attach_ann(ann, None if retrain else ANN_INDEX_PATH, train=retrain or len(embedding_index) >= ANN_MIN_SIZE)
+    if state == "built":
+        embedding_index.save_ann(ANN_INDEX_PATH)
+    if state:
+        logger.info("ANN index %s", "retrained" if retrain else state, extra={"backend": ann.backend, "vectors": ann.ntotal, "nlist": getattr(ann, "nlist", None)})
+    else:
+        logger.info("Catalog below ANN_MIN_SIZE, using exact search", extra={"ann_min_size": ANN_MIN_SIZE})
+
+@app.on_event("startup")
+def load_embedding_index():
+    if USE_ML_MODELS:
+        if embedding_store is not None:
+            load_embedding_store()
+        else:
+            embedding_index.load(fetch_embeddings())
+        logger.info("Loaded embeddings into the search index", extra={"embeddings": len(embedding_index)})
+        if ANN_BACKEND.lower() == "ivfpq" and embedding_store is None:
+            logger.warning(
+                "ANN_BACKEND=ivfpq keeps the PQ codes on top of the resident float32 matrix; "
+                "set EMBEDDING_STORE=float16 or int8 so the matrix stays on disk",
+                extra={"embedding_store": EMBEDDING_STORE}
+            )
+        build_ann_index()
+    if DEDUP_MODE == "dhash":
+        perceptual_index.load(fetch_perceptual_hashes())
+    if USE_ML_MODELS and MODEL_PRELOAD:
+        threading.Thread(target=prepare_models, name="model-preload", daemon=True).start()
+    elif USE_ML_MODELS and TEXT_CACHE_PREWARM_FILE:
+        # Without preloading the prewarm still runs; it loads the models itself
+        threading.Thread(target=prewarm_text_cache, name="text-cache-prewarm", daemon=True).start()
+
+@app.on_event("shutdown")
+def save_ann_index():
+    if embedding_index.save_ann(ANN_INDEX_PATH):
+        logger.info("Saved ANN index", extra={"path": ANN_INDEX_PATH})
+
+@app.on_event("shutdown")
+async def stop_caption_batcher():
+    for batcher in caption_batchers.values():
+        await batcher.stop()
+    inference_pool.shutdown()
+
+@app.exception_handler(InferenceQueueFull)
+async def inference_queue_full_handler(request, exc: InferenceQueueFull):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"error": "Server is busy, please retry later"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+def index_image(image_id, filename, caption, embedding, perceptual_hash=None):
+    if DEDUP_MODE == "dhash":
+        perceptual_index.add(image_id, perceptual_hash)
+    if not USE_ML_MODELS:
+        return
+    embedding_index.add(image_id, filename, caption, embedding)
+    if embedding_index.ann is None and ANN_BACKEND != "exact" and len(embedding_index) >= ANN_MIN_SIZE:
+        threading.Thread(target=build_ann_index, daemon=True).start()
+    elif ann_outgrown():
+        threading.Thread(target=retrain_ann_index, name="ann-retrain", daemon=True).start()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the AI-Powered Image Captioning and Search API!"}
 
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    ready = not USE_ML_MODELS or ((models_ready or not MODEL_PRELOAD) and embedding_index.loaded)
+    content = {"ready": ready, "models": model_status, "error": model_status["error"], "indexed_images": len(embedding_index)}
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+def upload_cache_counts():
+    stats = dedup_stats.stats()
+    hits = stats["exact_hits"] + stats["perceptual_hits"]
+    return hits, stats["lookups"] - hits
+
+register_cache("text_embedding", lambda: (text_embedding_cache.hits, text_embedding_cache.misses))
+register_cache("upload", upload_cache_counts)
+register_queue("inference", lambda: inference_pool.pending)
+register_queue("database_writes", lambda: write_queue.stats()["pending"])
+register_queue("jobs", lambda: job_queue.counts()["pending"])
+for tier, batcher in caption_batchers.items():
+    register_queue(f"caption_{tier}", lambda batcher=batcher: batcher.stats()["pending"])
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, error and cache counters, queue depths."""
+    body, content_type = await run_in_threadpool(render_metrics)
+    return Response(content=body, media_type=content_type)
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "caption_batching": {tier: batcher.stats() for tier, batcher in caption_batchers.items()},
+        "inference": inference_pool.stats(),
+        "upload_cache": dict(dedup_stats.stats(), mode=DEDUP_MODE),
+        "text_embedding_cache": text_embedding_cache.stats(),
+        "database_writes": write_queue.stats(),
+        "jobs": await run_in_threadpool(job_queue.counts),
+        "models": model_status,
+    }
+
 @app.get("/test-auth")
 async def test_auth(current_user: User = Depends(get_current_user)):
     return {"message": "Authentication successful", "user": current_user.username}
@@ -156,121 +728,684 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
         "email": current_user.email
     }
 
+async def process_upload(filename, image_data, content_hash, tier=CAPTION_DEFAULT_TIER, uploader=None, metadata=None):
+    """Dedup, caption, embed, store and index one upload; returns (image_id, caption, cached)."""
+    perceptual_hash = None
+    hit = None
+    if metadata is None:
+        metadata = await run_in_threadpool(image_metadata, image_data)
+    
+    cached = await run_in_threadpool(find_cached_result, content_hash=content_hash)
+    if cached is not None:
+        hit = "exact"
+    else:
+        with inference_pool.admit():
+            image = await run_in_threadpool(decode_image, image_data)
+            if DEDUP_MODE == "dhash":
+                perceptual_hash = dhash(image)
+                cached = await run_in_threadpool(find_near_duplicate, perceptual_hash)
+                if cached is not None:
+                    hit = "perceptual"
+            if cached is None:
+                caption = await caption_image(image, tier)
+                embedding = await inference_pool.run(generate_embedding, image)
+    dedup_stats.record(hit)
+    if cached is not None:
+        caption, embedding, cached_perceptual_hash = cached
+        perceptual_hash = perceptual_hash if perceptual_hash is not None else cached_perceptual_hash
+    
+    await store_upload(filename, image_data, content_hash)
+    
+    image_id = await run_in_threadpool(
+        insert_image, filename, caption, embedding, content_hash, perceptual_hash, uploader, metadata
+    )
+    if image_id is not None:
+        index_image(image_id, filename, caption, embedding, perceptual_hash)
+    return image_id, caption, hit is not None
+
+job_queue = JobQueue(JOB_MAX_ATTEMPTS)
+job_workers = []
+webhook_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webhooks")
+
+def save_job_file(image_data):
+    """Spool the upload under a unique name and fsync it before the job row points at it."""
+    os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(JOB_SPOOL_DIR, uuid.uuid4().hex)
+    with open(path, "wb") as f:
+        f.write(image_data)
+        f.flush()
+        os.fsync(f.fileno())
+    return path
+
+def read_job_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def remove_job_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("Could not remove job file", extra={"path": path, "error": str(e)})
+
+def job_response(job):
+    return {key: value for key, value in job.items() if key != "username"}
+
+def send_webhook(url, job):
+    # Checked again at send time: the allowlist may have changed since the job was queued
+    if not webhook_allowed(url, JOB_WEBHOOK_ALLOWED_HOSTS):
+        logger.warning("Webhook host not allowed", extra={"job_id": job["id"]})
+        return
+    try:
+        # Redirects are not followed, so an allowed host cannot bounce the request elsewhere
+        requests.post(url, json=job_response(job), timeout=JOB_WEBHOOK_TIMEOUT, allow_redirects=False)
+    except Exception as e:
+        count_error("webhook")
+        logger.warning("Webhook error", extra={"job_id": job["id"], "error": str(e)})
+
+async def job_finished(job):
+    await job_queue.notify()
+    if job["webhook_url"]:
+        state = await run_in_threadpool(job_queue.get, job["id"])
+        webhook_executor.submit(send_webhook, job["webhook_url"], state)
+
+async def run_job(job):
+    try:
+        image_data = await run_in_threadpool(read_job_file, job["file_path"])
+        image_id, caption, _ = await process_upload(
+            job["filename"], image_data, job["content_hash"], job["tier"], job["username"]
+        )
+        if image_id is None:
+            raise RuntimeError("Failed to save to database")
+    except InferenceQueueFull as e:
+        await run_in_threadpool(job_queue.release, job["id"])
+        await asyncio.sleep(e.retry_after)
+        return
+    except Exception as e:
+        count_error("job")
+        logger.exception("Job failed", extra={"job_id": job["id"], "attempts": job["attempts"]})
+        attempts = JOB_MAX_ATTEMPTS if isinstance(e, FileNotFoundError) else job["attempts"]
+        if await run_in_threadpool(job_queue.fail, job["id"], e, attempts) == "failed":
+            await run_in_threadpool(remove_job_file, job["file_path"])
+            await job_finished(job)
+        return
+    await run_in_threadpool(job_queue.complete, job["id"], image_id, caption)
+    await run_in_threadpool(remove_job_file, job["file_path"])
+    await job_finished(job)
+
+async def job_worker():
+    while True:
+        try:
+            job = await run_in_threadpool(job_queue.claim)
+        except Exception:
+            count_error("job_queue")
+            logger.exception("Job queue error")
+            job = None
+        if job is None:
+            await job_queue.wait_for_change(job_queue.poll_interval)
+        else:
+            await run_job(job)
+
+@app.on_event("startup")
+async def start_job_workers():
+    requeued, failed = await run_in_threadpool(job_queue.requeue_interrupted)
+    if requeued:
+        logger.info("Resuming interrupted upload jobs", extra={"jobs": requeued})
+    for job in failed:
+        logger.warning("Giving up on a job interrupted on every attempt", extra={"job_id": job["id"], "attempts": job["attempts"]})
+        await run_in_threadpool(remove_job_file, job["file_path"])
+        await job_finished(job)
+    job_workers.extend(asyncio.create_task(job_worker()) for _ in range(JOB_WORKERS))
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    for worker in job_workers:
+        worker.cancel()
+    await asyncio.gather(*job_workers, return_exceptions=True)
+    job_workers.clear()
+    webhook_executor.shutdown(wait=False)
+
 @app.post("/upload/")
-async def upload_image(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
+async def upload_image(
+    file: UploadFile = File(...),
+    tier: str = CAPTION_DEFAULT_TIER,
+    mode: str = UPLOAD_MODE,
+    webhook_url: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     try:
         if not file.content_type.startswith('image/'):
             return {"error": "File must be an image"}
+        if tier not in CAPTION_TIERS:
+            return {"error": f"tier must be one of: {', '.join(CAPTION_TIERS)}"}
+        if mode not in ("sync", "async"):
+            return {"error": "mode must be one of: sync, async"}
+        if webhook_url and not webhook_allowed(webhook_url, JOB_WEBHOOK_ALLOWED_HOSTS):
+            return {"error": "webhook_url must be an http(s) URL on a host in JOB_WEBHOOK_ALLOWED_HOSTS"}
         
         image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data)).convert('RGB')
+        content_hash, metadata = await run_in_threadpool(inspect_upload, image_data)
         
-        caption = generate_caption(image)
-        embedding = generate_embedding(image)
+        if mode == "async":
+            file_path = await run_in_threadpool(save_job_file, image_data)
+            job_id = await run_in_threadpool(
+                job_queue.create, current_user.username, file.filename, file_path, content_hash, tier, webhook_url
+            )
+            await job_queue.notify()
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={
+                    "message": "Image queued for processing",
+                    "filename": file.filename,
+                    "job_id": job_id,
+                    "status": "pending"
+                },
+                headers={"Location": f"/jobs/{job_id}"},
+            )
         
-        os.makedirs("data/raw", exist_ok=True)
-        
-        file_location = f"data/raw/{file.filename}"
-        with open(file_location, "wb") as f:
-            f.write(image_data)
-        
-        if insert_image(file.filename, caption, embedding):
+        image_id, caption, cached = await process_upload(
+            file.filename, image_data, content_hash, tier, current_user.username, metadata
+        )
+        if image_id is not None:
             return {
                 "message": "Image uploaded successfully",
                 "filename": file.filename,
-                "caption": caption
+                "caption": caption,
+                "cached": cached,
+                "tier": tier
             }
         else:
             return {"error": "Failed to save to database"}
             
+    except InferenceQueueFull:
+        raise
     except Exception as e:
-        print(f"Upload error: {e}")
+        count_error("upload")
+        logger.exception("Upload error")
         return {"error": str(e)}
 
-@app.get("/search/")
-async def search_images(query: str, current_user: User = Depends(get_current_user)):
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int, wait: float = 0, current_user: User = Depends(get_current_user)):
+    """Status of an async upload; with wait > 0, long-polls up to that many seconds for it to finish."""
     try:
-        print(f"Search request received for query: '{query}'")
-        
-        images = fetch_images()
-        print(f"Found {len(images)} images in database")
-        
-        if not images:
-            print("No images found in database")
-            return {"query": query, "results": []}
-        
-        if USE_ML_MODELS:
-            print("Using ML models for search")
-            if not load_models():
-                print("Models not loaded, returning error")
-                return JSONResponse(status_code=500, content={"error": "Models not loaded"})
-            
-            query_inputs = clip_processor(text=[query], return_tensors="pt", padding=True)
-            with torch.no_grad():
-                query_features = clip_model.get_text_features(**query_inputs)
-            query_embedding = query_features.cpu().numpy()
-            
-            similarities = []
-            for row in images:
-                try:
-                    stored_embedding = np.frombuffer(row["embedding"], dtype=np.float32).reshape(1, -1)
-                    similarity = np.dot(query_embedding, stored_embedding.T) / (
-                        np.linalg.norm(query_embedding) * np.linalg.norm(stored_embedding)
-                    )
-                    similarities.append((similarity[0][0], row))
-                except Exception as e:
-                    print(f"Error processing image {row['filename']}: {e}")
-                    continue
+        if wait > 0:
+            job = await job_queue.wait(job_id, min(wait, JOB_MAX_WAIT))
+        else:
+            job = await run_in_threadpool(job_queue.get, job_id)
+        if job is None or job["username"] != current_user.username:
+            return JSONResponse(status_code=404, content={"error": "Job not found"})
+        return job_response(job)
+    except Exception as e:
+        count_error("jobs")
+        logger.exception("Job status error")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+async def decode_upload(filename, image_data):
+    try:
+        return await run_in_threadpool(decode_image, image_data)
+    except Exception as e:
+        count_error("decode")
+        logger.warning("Decode error", extra={"upload": filename, "error": str(e)})
+        return e
+
+async def process_upload_batch(uploads, tier=CAPTION_DEFAULT_TIER, uploader=None):
+    images = []
+    for filename, content_type, image_data in uploads:
+        if not content_type or not content_type.startswith('image/'):
+            yield {"filename": filename, "status": "error", "error": "File must be an image"}
         else:
-            print("Using simple text-based search")
-            similarities = []
-            query_lower = query.lower()
-            for row in images:
-                try:
-                    caption_lower = row["caption"].lower()
-                    if query_lower in caption_lower:
-                        similarity = 0.8
-                    else:
-                        similarity = 0.1
-                    similarities.append((similarity, row))
-                except Exception as e:
-                    print(f"Error processing row {row}: {e}")
+            images.append((filename, image_data))
+    inspected = await asyncio.gather(*(run_in_threadpool(inspect_upload, image_data) for _, image_data in images))
+    pending = [(filename, image_data, *info) for (filename, image_data), info in zip(images, inspected)]
+    
+    rows = []
+    cached_results = await asyncio.gather(*(
+        run_in_threadpool(find_cached_result, content_hash=content_hash) for _, _, content_hash, _ in pending
+    ))
+    misses = []
+    for (filename, image_data, content_hash, metadata), cached in zip(pending, cached_results):
+        if cached is None:
+            misses.append((filename, image_data, content_hash, metadata))
+            continue
+        dedup_stats.record("exact")
+        caption, embedding, perceptual_hash = cached
+        await store_upload(filename, image_data, content_hash)
+        rows.append((filename, caption, embedding, content_hash, perceptual_hash, uploader, *metadata))
+        yield {"filename": filename, "status": "processed", "caption": caption, "cached": True}
+    
+    # Cache misses are decoded and run through the models one chunk at a time, each chunk holding its
+    # own inference slot, so at most CAPTION_MAX_BATCH_SIZE decoded images are in memory at once
+    for start in range(0, len(misses), CAPTION_MAX_BATCH_SIZE):
+        chunk = misses[start:start + CAPTION_MAX_BATCH_SIZE]
+        try:
+            with inference_pool.admit():
+                decoded = await asyncio.gather(*(decode_upload(filename, image_data) for filename, image_data, _, _ in chunk))
+                ready = []
+                for (filename, image_data, content_hash, metadata), image in zip(chunk, decoded):
+                    if isinstance(image, Exception):
+                        yield {"filename": filename, "status": "error", "error": str(image)}
+                        continue
+                    perceptual_hash = None
+                    if DEDUP_MODE == "dhash":
+                        perceptual_hash = dhash(image)
+                        cached = await run_in_threadpool(find_near_duplicate, perceptual_hash)
+                        if cached is not None:
+                            dedup_stats.record("perceptual")
+                            caption, embedding, _ = cached
+                            await store_upload(filename, image_data, content_hash)
+                            rows.append((filename, caption, embedding, content_hash, perceptual_hash, uploader, *metadata))
+                            yield {"filename": filename, "status": "processed", "caption": caption, "cached": True}
+                            continue
+                    dedup_stats.record()
+                    ready.append((filename, image_data, image, content_hash, perceptual_hash, metadata))
+                if not ready:
                     continue
+                batch_images = [image for _, _, image, _, _, _ in ready]
+                captions = await inference_pool.run(generate_captions, batch_images, tier)
+                embeddings = await inference_pool.run(generate_embeddings, batch_images)
+                for (filename, image_data, _, content_hash, perceptual_hash, metadata), caption, embedding in zip(ready, captions, embeddings):
+                    await store_upload(filename, image_data, content_hash)
+                    rows.append((filename, caption, embedding, content_hash, perceptual_hash, uploader, *metadata))
+                    yield {"filename": filename, "status": "processed", "caption": caption, "cached": False}
+        except InferenceQueueFull:
+            # Keep what was processed so far; the rest can be retried
+            for filename, _, _, _ in misses[start:]:
+                yield {"filename": filename, "status": "error", "error": "Server is busy, please retry later"}
+            break
+    
+    image_ids = await run_in_threadpool(insert_images, rows) if rows else []
+    if image_ids is None:
+        yield {"status": "error", "error": "Failed to save to database", "uploaded": 0}
+        return
+    for image_id, (filename, caption, embedding, _, perceptual_hash, *_) in zip(image_ids, rows):
+        index_image(image_id, filename, caption, embedding, perceptual_hash)
+    yield {"status": "complete", "uploaded": len(image_ids), "failed": len(uploads) - len(image_ids)}
+
+@app.post("/upload/batch")
+async def upload_images_batch(
+    files: List[UploadFile] = File(...),
+    tier: str = CAPTION_DEFAULT_TIER,
+    current_user: User = Depends(get_current_user)
+):
+    if tier not in CAPTION_TIERS:
+        return {"error": f"tier must be one of: {', '.join(CAPTION_TIERS)}"}
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        return JSONResponse(status_code=413, content={"error": f"At most {UPLOAD_BATCH_MAX_FILES} files per batch upload"})
+    if inference_pool.pending >= inference_pool.max_pending:
+        raise InferenceQueueFull(inference_pool.retry_after)
+    uploads = [(file.filename, file.content_type, await file.read()) for file in files]
+    
+    async def ndjson():
+        try:
+            async for result in process_upload_batch(uploads, tier, current_user.username):
+                yield json.dumps(result) + "\n"
+        except InferenceQueueFull:
+            yield json.dumps({"status": "error", "error": "Server is busy, please retry later"}) + "\n"
+        except Exception as e:
+            count_error("upload_batch")
+            logger.exception("Batch upload error")
+            yield json.dumps({"status": "error", "error": str(e)}) + "\n"
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+SEARCH_MODES = ("semantic", "keyword", "hybrid")
+
+def search_filters(
+    uploader: Optional[str] = None,
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None,
+    min_width: Optional[int] = None,
+    max_width: Optional[int] = None,
+    min_height: Optional[int] = None,
+    max_height: Optional[int] = None,
+    mime_type: Optional[str] = None
+):
+    """Metadata filter query parameters shared by the search endpoints, as a (where, params) condition."""
+    return metadata_filter(
+        uploader,
+        utc_timestamp(uploaded_after) if uploaded_after else None,
+        utc_timestamp(uploaded_before) if uploaded_before else None,
+        min_width, max_width, min_height, max_height,
+        [value.strip() for value in mime_type.split(",") if value.strip()] if mime_type else None
+    )
+
+def search_tuning(
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    rerank: Optional[int] = None,
+    exact: bool = False
+):
+    """ANN query parameters shared by the vector search endpoints."""
+    return {"exact": exact, "nprobe": nprobe, "ef_search": ef_search, "rerank": rerank}
+
+async def index_matches(embedding, k, where="", params=(), exclude=None, **search_params):
+    """Top-k (similarity, id, filename, caption) for an embedding, scoring only images matching the filter.
+
+    exclude drops one image id (the query image itself) from the results.
+    """
+    if where:
+        matches = (await run_in_threadpool(
+            filtered_search, embedding_index.search_batch, embedding[None], k + (exclude is not None), where, params,
+            **search_params
+        ))[0]
+    else:
+        with stage_timer("scoring"):
+            matches = await run_in_threadpool(embedding_index.search, embedding, k=k + (exclude is not None), **search_params)
+    return [match for match in matches if match[1] != exclude][:k]
+
+async def semantic_matches(query, k, where="", params=(), **search_params):
+    """Top-k matches for a text query from the embedding index, or None if the models cannot load."""
+    if not models_loaded and not await inference_pool.run(load_models):
+        return None
+    query_embedding = text_embedding_cache.get(text_cache_key(query))
+    if query_embedding is None:
+        with inference_pool.admit():
+            query_embedding = (await inference_pool.run(encode_texts, [query]))[0]
+    return await index_matches(query_embedding, k, where, params, **search_params)
+
+async def encode_queries(queries):
+    """(len(queries), dim) embeddings; text cache misses are encoded together in one CLIP batch."""
+    embeddings = [text_embedding_cache.get(text_cache_key(query)) for query in queries]
+    missing = list(dict.fromkeys(normalize_query(query) for query, embedding in zip(queries, embeddings) if embedding is None))
+    if missing:
+        with inference_pool.admit():
+            encoded = dict(zip(missing, await inference_pool.run(encode_texts, missing)))
+        embeddings = [
+            encoded[normalize_query(query)] if embedding is None else embedding
+            for query, embedding in zip(queries, embeddings)
+        ]
+    return np.stack(embeddings)
+
+def above_min_score(results, min_score, key="similarity"):
+    return results if min_score is None else [result for result in results if result[key] >= min_score]
+
+def vector_results(matches, min_score):
+    return above_min_score([
+        {
+            "id": image_id,
+            "filename": filename,
+            "caption": caption,
+            "similarity": similarity
+        }
+        for similarity, image_id, filename, caption in matches
+    ], min_score)
+
+def json_response(content):
+    """Render a search response directly, timing the JSON encoding as the serialization stage."""
+    with stage_timer("serialization"):
+        return JSONResponse(content=content)
+
+def check_k(k):
+    if not 1 <= k <= SEARCH_MAX_K:
+        return JSONResponse(status_code=400, content={"error": f"k must be between 1 and {SEARCH_MAX_K}"})
+    return None
+
+@app.get("/search/")
+async def search_images(
+    query: str,
+    mode: Optional[str] = None,
+    k: int = 3,
+    min_score: Optional[float] = None,
+    filters: tuple = Depends(search_filters),
+    search_params: dict = Depends(search_tuning),
+    fusion: str = SEARCH_FUSION,
+    vector_weight: float = SEARCH_VECTOR_WEIGHT,
+    vector_candidates: int = SEARCH_VECTOR_CANDIDATES,
+    keyword_candidates: int = SEARCH_KEYWORD_CANDIDATES,
+    rrf_k: int = SEARCH_RRF_K,
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        logger.debug("Search request", extra={"query": query, "mode": mode, "k": k})
+        mode = mode or ("semantic" if USE_ML_MODELS else "keyword")
+        if mode not in SEARCH_MODES:
+            return JSONResponse(status_code=400, content={"error": f"mode must be one of: {', '.join(SEARCH_MODES)}"})
+        if mode != "keyword" and not USE_ML_MODELS:
+            return JSONResponse(status_code=400, content={"error": f"{mode.capitalize()} search requires the ML models, use mode=keyword"})
+        invalid = check_k(k)
+        if invalid is not None:
+            return invalid
+        where, params = filters
         
-        print(f"Processed {len(similarities)} similarities")
+        if mode == "hybrid":
+            if fusion not in FUSION_METHODS:
+                return JSONResponse(status_code=400, content={"error": f"fusion must be one of: {', '.join(FUSION_METHODS)}"})
+            # Capped at SEARCH_MAX_K so a hybrid query never scans more than a vector-only one may
+            candidates_valid = all(1 <= candidates <= SEARCH_MAX_K for candidates in (vector_candidates, keyword_candidates))
+            if not 0 <= vector_weight <= 1 or not candidates_valid or rrf_k < 0:
+                return JSONResponse(status_code=400, content={"error": f"vector_weight must be in [0, 1], candidate pools between 1 and {SEARCH_MAX_K} and rrf_k non-negative"})
+            # The keyword query runs while the query embedding is computed and the index is scanned
+            vector_matches, keyword_matches = await asyncio.gather(
+                semantic_matches(query, max(k, vector_candidates), where, params, **search_params),
+                run_in_threadpool(search_captions, query, max(k, keyword_candidates), where, params)
+            )
+            if vector_matches is None:
+                return JSONResponse(status_code=500, content={"error": "Models not loaded"})
+            results = above_min_score(fuse(vector_matches, keyword_matches, k, fusion, vector_weight, rrf_k), min_score)
+            logger.debug("Hybrid search results", extra={
+                "results": len(results), "vector_candidates": len(vector_matches), "keyword_candidates": len(keyword_matches)
+            })
+            return json_response({"query": query, "mode": mode, "fusion": fusion, "results": results})
         
-        similarities.sort(key=lambda x: x[0], reverse=True)
-        results = [
-            {
-                "filename": row["filename"], 
-                "caption": row["caption"],
-                "similarity": float(sim)
-            } 
-            for sim, row in similarities[:3]
-        ]
+        if mode == "keyword":
+            matches = await run_in_threadpool(search_captions, query, k, where, params)
+            results = above_min_score([
+                {
+                    "id": image_id,
+                    "filename": filename,
+                    "caption": caption,
+                    "similarity": score,
+                    "snippet": snippet
+                }
+                for score, image_id, filename, caption, snippet in matches
+            ], min_score)
+            logger.debug("Keyword search results", extra={"results": len(results)})
+            return json_response({"query": query, "mode": mode, "results": results})
         
-        print(f"Returning {len(results)} results")
-        return {"query": query, "results": results}
+        matches = await semantic_matches(query, k, where, params, **search_params)
+        if matches is None:
+            return JSONResponse(status_code=500, content={"error": "Models not loaded"})
+        results = vector_results(matches, min_score)
+        logger.debug("Semantic search results", extra={"results": len(results)})
+        return json_response({"query": query, "mode": mode, "results": results})
+    except InferenceQueueFull:
+        raise
     except Exception as e:
-        print(f"Search error: {e}")
-        import traceback
-        traceback.print_exc()
+        count_error("search")
+        logger.exception("Search error", extra={"query": query})
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.post("/search/batch")
+async def search_images_batch(
+    queries: List[str] = Body(..., embed=True),
+    k: int = 3,
+    min_score: Optional[float] = None,
+    filters: tuple = Depends(search_filters),
+    search_params: dict = Depends(search_tuning),
+    current_user: User = Depends(get_current_user)
+):
+    """Semantic search for many queries: one batched text encode and one matrix-matrix scoring pass."""
+    try:
+        if not USE_ML_MODELS:
+            return JSONResponse(status_code=400, content={"error": "Batch search requires the ML models"})
+        if not 1 <= len(queries) <= SEARCH_BATCH_MAX_QUERIES:
+            return JSONResponse(status_code=400, content={"error": f"queries must hold between 1 and {SEARCH_BATCH_MAX_QUERIES} queries"})
+        invalid = check_k(k)
+        if invalid is not None:
+            return invalid
+        logger.debug("Batch search request", extra={"queries": len(queries), "k": k})
+        if not models_loaded and not await inference_pool.run(load_models):
+            return JSONResponse(status_code=500, content={"error": "Models not loaded"})
+        embeddings = await encode_queries(queries)
+        where, params = filters
+        if where:
+            matches = await run_in_threadpool(
+                filtered_search, embedding_index.search_batch, embeddings, k, where, params, **search_params
+            )
+        else:
+            with stage_timer("scoring"):
+                matches = await run_in_threadpool(embedding_index.search_batch, embeddings, k=k, **search_params)
+        return json_response({"results": [
+            {"query": query, "results": vector_results(query_matches, min_score)}
+            for query, query_matches in zip(queries, matches)
+        ]})
+    except InferenceQueueFull:
+        raise
+    except Exception as e:
+        count_error("search_batch")
+        logger.exception("Batch search error")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/search/similar/{image_id}")
+async def search_similar(
+    image_id: int,
+    k: int = 3,
+    min_score: Optional[float] = None,
+    filters: tuple = Depends(search_filters),
+    search_params: dict = Depends(search_tuning),
+    current_user: User = Depends(get_current_user)
+):
+    """Images most similar to a stored one, from its indexed embedding without running any model."""
+    try:
+        if not USE_ML_MODELS:
+            return JSONResponse(status_code=400, content={"error": "Similarity search requires the ML models"})
+        invalid = check_k(k)
+        if invalid is not None:
+            return invalid
+        embedding = embedding_index.vector(image_id)
+        if embedding is None:
+            return JSONResponse(status_code=404, content={"error": "Image not found in the search index"})
+        matches = await index_matches(embedding, k, *filters, exclude=image_id, **search_params)
+        return json_response({"image_id": image_id, "results": vector_results(matches, min_score)})
+    except Exception as e:
+        count_error("search_similar")
+        logger.exception("Similar search error", extra={"image_id": image_id})
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.post("/search/by-image")
+async def search_by_image(
+    file: UploadFile = File(...),
+    k: int = 3,
+    min_score: Optional[float] = None,
+    filters: tuple = Depends(search_filters),
+    search_params: dict = Depends(search_tuning),
+    current_user: User = Depends(get_current_user)
+):
+    """Images most similar to an uploaded query image; the upload is not stored."""
+    try:
+        if not USE_ML_MODELS:
+            return JSONResponse(status_code=400, content={"error": "Similarity search requires the ML models"})
+        if not file.content_type or not file.content_type.startswith('image/'):
+            return JSONResponse(status_code=400, content={"error": "File must be an image"})
+        invalid = check_k(k)
+        if invalid is not None:
+            return invalid
+        image_data = await file.read()
+        # An image that is already in the catalog reuses its stored embedding
+        content_hash = await run_in_threadpool(compute_content_hash, image_data)
+        cached = await run_in_threadpool(find_cached_result, content_hash=content_hash)
+        if cached is not None:
+            embedding = cached[1]
+        else:
+            if not models_loaded and not await inference_pool.run(load_models):
+                return JSONResponse(status_code=500, content={"error": "Models not loaded"})
+            with inference_pool.admit():
+                image = await run_in_threadpool(decode_image, image_data)
+                embedding = await inference_pool.run(generate_embedding, image)
+        if not embedding:
+            return JSONResponse(status_code=500, content={"error": "Failed to embed the query image"})
+        matches = await index_matches(np.frombuffer(embedding, dtype=np.float32), k, *filters, **search_params)
+        return json_response({"filename": file.filename, "cached": cached is not None, "results": vector_results(matches, min_score)})
+    except InferenceQueueFull:
+        raise
+    except Exception as e:
+        count_error("search_by_image")
+        logger.exception("Image search error")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+def ensure_thumbnail(record, size):
+    """Path and content hash of the thumbnail, generating it from the original if it is missing."""
+    content_hash = record["content_hash"]
+    if content_hash:
+        path = thumbnail_path(content_hash, size)
+        if os.path.exists(path):
+            return path, content_hash
+    with open(os.path.join(UPLOAD_DIR, record["filename"]), "rb") as f:
+        image_data = f.read()
+    content_hash = content_hash or compute_content_hash(image_data)
+    return generate_thumbnails(image_data, content_hash, (size,))[size], content_hash
+
+@app.get("/thumbnails/{image_id}")
+async def get_thumbnail(
+    image_id: int,
+    request: Request,
+    size: int = THUMBNAIL_SIZES[-1],
+    current_user: User = Depends(get_current_user)
+):
+    if size not in THUMBNAIL_SIZES:
+        return JSONResponse(status_code=400, content={"error": f"size must be one of {list(THUMBNAIL_SIZES)}"})
+    record = await run_in_threadpool(fetch_image_record, image_id)
+    if record is None:
+        return JSONResponse(status_code=404, content={"error": "Image not found"})
+    
+    headers = {"Cache-Control": "private, max-age=31536000, immutable"}
+    if record["content_hash"]:
+        headers["ETag"] = f'"{record["content_hash"]}-{size}"'
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+    try:
+        path, content_hash = await run_in_threadpool(ensure_thumbnail, record, size)
+    except FileNotFoundError:
+        return JSONResponse(status_code=404, content={"error": "Original image not found"})
+    except Exception as e:
+        count_error("thumbnail")
+        logger.exception("Thumbnail error")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    headers["ETag"] = f'"{content_hash}-{size}"'
+    return FileResponse(path, media_type="image/webp", headers=headers)
+
+async def stream_history(cursor, limit):
+    remaining = limit
+    while remaining is None or remaining > 0:
+        page_size = HISTORY_MAX_PAGE_SIZE if remaining is None else min(remaining, HISTORY_MAX_PAGE_SIZE)
+        rows = await run_in_threadpool(fetch_history_page, cursor, page_size)
+        for row in rows:
+            yield json.dumps({"id": row["id"], "filename": row["filename"], "caption": row["caption"]}) + "\n"
+        if len(rows) < page_size:
+            return
+        cursor = rows[-1]["id"]
+        if remaining is not None:
+            remaining -= len(rows)
+
 @app.get("/history/")
-async def get_history(current_user: User = Depends(get_current_user)):
+async def get_history(
+    limit: Optional[int] = None,
+    cursor: int = 0,
+    format: str = "json",
+    current_user: User = Depends(get_current_user)
+):
     try:
-        images = fetch_images()
-        return {"images": [{"filename": row["filename"], "caption": row["caption"]} for row in images]}
+        if format == "ndjson":
+            return StreamingResponse(stream_history(cursor, limit), media_type="application/x-ndjson")
+        
+        limit = max(1, min(limit or HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE))
+        rows = await run_in_threadpool(fetch_history_page, cursor, limit + 1)
+        next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+        return {
+            "images": [{"id": row["id"], "filename": row["filename"], "caption": row["caption"]} for row in rows[:limit]],
+            "next_cursor": next_cursor
+        }
     except Exception as e:
-        print(f"History error: {e}")
+        count_error("history")
+        logger.exception("History error")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 if __name__ == "__main__":
-    print("Starting AI-Powered Image Captioning and Search API...")
+    logger.info("Starting AI-Powered Image Captioning and Search API")
     if USE_ML_MODELS:
-        print("Loading models (this may take a few minutes on first run)...")
+        logger.info("Loading models (this may take a few minutes on first run)")
     else:
-        print("Running in test mode with simplified captioning and search...")
+        logger.info("Running in test mode with simplified captioning and search")
     run(app, host="0.0.0.0", port=8000)
 
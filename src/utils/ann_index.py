@@ -0,0 +1,384 @@
+import logging
+import os
+import numpy as np
+from utils.embedding_index import normalize, top_k
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+
+def kmeans(vectors, n_clusters, iterations=20, seed=0, chunk_size=65536):
+    """Spherical k-means over L2-normalized vectors; returns normalized centroids."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    centroids = vectors[rng.choice(n, n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign(vectors, centroids, chunk_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = vectors[rng.choice(n, empty.size, replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+def assign(vectors, centroids, chunk_size=65536):
+    assignments = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], chunk_size):
+        block = vectors[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFFlatIndex:
+    """Inverted-file index over the rows of an EmbeddingIndex matrix.
+
+    Each inverted list stores row positions only; candidate vectors are read back
+    from the resident matrix, so the index adds no second copy of the embeddings.
+    """
+
+    backend = "ivf"
+
+    def __init__(self, nlist=None, nprobe=8, iterations=20, max_train_points=256, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self.centroids = None
+        self.lists = []
+        self.ntotal = 0
+        self.trained_size = 0
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def outgrown(self, growth):
+        """True once the index holds more than growth times the vectors its centroids were trained on."""
+        return growth > 0 and self.trained_size > 0 and self.ntotal > growth * self.trained_size
+
+    def train(self, vectors):
+        n = vectors.shape[0]
+        nlist = self.nlist or int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+        sample = vectors
+        limit = nlist * self.max_train_points
+        if n > limit:
+            rng = np.random.default_rng(self.seed)
+            sample = vectors[np.sort(rng.choice(n, limit, replace=False))]
+        self.centroids = kmeans(sample, nlist, self.iterations, self.seed)
+        self.nlist = nlist
+        self.trained_size = n
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self.ntotal = 0
+
+    def _extend(self, assignments):
+        positions = np.arange(self.ntotal, self.ntotal + assignments.shape[0], dtype=np.int64)
+        order = np.argsort(assignments, kind="stable")
+        boundaries = np.searchsorted(assignments[order], np.arange(self.nlist + 1))
+        for list_id in np.unique(assignments):
+            members = positions[order[boundaries[list_id]:boundaries[list_id + 1]]]
+            self.lists[list_id] = np.concatenate([self.lists[list_id], members])
+        self.ntotal += assignments.shape[0]
+
+    def add(self, vectors, chunk_size=65536):
+        """Append vectors whose positions continue from the current ntotal.
+
+        Assigned in chunks, so a memory-mapped or quantized matrix is never fully materialized as float32.
+        """
+        if not self.is_trained:
+            raise RuntimeError("IVF index must be trained before adding vectors")
+        for start in range(0, vectors.shape[0], chunk_size):
+            block = np.asarray(vectors[start:start + chunk_size], dtype=np.float32).reshape(-1, self.centroids.shape[1])
+            self._extend(assign(block, self.centroids))
+
+    def search(self, matrix, query, k, nprobe=None, **unused):
+        """Return (positions, scores) of the approximate top-k rows of matrix."""
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        probes = top_k(self.centroids @ query, nprobe)
+        candidates = np.concatenate([self.lists[list_id] for list_id in probes])
+        candidates = candidates[candidates < matrix.shape[0]]
+        scores = matrix[candidates] @ query
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+    def _state(self):
+        assignments = np.empty(self.ntotal, dtype=np.int64)
+        for list_id, members in enumerate(self.lists):
+            assignments[members] = list_id
+        return {"centroids": self.centroids, "assignments": assignments, "trained_size": self.trained_size}
+
+    def _restore(self, data):
+        self.centroids = data["centroids"]
+        self.nlist = self.centroids.shape[0]
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(self.nlist)]
+        self.ntotal = 0
+        self._extend(data["assignments"])
+        # Files saved before trained_size was recorded count as trained on what they held
+        self.trained_size = int(data["trained_size"]) if "trained_size" in data else self.ntotal
+
+    def save(self, path, ids):
+        with open(path, "wb") as f:
+            np.savez(f, ids=np.asarray(ids[:self.ntotal]), **self._state())
+
+    def load(self, path, ids):
+        """Restore from disk; returns False when the file does not match the given row ids."""
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            saved_ids = data["ids"]
+            if saved_ids.shape[0] > len(ids) or not np.array_equal(saved_ids, np.asarray(ids[:saved_ids.shape[0]])):
+                return False
+            self._restore(data)
+        return True
+
+
+def nearest_centroids(vectors, centroids, chunk_size=65536):
+    """Index of the closest centroid (Euclidean) for each row."""
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], chunk_size):
+        block = vectors[start:start + chunk_size]
+        labels[start:start + chunk_size] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return labels
+
+
+def train_codebooks(vectors, m, ksub=256, iterations=20, seed=0):
+    """Euclidean k-means codebook per sub-vector; returns an (m, ksub, dim / m) array."""
+    n, dim = vectors.shape
+    dsub = dim // m
+    ksub = min(ksub, n)
+    rng = np.random.default_rng(seed)
+    codebooks = np.empty((m, ksub, dsub), dtype=np.float32)
+    for j in range(m):
+        sub = np.ascontiguousarray(vectors[:, j * dsub:(j + 1) * dsub])
+        centroids = sub[rng.choice(n, ksub, replace=False)].copy()
+        for _ in range(iterations):
+            labels = nearest_centroids(sub, centroids)
+            counts = np.bincount(labels, minlength=ksub)
+            for d in range(dsub):
+                centroids[:, d] = np.bincount(labels, weights=sub[:, d], minlength=ksub)
+            filled = counts > 0
+            centroids[filled] /= counts[filled, None]
+            empty = np.flatnonzero(~filled)
+            if empty.size:
+                centroids[empty] = sub[rng.choice(n, empty.size, replace=False)]
+        codebooks[j] = centroids
+    return codebooks
+
+
+def pq_encode(vectors, codebooks):
+    m, _, dsub = codebooks.shape
+    codes = np.empty((vectors.shape[0], m), dtype=np.uint8)
+    for j in range(m):
+        codes[:, j] = nearest_centroids(vectors[:, j * dsub:(j + 1) * dsub], codebooks[j])
+    return codes
+
+
+def pq_decode(codes, codebooks):
+    return np.concatenate([codebooks[j][codes[:, j]] for j in range(codebooks.shape[0])], axis=1)
+
+
+class IVFPQIndex(IVFFlatIndex):
+    """IVF index whose vectors are stored as product-quantization codes (optionally OPQ-rotated).
+
+    Each vector costs m bytes of codes plus its inverted-list entry. Probed candidates are
+    scored with asymmetric distance (a per-query lookup table of sub-vector inner products
+    against each codebook), and the best `rerank` of them are re-scored exactly against
+    the embedding matrix, which is read from the memory-mapped embedding store on disk.
+    """
+
+    backend = "ivfpq"
+
+    def __init__(self, nlist=None, nprobe=8, m=64, rerank=100, opq=True, iterations=20,
+                 opq_iterations=8, max_train_points=256, max_pq_train_points=65536, seed=0):
+        super().__init__(nlist, nprobe, iterations, max_train_points, seed)
+        self.m = m
+        self.rerank = rerank
+        self.opq = opq
+        self.opq_iterations = opq_iterations
+        self.max_pq_train_points = max_pq_train_points
+        self.rotation = None
+        self.codebooks = None
+        self._codes = np.empty((0, m), dtype=np.uint8)
+
+    @property
+    def bytes_per_vector(self):
+        # PQ codes plus the int64 row position in its inverted list
+        return self.m + 8
+
+    def train(self, vectors):
+        n, dim = vectors.shape
+        if dim % self.m:
+            raise ValueError(f"Embedding dimension {dim} is not divisible by {self.m} PQ sub-quantizers")
+        super().train(vectors)
+        rng = np.random.default_rng(self.seed)
+        sample = vectors
+        if n > self.max_pq_train_points:
+            sample = vectors[np.sort(rng.choice(n, self.max_pq_train_points, replace=False))]
+        sample = np.asarray(sample, dtype=np.float32)
+        self.rotation = self._train_rotation(sample) if self.opq else None
+        self.codebooks = train_codebooks(self._rotate(sample), self.m, iterations=self.iterations, seed=self.seed)
+        self._codes = np.empty((0, self.m), dtype=np.uint8)
+
+    def _train_rotation(self, sample):
+        """OPQ: alternate PQ training with the orthogonal Procrustes rotation that best fits the reconstruction."""
+        sample = sample[:16384]
+        rotation = np.eye(sample.shape[1], dtype=np.float32)
+        for _ in range(self.opq_iterations):
+            rotated = sample @ rotation
+            codebooks = train_codebooks(rotated, self.m, iterations=4, seed=self.seed)
+            reconstructed = pq_decode(pq_encode(rotated, codebooks), codebooks)
+            u, _, vt = np.linalg.svd(sample.T @ reconstructed)
+            rotation = (u @ vt).astype(np.float32)
+        return rotation
+
+    def _rotate(self, vectors):
+        return vectors if self.rotation is None else vectors @ self.rotation
+
+    def add(self, vectors, chunk_size=65536):
+        """Assign and encode vectors in chunks, so a memory-mapped matrix is never fully materialized."""
+        if not self.is_trained:
+            raise RuntimeError("IVF-PQ index must be trained before adding vectors")
+        for start in range(0, vectors.shape[0], chunk_size):
+            block = np.asarray(vectors[start:start + chunk_size], dtype=np.float32).reshape(-1, self.centroids.shape[1])
+            codes = pq_encode(self._rotate(block), self.codebooks)
+            if self.ntotal + len(codes) > self._codes.shape[0]:
+                grown = np.empty((max(2 * self._codes.shape[0], self.ntotal + len(codes)), self.m), dtype=np.uint8)
+                grown[:self.ntotal] = self._codes[:self.ntotal]
+                self._codes = grown
+            self._codes[self.ntotal:self.ntotal + len(codes)] = codes
+            super().add(block)
+
+    def lookup_table(self, query):
+        """(m, ksub) inner products of each query sub-vector with its codebook."""
+        sub_queries = self._rotate(query).reshape(self.m, -1)
+        return np.einsum("mkd,md->mk", self.codebooks, sub_queries)
+
+    def adc_scores(self, lut, positions, chunk_size=65536):
+        scores = np.empty(positions.shape[0], dtype=np.float32)
+        columns = np.arange(self.m)
+        for start in range(0, positions.shape[0], chunk_size):
+            codes = self._codes[positions[start:start + chunk_size]]
+            scores[start:start + chunk_size] = lut[columns, codes].sum(axis=1)
+        return scores
+
+    def search(self, matrix, query, k, nprobe=None, rerank=None, **unused):
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        probes = top_k(self.centroids @ query, nprobe)
+        candidates = np.concatenate([self.lists[list_id] for list_id in probes])
+        candidates = candidates[candidates < matrix.shape[0]]
+        scores = self.adc_scores(self.lookup_table(query), candidates)
+        rerank = self.rerank if rerank is None else rerank
+        if rerank <= 0:
+            best = top_k(scores, k)
+            return candidates[best], scores[best]
+        # Sorted positions turn the exact re-rank into mostly forward reads of the store file
+        shortlist = np.sort(candidates[top_k(scores, max(k, rerank))])
+        exact = matrix[shortlist] @ query
+        best = top_k(exact, k)
+        return shortlist[best], exact[best]
+
+    def _state(self):
+        state = super()._state()
+        state.update(codebooks=self.codebooks, codes=self._codes[:self.ntotal])
+        if self.rotation is not None:
+            state["rotation"] = self.rotation
+        return state
+
+    def _restore(self, data):
+        self.codebooks = data["codebooks"]
+        self.m = self.codebooks.shape[0]
+        self.rotation = data["rotation"] if "rotation" in data else None
+        self.opq = self.rotation is not None
+        self._codes = np.array(data["codes"])
+        super()._restore(data)
+
+
+class FaissHNSWIndex:
+    """HNSW graph index backed by FAISS (inner product over normalized vectors)."""
+
+    backend = "faiss"
+
+    def __init__(self, m=32, ef_construction=200, ef_search=64):
+        if faiss is None:
+            raise ImportError("faiss is not installed")
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.index = None
+
+    @property
+    def is_trained(self):
+        return self.index is not None
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal if self.index is not None else 0
+
+    def outgrown(self, growth):
+        # The graph grows with the catalog, there is nothing to retrain
+        return False
+
+    def _create(self, dim):
+        self.index = faiss.IndexHNSWFlat(dim, self.m, faiss.METRIC_INNER_PRODUCT)
+        self.index.hnsw.efConstruction = self.ef_construction
+
+    def train(self, vectors):
+        self._create(vectors.shape[1])
+
+    def add(self, vectors):
+        if not self.is_trained:
+            raise RuntimeError("HNSW index must be created before adding vectors")
+        self.index.add(np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.index.d))
+
+    def search(self, matrix, query, k, ef_search=None, **unused):
+        self.index.hnsw.efSearch = max(ef_search or self.ef_search, k)
+        scores, positions = self.index.search(query.reshape(1, -1), k)
+        keep = (positions[0] >= 0) & (positions[0] < matrix.shape[0])
+        return positions[0][keep], scores[0][keep]
+
+    def save(self, path, ids):
+        faiss.write_index(self.index, path)
+        np.save(path + ".ids.npy", np.asarray(ids[:self.ntotal]))
+
+    def load(self, path, ids):
+        ids_path = path + ".ids.npy"
+        if not os.path.exists(path) or not os.path.exists(ids_path):
+            return False
+        saved_ids = np.load(ids_path)
+        if saved_ids.shape[0] > len(ids) or not np.array_equal(saved_ids, np.asarray(ids[:saved_ids.shape[0]])):
+            return False
+        self.index = faiss.read_index(path)
+        return True
+
+
+def create_ann_index(backend, **params):
+    """Build an unpopulated ANN index for ANN_BACKEND; returns None for exact search.
+
+    m is the HNSW graph degree; the IVF-PQ sub-quantizer count is passed separately as pq_m.
+    """
+    backend = (backend or "exact").lower()
+    if backend == "exact":
+        return None
+    if backend == "faiss":
+        if faiss is not None:
+            return FaissHNSWIndex(**{key: value for key, value in params.items() if key in ("m", "ef_construction", "ef_search")})
+        logger.warning("faiss is not installed, falling back to the NumPy IVF index")
+        backend = "ivf"
+    if backend == "ivf":
+        return IVFFlatIndex(**{key: value for key, value in params.items() if key in ("nlist", "nprobe")})
+    if backend == "ivfpq":
+        pq_params = {key: value for key, value in params.items() if key in ("nlist", "nprobe", "rerank", "opq")}
+        if "pq_m" in params:
+            pq_params["m"] = params["pq_m"]
+        return IVFPQIndex(**pq_params)
+    raise ValueError(f"Unknown ANN backend: {backend}")
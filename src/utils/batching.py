@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+
+
+class BatchScheduler:
+    """Collects concurrent requests into batches for a synchronous batch function.
+
+    A background task waits for the first pending item, then keeps gathering until
+    max_batch_size items are queued or max_wait_ms has elapsed, runs
+    process_batch(items) in an executor and resolves each caller's future with its
+    own result.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=20, executor=None):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000
+        self.executor = executor
+        self._queue = None
+        self._worker = None
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+
+    def _ensure_started(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _record(self, batch, started):
+        waits = [started - enqueued for _, _, enqueued in batch]
+        with self._stats_lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._queue_wait_total += sum(waits)
+            self._queue_wait_max = max(self._queue_wait_max, max(waits))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            batch = [entry for entry in batch if not entry[1].cancelled()]
+            if not batch:
+                continue
+            self._record(batch, time.perf_counter())
+            items = [item for item, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.process_batch, items)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        with self._stats_lock:
+            batches = self._batches
+            items = self._items
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": batches,
+                "items": items,
+                "pending": self._queue.qsize() if self._queue is not None else 0,
+                "mean_batch_size": items / batches if batches else 0.0,
+                "batch_fill_ratio": items / (batches * self.max_batch_size) if batches else 0.0,
+                "mean_queue_wait_ms": 1000 * self._queue_wait_total / items if items else 0.0,
+                "max_queue_wait_ms": 1000 * self._queue_wait_max,
+            }
@@ -1,14 +1,202 @@
+import logging
 import sqlite3
 import os
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 
-def connection():
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    src_dir = os.path.dirname(current_dir)
-    db_path = os.path.join(src_dir, 'images.db')
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+logger = logging.getLogger(__name__)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.dirname(current_dir)
+DB_PATH = os.path.join(src_dir, 'images.db')
+
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "64"))
+DB_WRITE_WAIT_MS = float(os.getenv("DB_WRITE_WAIT_MS", "2"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "65536"))
+
+def configure(conn):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=5000")
     return conn
 
+def connection(db_path=None, **kwargs):
+    conn = sqlite3.connect(db_path or DB_PATH, **kwargs)
+    conn.row_factory = sqlite3.Row
+    return configure(conn)
+
+class ReadPool:
+    """Fixed set of read connections shared across threads, one borrower at a time."""
+
+    def __init__(self, size, db_path=None):
+        self.size = max(1, size)
+        self.db_path = db_path
+        self._connections = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._connections.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            conn = connection(self.db_path, check_same_thread=False) if create else self._connections.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._connections.put(conn)
+
+class WriteQueue:
+    """Single writer thread that group-commits queued write jobs.
+
+    Each job is a callable taking the writer connection. Jobs that arrive together run
+    in one transaction, each inside its own savepoint so a failing job does not roll
+    back the others.
+    """
+
+    def __init__(self, batch_size=64, wait_ms=2, db_path=None):
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.wait = max(0, wait_ms) / 1000
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.commits = 0
+        self.jobs = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, job):
+        self._ensure_started()
+        future = Future()
+        self._jobs.put((job, future))
+        return future
+
+    def execute(self, job):
+        return self.submit(job).result()
+
+    def _collect(self):
+        batch = [self._jobs.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._jobs.get(timeout=self.wait) if self.wait else self._jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = connection(self.db_path, check_same_thread=False, isolation_level=None)
+        while True:
+            batch = self._collect()
+            results = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for job, _ in batch:
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        results.append((job(conn), None))
+                        conn.execute("RELEASE job")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO job")
+                        conn.execute("RELEASE job")
+                        results.append((None, e))
+                conn.execute("COMMIT")
+                self.commits += 1
+                self.jobs += len(batch)
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                results = [(None, e)] * len(batch)
+            for (_, future), (result, error) in zip(batch, results):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            "commits": self.commits,
+            "jobs": self.jobs,
+            "pending": self._jobs.qsize(),
+            "jobs_per_commit": self.jobs / self.commits if self.commits else 0.0,
+        }
+
+read_pool = ReadPool(DB_READ_POOL_SIZE)
+write_queue = WriteQueue(DB_WRITE_BATCH_SIZE, DB_WRITE_WAIT_MS)
+
+def read_connection():
+    return read_pool.connection()
+
+def write(job):
+    """Run job(conn) on the single writer connection; blocks until its group commit completes."""
+    return write_queue.execute(job)
+
+def create_jobs_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            filename TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            tier TEXT NOT NULL,
+            webhook_url TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            image_id INTEGER,
+            caption TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+
+def create_caption_index(cursor):
+    """FTS5 index over images.caption (external content), kept in sync by triggers."""
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'images_fts'").fetchone()
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+            caption, content='images', content_rowid='id', tokenize='porter unicode61', prefix='2 3'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images BEGIN
+            INSERT INTO images_fts (rowid, caption) VALUES (new.id, new.caption);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images BEGIN
+            INSERT INTO images_fts (images_fts, rowid, caption) VALUES ('delete', old.id, old.caption);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_fts_update AFTER UPDATE OF caption ON images BEGIN
+            INSERT INTO images_fts (images_fts, rowid, caption) VALUES ('delete', old.id, old.caption);
+            INSERT INTO images_fts (rowid, caption) VALUES (new.id, new.caption);
+        END
+    """)
+    if not exists:
+        # Index captions written before the table existed
+        cursor.execute("INSERT INTO images_fts (images_fts) VALUES ('rebuild')")
+
 def initialize_db():
     conn = connection()
     cursor = conn.cursor()
@@ -25,5 +213,25 @@ def initialize_db():
         cursor.execute("ALTER TABLE images ADD COLUMN caption TEXT NOT NULL DEFAULT ''")
     if 'embedding' not in columns:
         cursor.execute("ALTER TABLE images ADD COLUMN embedding BLOB NOT NULL DEFAULT ''")
+    if 'content_hash' not in columns:
+        cursor.execute("ALTER TABLE images ADD COLUMN content_hash TEXT")
+    if 'perceptual_hash' not in columns:
+        cursor.execute("ALTER TABLE images ADD COLUMN perceptual_hash INTEGER")
+    # Search filter metadata; NULL for images uploaded before these columns existed
+    for column, column_type in (("uploader", "TEXT"), ("uploaded_at", "REAL"), ("width", "INTEGER"),
+                                ("height", "INTEGER"), ("mime_type", "TEXT")):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE images ADD COLUMN {column} {column_type}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_content_hash ON images (content_hash)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_perceptual_hash ON images (perceptual_hash)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_uploader ON images (uploader, uploaded_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_uploaded_at ON images (uploaded_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_mime_type ON images (mime_type)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_dimensions ON images (width, height)")
+    create_jobs_table(cursor)
+    try:
+        create_caption_index(cursor)
+    except sqlite3.OperationalError as e:
+        logger.warning("Keyword search unavailable, SQLite was built without FTS5", extra={"error": str(e)})
     conn.commit()
     conn.close()
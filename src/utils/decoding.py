@@ -0,0 +1,40 @@
+import time
+
+DECODING_STRATEGIES = ("greedy", "beam", "length_penalty")
+
+
+def decoding_config(strategy, num_beams=5, length_penalty=1.0, max_length=50):
+    """generate() keyword arguments for a decoding strategy.
+
+    greedy runs a single hypothesis, beam keeps num_beams hypotheses with neutral length
+    normalization, and length_penalty is beam search with the given length_penalty
+    exponent (> 1 favours longer captions, < 1 shorter ones).
+    """
+    strategy = strategy.lower()
+    if strategy == "greedy":
+        return {"max_length": max_length, "num_beams": 1}
+    if strategy == "beam":
+        return {"max_length": max_length, "num_beams": max(2, num_beams), "length_penalty": 1.0}
+    if strategy == "length_penalty":
+        return {"max_length": max_length, "num_beams": max(2, num_beams), "length_penalty": length_penalty}
+    raise ValueError(f"Unknown decoding strategy: {strategy} (expected one of {', '.join(DECODING_STRATEGIES)})")
+
+
+def check_kv_cache(generate, max_length=20):
+    """Run generate(use_cache=..., max_length=...) with and without the KV cache and compare.
+
+    With the cache each decoding step only feeds the newest token through the decoder, so the
+    outputs must be identical and the cached run should be faster.
+    """
+    timings = {}
+    outputs = {}
+    for use_cache in (True, False):
+        start = time.perf_counter()
+        outputs[use_cache] = generate(use_cache=use_cache, max_length=max_length)
+        timings[use_cache] = time.perf_counter() - start
+    return {
+        "matches": outputs[True] == outputs[False],
+        "cached_seconds": round(timings[True], 3),
+        "uncached_seconds": round(timings[False], 3),
+        "speedup": round(timings[False] / timings[True], 2) if timings[True] else None,
+    }
@@ -0,0 +1,80 @@
+import hashlib
+import threading
+import numpy as np
+from PIL import Image
+
+
+def content_hash(image_data):
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def dhash(image, hash_size=8):
+    """64-bit difference hash, stable across re-encodes and small resizes of the same picture."""
+    small = np.asarray(image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = int(np.packbits(bits).view('>u8')[0])
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class PerceptualHashIndex:
+    """In-memory dHash table for near-duplicate lookup by Hamming distance."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashes = np.empty(0, dtype=np.int64)
+        self._ids = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return self._ids.shape[0]
+
+    def load(self, rows):
+        rows = [(image_id, value) for image_id, value in rows if value is not None]
+        with self._lock:
+            self._ids = np.array([image_id for image_id, _ in rows], dtype=np.int64)
+            self._hashes = np.array([value for _, value in rows], dtype=np.int64)
+
+    def add(self, image_id, value):
+        if value is None:
+            return
+        with self._lock:
+            self._ids = np.append(self._ids, np.int64(image_id))
+            self._hashes = np.append(self._hashes, np.int64(value))
+
+    def find(self, value, max_distance):
+        """Id of the closest stored hash within max_distance bits, or None."""
+        with self._lock:
+            hashes, ids = self._hashes, self._ids
+        if hashes.shape[0] == 0:
+            return None
+        distances = np.bitwise_count(np.bitwise_xor(hashes, np.int64(value)).view(np.uint64))
+        best = int(np.argmin(distances))
+        if distances[best] > max_distance:
+            return None
+        return int(ids[best])
+
+
+class DedupStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.exact_hits = 0
+        self.perceptual_hits = 0
+
+    def record(self, hit=None):
+        with self._lock:
+            self.lookups += 1
+            if hit == "exact":
+                self.exact_hits += 1
+            elif hit == "perceptual":
+                self.perceptual_hits += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.perceptual_hits
+            return {
+                "lookups": self.lookups,
+                "exact_hits": self.exact_hits,
+                "perceptual_hits": self.perceptual_hits,
+                "hit_rate": hits / self.lookups if self.lookups else 0.0,
+            }
@@ -0,0 +1,316 @@
+import threading
+import numpy as np
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first, without a full sort."""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def top_k_rows(scores, k):
+    """top_k() for every row of a 2-D score matrix; returns (indices, scores), each (rows, min(k, n))."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0), dtype=np.int64)
+        return empty, empty.astype(scores.dtype)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < n else np.tile(np.arange(n), (scores.shape[0], 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
+
+
+class EmbeddingIndex:
+    """Resident, L2-normalized float32 embedding matrix with parallel id/filename/caption arrays.
+
+    Rows are appended in place (the backing matrix grows geometrically), so uploads
+    never force a rebuild from SQLite and a search is a single matrix-vector product.
+    With attach_store() the vectors live in a memory-mapped EmbeddingStore instead and
+    only the name arrays stay resident.
+    """
+
+    def __init__(self, initial_capacity=1024):
+        self._lock = threading.Lock()
+        self._initial_capacity = initial_capacity
+        self.dim = None
+        self.size = 0
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self.filenames = []
+        self.captions = []
+        self.loaded = False
+        self.ann = None
+        self.store = None
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, needed):
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(self._initial_capacity, capacity)
+        while new_capacity < needed:
+            new_capacity *= 2
+        matrix = np.empty((new_capacity, self.dim), dtype=np.float32)
+        matrix[:self.size] = self._matrix[:self.size]
+        ids = np.empty(new_capacity, dtype=np.int64)
+        ids[:self.size] = self._ids[:self.size]
+        self._matrix = matrix
+        self._ids = ids
+
+    def _parse(self, embedding):
+        if isinstance(embedding, (bytes, bytearray, memoryview)):
+            if len(embedding) == 0 or len(embedding) % 4:
+                return None
+            vector = np.frombuffer(embedding, dtype=np.float32)
+        else:
+            vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if self.dim is not None and vector.shape[0] != self.dim:
+            return None
+        return vector
+
+    def load(self, rows):
+        """Replace the index contents with rows of (id, filename, caption, embedding)."""
+        ids, filenames, captions, vectors = [], [], [], []
+        dim = None
+        for image_id, filename, caption, embedding in rows:
+            if not embedding or len(embedding) % 4:
+                continue
+            length = len(embedding) // 4
+            if dim is None:
+                dim = length
+            elif length != dim:
+                continue
+            ids.append(image_id)
+            filenames.append(filename)
+            captions.append(caption)
+            vectors.append(bytes(embedding))
+        with self._lock:
+            self.dim = dim
+            self.size = 0
+            self._matrix = np.empty((0, dim or 0), dtype=np.float32)
+            self._ids = np.empty(0, dtype=np.int64)
+            self.filenames = []
+            self.captions = []
+            self.store = None
+            if vectors:
+                matrix = np.frombuffer(b"".join(vectors), dtype=np.float32).reshape(len(vectors), dim)
+                self._reserve(len(vectors))
+                self._matrix[:len(vectors)] = normalize(matrix)
+                self._ids[:len(vectors)] = ids
+                self.filenames = filenames
+                self.captions = captions
+                self.size = len(vectors)
+            self.ann = None
+            self.loaded = True
+
+    def attach_store(self, store, rows):
+        """Replace the index contents with the vectors of store and (id, filename, caption) rows.
+
+        Store rows without a matching entry in rows are kept out of search results.
+        """
+        with self._lock:
+            self.store = store
+            self.dim = store.dim
+            self.size = store.count
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+            self._ids = np.empty(0, dtype=np.int64)
+            self.filenames = [None] * self.size
+            self.captions = [None] * self.size
+            for image_id, filename, caption in rows:
+                position = store.position(image_id)
+                if position is not None and position < self.size:
+                    self.filenames[position] = filename
+                    self.captions[position] = caption
+            self.ann = None
+            self.loaded = True
+
+    def _add_stored(self, image_id, filename, caption):
+        position = self.store.position(image_id)
+        if position is None:
+            return False
+        with self._lock:
+            count = self.store.count
+            if count > len(self.filenames):
+                padding = [None] * (count - len(self.filenames))
+                self.filenames.extend(padding)
+                self.captions.extend(padding)
+            self.filenames[position] = filename
+            self.captions[position] = caption
+            if count > self.size:
+                self.dim = self.store.dim
+                if self.ann is not None:
+                    self.ann.add(self.store.vectors[self.size:count])
+                self.size = count
+            return True
+
+    def add(self, image_id, filename, caption, embedding):
+        """Append a single row; returns False if the embedding does not fit the index.
+
+        In store mode the vector must already have been appended to the store.
+        """
+        if self.store is not None:
+            return self._add_stored(image_id, filename, caption)
+        with self._lock:
+            vector = self._parse(embedding)
+            if vector is None:
+                return False
+            if self.dim is None:
+                self.dim = vector.shape[0]
+                self._matrix = np.empty((0, self.dim), dtype=np.float32)
+            self._reserve(self.size + 1)
+            self._matrix[self.size] = normalize(vector)
+            self._ids[self.size] = image_id
+            self.filenames.append(filename)
+            self.captions.append(caption)
+            self.size += 1
+            if self.ann is not None:
+                self.ann.add(self._matrix[self.size - 1:self.size])
+            return True
+
+    def attach_ann(self, ann, path=None, train=True):
+        """Put an ANN index in front of exact search, restoring it from path when it matches.
+
+        Returns "loaded", "built" or None (left on exact search).
+        """
+        # Training and adding the snapshot rows run outside the lock so searches and uploads are not
+        # blocked meanwhile; only rows appended in the meantime are added under the lock before attaching.
+        matrix, ids, _, _ = self.snapshot()
+        state = None
+        if path and ann.load(path, ids):
+            state = "loaded"
+        elif train and matrix.shape[0] > 0:
+            ann.train(matrix)
+            state = "built"
+        if state is None:
+            return None
+        if ann.ntotal < matrix.shape[0]:
+            ann.add(matrix[ann.ntotal:])
+        with self._lock:
+            if ann.ntotal < self.size:
+                ann.add(self._vectors()[ann.ntotal:self.size])
+            self.ann = ann
+            return state
+
+    def save_ann(self, path):
+        with self._lock:
+            if self.ann is None:
+                return False
+            self.ann.save(path, self._row_ids()[:self.size])
+            return True
+
+    def _vectors(self):
+        return self.store.vectors if self.store is not None else self._matrix
+
+    def _row_ids(self):
+        return self.store.ids if self.store is not None else self._ids
+
+    def snapshot(self):
+        with self._lock:
+            n = self.size
+            # The name lists are only ever appended to (or filled in, in store mode), so handing
+            # out the live lists is safe for positions below n and avoids copying them on every query.
+            return self._vectors()[:n], self._row_ids()[:n], self.filenames, self.captions
+
+    def search_batch(self, queries, k=3, exact=False, ids=None, max_scores=1 << 25, **search_params):
+        """search() for a (queries, dim) matrix; returns one result list per query.
+
+        Exact scoring is a single matrix-matrix product, split into query blocks so the score
+        matrix stays under max_scores floats. With an ANN index attached (and no ids filter)
+        the queries go through the ANN index one by one.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.shape[0] == 0:
+            return []
+        matrix, row_ids, filenames, captions = self.snapshot()
+        if matrix.shape[0] == 0:
+            return [[] for _ in range(queries.shape[0])]
+        queries = normalize(queries.reshape(queries.shape[0], -1))
+        if queries.shape[1] != matrix.shape[1]:
+            raise ValueError(f"Query dimension {queries.shape[1]} does not match index dimension {matrix.shape[1]}")
+        if self.ann is not None and not exact and ids is None:
+            return [self.search(query, k, **search_params) for query in queries]
+        positions = None
+        if ids is not None:
+            positions = np.flatnonzero(np.isin(row_ids, ids))
+            matrix = matrix[positions]
+        if matrix.shape[0] == 0:
+            return [[] for _ in range(queries.shape[0])]
+        block = max(1, max_scores // matrix.shape[0])
+        results = []
+        for start in range(0, queries.shape[0], block):
+            scores = np.ascontiguousarray((matrix @ queries[start:start + block].T).T)
+            best, best_scores = top_k_rows(scores, k)
+            if positions is not None:
+                best = positions[best]
+            for row_positions, row_scores in zip(best, best_scores):
+                results.append([
+                    (float(score), int(row_ids[i]), filenames[i], captions[i])
+                    for score, i in zip(row_scores, row_positions)
+                    if filenames[i] is not None
+                ])
+        return results
+
+    def vector(self, image_id):
+        """Normalized embedding of an indexed image, or None; read straight from the index, no inference."""
+        matrix, row_ids, filenames, _ = self.snapshot()
+        if self.store is not None:
+            position = self.store.position(image_id)
+            if position is None or position >= matrix.shape[0]:
+                return None
+        else:
+            positions = np.flatnonzero(row_ids == image_id)
+            if positions.size == 0:
+                return None
+            position = positions[-1]
+        if filenames[position] is None:
+            return None
+        return np.array(matrix[position], dtype=np.float32)
+
+    def search(self, query, k=3, exact=False, ids=None, **search_params):
+        """Return up to k (similarity, id, filename, caption) tuples, most similar first.
+
+        With ids, only rows with those image ids are scored (exactly, bypassing the ANN index).
+        search_params (nprobe, ef_search, rerank) are forwarded to the attached ANN index.
+        """
+        ann = None if exact or ids is not None else self.ann
+        matrix, row_ids, filenames, captions = self.snapshot()
+        if matrix.shape[0] == 0:
+            return []
+        query = normalize(np.asarray(query, dtype=np.float32).reshape(-1))
+        if query.shape[0] != matrix.shape[1]:
+            raise ValueError(f"Query dimension {query.shape[0]} does not match index dimension {matrix.shape[1]}")
+        if ids is not None:
+            # Pre-filter: the id comparison is far cheaper than scoring every row
+            positions = np.flatnonzero(np.isin(row_ids, ids))
+            scores = np.empty(positions.shape[0], dtype=np.float32)
+            for start in range(0, positions.shape[0], 65536):
+                scores[start:start + 65536] = matrix[positions[start:start + 65536]] @ query
+            best = top_k(scores, k)
+            positions, scores = positions[best], scores[best]
+        elif ann is not None:
+            positions, scores = ann.search(matrix, query, k, **search_params)
+        else:
+            scores = matrix @ query
+            positions = top_k(scores, k)
+            scores = scores[positions]
+        return [
+            (float(score), int(row_ids[i]), filenames[i], captions[i])
+            for score, i in zip(scores, positions)
+            if filenames[i] is not None
+        ]
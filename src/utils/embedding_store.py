@@ -0,0 +1,287 @@
+import fcntl
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+from utils.embedding_index import normalize
+
+STORE_DTYPES = {"float16": "<f2", "int8": "i1"}
+MAGIC = b"IMGEMB01"
+HEADER = np.dtype([("magic", "S8"), ("dtype", "S8"), ("dim", "<u4"), ("reserved", "<u4"), ("count", "<u8"), ("padding", "V32")])
+
+
+def default_store_path(db_path, dtype):
+    return os.path.splitext(db_path)[0] + f".{dtype}.embeddings"
+
+
+class QuantizedMatrix:
+    """Read-only float32 view over quantized rows (vector * per-row scale).
+
+    Slicing returns another view without copying; indexing with positions and matrix
+    products dequantize chunk by chunk, so the full float32 matrix never exists in memory.
+    """
+
+    def __init__(self, vectors, scales, chunk_rows=1024):
+        self.vectors = vectors
+        self.scales = scales
+        self.chunk_rows = chunk_rows
+        self.dtype = np.dtype(np.float32)
+
+    @property
+    def shape(self):
+        return self.vectors.shape
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return QuantizedMatrix(self.vectors[key], self.scales[key], self.chunk_rows)
+        rows = np.array(self.vectors[key], dtype=np.float32)
+        rows *= np.asarray(self.scales[key], dtype=np.float32)[..., None]
+        return rows
+
+    def __matmul__(self, other):
+        other = np.asarray(other, dtype=np.float32)
+        out = np.empty((len(self),) + other.shape[1:], dtype=np.float32)
+        for start in range(0, len(self), self.chunk_rows):
+            stop = start + self.chunk_rows
+            block = np.asarray(self.vectors[start:stop], dtype=np.float32) @ other
+            scales = self.scales[start:stop]
+            out[start:stop] = block * (scales[:, None] if block.ndim == 2 else scales)
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        rows = self[np.arange(len(self))]
+        return rows if dtype is None else rows.astype(dtype)
+
+
+class EmbeddingStore:
+    """Append-only, memory-mapped sidecar file of L2-normalized embeddings.
+
+    Layout: a 64-byte header (magic, dtype, dim, row count) followed by fixed-size
+    records of (image id, scale, vector). float16 rows store the vector directly
+    (scale 1); int8 rows store round(vector / scale) with scale = max|vector| / 127.
+    Rows are addressed by image id through an in-memory id -> position map rebuilt
+    from the id column on open. The file grows geometrically and is only ever
+    appended to while serving, so readers can keep using an older mapping. Appends
+    take an exclusive flock, so the API and index_directory.py can write concurrently.
+    """
+
+    def __init__(self, path, dtype="float16"):
+        if dtype not in STORE_DTYPES:
+            raise ValueError(f"Unknown embedding store dtype: {dtype} (expected one of {', '.join(STORE_DTYPES)})")
+        self.path = path
+        self.dtype = dtype
+        self.dim = None
+        self.count = 0
+        self._lock = threading.Lock()
+        self._header = None
+        self._records = None
+        self._inode = None
+        self._positions = {}
+        if os.path.exists(path):
+            self._open()
+
+    def __len__(self):
+        return self.count
+
+    def _record_dtype(self, dim):
+        return np.dtype([("id", "<i8"), ("scale", "<f4"), ("vector", STORE_DTYPES[self.dtype], (dim,))])
+
+    def _open(self):
+        header = np.memmap(self.path, dtype=HEADER, mode="r+", shape=(1,))
+        if header["magic"][0] != MAGIC:
+            raise ValueError(f"{self.path} is not an embedding store")
+        stored_dtype = header["dtype"][0].decode()
+        if stored_dtype != self.dtype:
+            raise ValueError(f"{self.path} holds {stored_dtype} embeddings, not {self.dtype}; remove it or migrate again")
+        self._header = header
+        self._inode = os.stat(self.path).st_ino
+        self.dim = int(header["dim"][0])
+        self.count = int(header["count"][0])
+        self._map()
+        self._positions = {int(image_id): position for position, image_id in enumerate(self._records["id"][:self.count])}
+
+    def _map(self):
+        record = self._record_dtype(self.dim)
+        capacity = (os.path.getsize(self.path) - HEADER.itemsize) // record.itemsize
+        self._records = np.memmap(self.path, dtype=record, mode="r+", offset=HEADER.itemsize, shape=(capacity,))
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Pick up rows appended by another process since this one last looked."""
+        if self._header is None or os.stat(self.path).st_ino != self._inode:
+            # Not created yet when this process opened it, or compacted and replaced since
+            if os.path.exists(self.path):
+                self._open()
+            return
+        count = int(self._header["count"][0])
+        if count <= self.count:
+            return
+        if count > self._records.shape[0]:
+            self._map()
+        for offset, image_id in enumerate(self._records["id"][self.count:count]):
+            self._positions[int(image_id)] = self.count + offset
+        self.count = count
+
+    def _create(self, dim):
+        header = np.zeros(1, dtype=HEADER)
+        header["magic"] = MAGIC
+        header["dtype"] = self.dtype.encode()
+        header["dim"] = dim
+        with open(self.path, "wb") as f:
+            f.write(header.tobytes())
+            f.truncate(HEADER.itemsize + 1024 * self._record_dtype(dim).itemsize)
+        self._open()
+
+    def _reserve(self, needed):
+        capacity = self._records.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER.itemsize + capacity * self._records.dtype.itemsize)
+        self._map()
+
+    def append(self, ids, vectors):
+        """Quantize and append rows; returns their positions."""
+        vectors = normalize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        with self._lock, self._file_lock():
+            self._refresh()
+            if self.dim is None:
+                self._create(vectors.shape[1])
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {self.dim}")
+            start = self.count
+            self._reserve(start + len(ids))
+            records = self._records[start:start + len(ids)]
+            records["id"] = ids
+            if self.dtype == "int8":
+                scales = np.abs(vectors).max(axis=1) / 127
+                scales[scales == 0] = 1.0
+                records["vector"] = np.rint(vectors / scales[:, None])
+                records["scale"] = scales
+            else:
+                records["vector"] = vectors
+                records["scale"] = 1.0
+            self._records.flush()
+            # The row count is published only after the rows themselves are on disk
+            self.count = start + len(ids)
+            self._header["count"] = self.count
+            self._header.flush()
+            for offset, image_id in enumerate(ids):
+                self._positions[int(image_id)] = start + offset
+            return list(range(start, self.count))
+
+    def position(self, image_id):
+        return self._positions.get(int(image_id))
+
+    def __contains__(self, image_id):
+        return int(image_id) in self._positions
+
+    def get(self, image_id):
+        """Dequantized float32 vector for an image id, or None."""
+        position = self.position(image_id)
+        if position is None:
+            return None
+        return self.vectors[position]
+
+    @property
+    def vectors(self):
+        records = self._records
+        count = self.count
+        if records is None:
+            return QuantizedMatrix(np.empty((0, self.dim or 0), dtype=STORE_DTYPES[self.dtype]), np.empty(0, dtype=np.float32))
+        return QuantizedMatrix(records["vector"][:count], records["scale"][:count])
+
+    @property
+    def ids(self):
+        if self._records is None:
+            return np.empty(0, dtype=np.int64)
+        return self._records["id"][:self.count]
+
+    def compact(self, valid_ids):
+        """Drop rows whose id is not in valid_ids and all but the last row per id; returns rows removed.
+
+        Such rows only appear when a write transaction failed after its embeddings were
+        appended. Must not run while other threads use the store.
+        """
+        with self._lock, self._file_lock():
+            self._refresh()
+            if self._records is None:
+                return 0
+            ids = self._records["id"][:self.count]
+            keep = np.zeros(self.count, dtype=bool)
+            keep[list(self._positions.values())] = True
+            keep &= np.isin(ids, np.fromiter(valid_ids, dtype=np.int64))
+            removed = int(self.count - keep.sum())
+            if removed == 0:
+                return 0
+            kept = np.array(self._records[:self.count][keep])
+            tmp_path = f"{self.path}.tmp"
+            header = np.array(self._header)
+            header["count"] = len(kept)
+            with open(tmp_path, "wb") as f:
+                f.write(header.tobytes())
+                f.write(kept.tobytes())
+            self._records = None
+            self._header = None
+            os.replace(tmp_path, self.path)
+            self._open()
+            return removed
+
+
+def migrate_sqlite_embeddings(store, db_path, clear=False, batch_size=4096, vacuum=False):
+    """Copy float32 embedding BLOBs that are not yet in the store into it.
+
+    With clear=True the copied BLOBs are then emptied (and the database optionally
+    vacuumed to return the space). Returns (copied, cleared).
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        copied = 0
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                "SELECT id, embedding FROM images WHERE id > ? AND length(embedding) > 0 ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            ids, vectors = [], []
+            for image_id, embedding in rows:
+                if image_id in store or len(embedding) % 4:
+                    continue
+                vector = np.frombuffer(embedding, dtype=np.float32)
+                if store.dim is not None and vector.shape[0] != store.dim:
+                    continue
+                ids.append(image_id)
+                vectors.append(vector)
+            if ids:
+                store.append(ids, np.stack(vectors))
+                copied += len(ids)
+        cleared = 0
+        if clear:
+            stored = [(image_id,) for image_id in store.ids.tolist()]
+            with conn:
+                before = conn.total_changes
+                conn.executemany("UPDATE images SET embedding = X'' WHERE id = ? AND length(embedding) > 0", stored)
+                cleared = conn.total_changes - before
+            if vacuum:
+                conn.execute("VACUUM")
+        return copied, cleared
+    finally:
+        conn.close()
@@ -0,0 +1,33 @@
+from datetime import timezone
+
+
+def utc_timestamp(value):
+    """Unix timestamp of a datetime; naive values are taken as UTC, aware ones are converted to it."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).timestamp()
+
+
+def metadata_filter(uploader=None, uploaded_after=None, uploaded_before=None, min_width=None, max_width=None,
+                    min_height=None, max_height=None, mime_types=None):
+    """SQL condition over the indexed images metadata columns and its parameters.
+
+    Returns ("", []) when no filter is set. Times are Unix timestamps and bounds are inclusive.
+    """
+    conditions, params = [], []
+    for condition, value in (
+        ("images.uploader = ?", uploader),
+        ("images.uploaded_at >= ?", uploaded_after),
+        ("images.uploaded_at <= ?", uploaded_before),
+        ("images.width >= ?", min_width),
+        ("images.width <= ?", max_width),
+        ("images.height >= ?", min_height),
+        ("images.height <= ?", max_height),
+    ):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    if mime_types:
+        conditions.append(f"images.mime_type IN ({', '.join('?' for _ in mime_types)})")
+        params.extend(mime_types)
+    return " AND ".join(conditions), params
@@ -0,0 +1,41 @@
+import heapq
+
+FUSION_METHODS = ("rrf", "weighted")
+
+
+def min_max(scores):
+    """Scale scores to [0, 1]; a list of equal scores maps to 1."""
+    if not scores:
+        return []
+    low, high = min(scores), max(scores)
+    if high == low:
+        return [1.0] * len(scores)
+    return [(score - low) / (high - low) for score in scores]
+
+
+def fuse(vector_matches, keyword_matches, k=3, method="rrf", vector_weight=0.5, rrf_k=60):
+    """Merge (score, id, filename, caption[, snippet]) result lists from the vector and keyword paths.
+
+    rrf adds vector_weight / (rrf_k + rank) and (1 - vector_weight) / (rrf_k + rank) over the two
+    rankings. weighted adds the min-max normalized scores with the same weights. Images found by only
+    one path get no contribution from the other. Returns up to k dicts, best first.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method: {method}")
+    merged = {}
+    for weight, matches, source in ((vector_weight, vector_matches, "vector"), (1 - vector_weight, keyword_matches, "keyword")):
+        if method == "rrf":
+            contributions = [weight / (rrf_k + rank) for rank in range(1, len(matches) + 1)]
+        else:
+            contributions = [weight * score for score in min_max([match[0] for match in matches])]
+        for contribution, match in zip(contributions, matches):
+            score, image_id, filename, caption = match[:4]
+            entry = merged.setdefault(image_id, {
+                "id": image_id, "filename": filename, "caption": caption, "similarity": 0.0,
+                "vector_score": None, "keyword_score": None, "snippet": None,
+            })
+            entry["similarity"] += contribution
+            entry[f"{source}_score"] = score
+            if source == "keyword":
+                entry["snippet"] = match[4]
+    return heapq.nlargest(k, merged.values(), key=lambda entry: entry["similarity"])
@@ -0,0 +1,66 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class InferenceQueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+def torch_threads_per_worker(workers):
+    """Split the CPU cores between inference workers so concurrent forward passes do not oversubscribe."""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+class InferencePool:
+    """Bounded thread pool for model inference with request-level admission control.
+
+    Requests enter through admit(); once max_pending requests are in flight, new ones
+    are rejected with InferenceQueueFull instead of queueing without bound.
+    """
+
+    def __init__(self, workers=1, max_pending=32, retry_after=1):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @contextmanager
+    def admit(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise InferenceQueueFull(self.retry_after)
+            self._pending += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "rejected": self._rejected,
+        }
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+from utils.database import read_connection, write
+
+JOB_STATUSES = ("pending", "processing", "done", "failed")
+
+JOB_COLUMNS = "id, username, filename, tier, status, attempts, image_id, caption, error, created_at, updated_at"
+
+
+def webhook_allowed(url, allowed_hosts):
+    """True when url is http(s) to a host in allowed_hosts; an entry starting with "." also matches subdomains."""
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+    except ValueError:
+        return False
+    if parts.scheme not in ("http", "https") or not host:
+        return False
+    return any(host == allowed or (allowed.startswith(".") and host.endswith(allowed)) for allowed in allowed_hosts)
+
+
+class JobQueue:
+    """Durable upload queue backed by the jobs table.
+
+    Workers claim the oldest pending job atomically through the single writer, so a job
+    is processed once even with several workers. Jobs left in 'processing' by a crash or
+    restart are put back to 'pending' by requeue_interrupted(), unless they already used
+    max_attempts (a job that crashes the worker would otherwise retry forever). Waiters are woken in-process
+    when a job finishes and re-check the table at least every poll_interval seconds.
+    """
+
+    def __init__(self, max_attempts=3, poll_interval=1.0, write=write, read_connection=read_connection):
+        self.max_attempts = max(1, max_attempts)
+        self.poll_interval = poll_interval
+        self._write = write
+        self._read_connection = read_connection
+        self._condition = None
+        self._loop = None
+
+    def _changed(self):
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition, self._loop = asyncio.Condition(), loop
+        return self._condition
+
+    async def notify(self):
+        condition = self._changed()
+        async with condition:
+            condition.notify_all()
+
+    async def wait_for_change(self, timeout):
+        condition = self._changed()
+        async with condition:
+            try:
+                await asyncio.wait_for(condition.wait(), min(timeout, self.poll_interval))
+            except asyncio.TimeoutError:
+                pass
+
+    def create(self, username, filename, file_path, content_hash, tier, webhook_url=None):
+        now = time.time()
+        return self._write(lambda conn: conn.execute("""
+            INSERT INTO jobs (username, filename, file_path, content_hash, tier, webhook_url, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (username, filename, file_path, content_hash, tier, webhook_url, now, now)).lastrowid)
+
+    def claim(self):
+        """Mark the oldest pending job as processing and return it, or None when the queue is empty."""
+        rows = self._write(lambda conn: conn.execute("""
+            UPDATE jobs SET status = 'processing', attempts = attempts + 1, updated_at = ?
+            WHERE id = (SELECT id FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1)
+            RETURNING id, username, filename, file_path, content_hash, tier, webhook_url, attempts
+        """, (time.time(),)).fetchall())
+        return dict(rows[0]) if rows else None
+
+    def complete(self, job_id, image_id, caption):
+        self._update(job_id, "done", image_id=image_id, caption=caption, error=None)
+
+    def fail(self, job_id, error, attempts):
+        """Record a failed attempt; the job goes back to pending until max_attempts is reached."""
+        status = "failed" if attempts >= self.max_attempts else "pending"
+        self._update(job_id, status, error=str(error))
+        return status
+
+    def release(self, job_id):
+        """Put a claimed job back without counting the attempt (e.g. the inference pool was full)."""
+        self._write(lambda conn: conn.execute(
+            "UPDATE jobs SET status = 'pending', attempts = attempts - 1, updated_at = ? WHERE id = ?",
+            (time.time(), job_id)
+        ))
+
+    def requeue_interrupted(self):
+        """Return interrupted jobs to pending; returns (requeued count, jobs marked failed instead)."""
+        def requeue(conn):
+            now = time.time()
+            failed = conn.execute("""
+                UPDATE jobs SET status = 'failed', error = 'Interrupted during processing too many times', updated_at = ?
+                WHERE status = 'processing' AND attempts >= ?
+                RETURNING id, username, filename, file_path, content_hash, tier, webhook_url, attempts
+            """, (now, self.max_attempts)).fetchall()
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'pending', updated_at = ? WHERE status = 'processing'", (now,)
+            ).rowcount
+            return requeued, [dict(row) for row in failed]
+        return self._write(requeue)
+
+    def _update(self, job_id, status, **fields):
+        assignments = "".join(f", {column} = ?" for column in fields)
+        self._write(lambda conn: conn.execute(
+            f"UPDATE jobs SET status = ?, updated_at = ?{assignments} WHERE id = ?",
+            (status, time.time(), *fields.values(), job_id)
+        ))
+
+    def get(self, job_id):
+        with self._read_connection() as conn:
+            row = conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def counts(self):
+        with self._read_connection() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict({status: 0 for status in JOB_STATUSES}, **{status: count for status, count in rows})
+
+    async def wait(self, job_id, timeout):
+        """The job once it is done or failed, or its current state after timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await asyncio.to_thread(self.get, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in ("done", "failed") or remaining <= 0:
+                return job
+            await self.wait_for_change(remaining)
@@ -0,0 +1,46 @@
+import json
+import logging
+import os
+import time
+
+# Attributes every LogRecord has; anything else on a record came from extra= and is logged as a field
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and the fields passed with extra=."""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development, with extra= fields appended as key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = " ".join(f"{key}={value}" for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES)
+        return f"{line} {fields}" if fields else line
+
+
+def configure_logging(level=None, format=None):
+    """Send all loggers to stderr at LOG_LEVEL, as JSON lines (LOG_FORMAT=json) or plain text."""
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).strip().upper()
+    format = (format or os.getenv("LOG_FORMAT", "json")).strip().lower()
+    handler = logging.StreamHandler()
+    handler.setFormatter(TextFormatter() if format == "text" else StructuredFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
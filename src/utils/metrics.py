@@ -0,0 +1,84 @@
+import logging
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import GCCollector, PlatformCollector, ProcessCollector
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("decode", "caption", "embed", "db_insert", "text_encode", "scoring", "keyword", "serialization")
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# A registry of our own, so importing this module twice (src.utils.metrics in tests) cannot clash
+registry = CollectorRegistry()
+ProcessCollector(registry=registry)
+PlatformCollector(registry=registry)
+GCCollector(registry=registry)
+
+stage_seconds = Histogram(
+    "image_api_stage_seconds", "Time spent in each processing stage", ["stage"],
+    buckets=LATENCY_BUCKETS, registry=registry
+)
+errors = Counter("image_api_errors_total", "Errors by the endpoint or stage that caught them", ["source"], registry=registry)
+for stage in STAGES:
+    stage_seconds.labels(stage)
+
+
+def stage_timer(stage):
+    """Context manager (or decorator) observing the duration of one stage."""
+    return stage_seconds.labels(stage).time()
+
+
+def count_error(source):
+    errors.labels(source).inc()
+
+
+class StatsCollector:
+    """Cache hit/miss counters and queue depth gauges read from the app's own stats at scrape time.
+
+    The caches and queues already count these, so nothing is incremented twice on the hot path.
+    """
+
+    def __init__(self):
+        self.caches = {}
+        self.queues = {}
+
+    def collect(self):
+        hits = CounterMetricFamily("image_api_cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("image_api_cache_misses", "Cache misses", labels=["cache"])
+        for name, stats in self.caches.items():
+            try:
+                cache_hits, cache_misses = stats()
+            except Exception as e:
+                logger.warning("Could not read cache stats", extra={"cache": name, "error": str(e)})
+                continue
+            hits.add_metric([name], cache_hits)
+            misses.add_metric([name], cache_misses)
+        depth = GaugeMetricFamily("image_api_queue_depth", "Items waiting in each queue", labels=["queue"])
+        for name, pending in self.queues.items():
+            try:
+                depth.add_metric([name], pending())
+            except Exception as e:
+                logger.warning("Could not read queue depth", extra={"queue": name, "error": str(e)})
+        yield hits
+        yield misses
+        yield depth
+
+
+stats_collector = StatsCollector()
+registry.register(stats_collector)
+
+
+def register_cache(name, stats):
+    """Export a cache; stats() returns its (hits, misses) totals."""
+    stats_collector.caches[name] = stats
+
+
+def register_queue(name, pending):
+    """Export a queue; pending() returns how many items are waiting in it."""
+    stats_collector.queues[name] = pending
+
+
+def render():
+    """The Prometheus text exposition of every metric, with its content type."""
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,139 @@
+import json
+import os
+import numpy as np
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+
+def create_session(path, intra_op_threads=0, inter_op_threads=0):
+    """CPU onnxruntime session with full graph optimization; 0 threads lets onnxruntime decide."""
+    if ort is None:
+        raise ImportError("onnxruntime is not installed")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found, run export_onnx.py first")
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if inter_op_threads > 1 else ort.ExecutionMode.ORT_SEQUENTIAL
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+def log_softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+
+class OnnxClip:
+    """CLIP image and text towers exported by export_onnx.py."""
+
+    def __init__(self, model_dir, intra_op_threads=0, inter_op_threads=0):
+        self.vision = create_session(os.path.join(model_dir, "clip_vision.onnx"), intra_op_threads, inter_op_threads)
+        self.text = create_session(os.path.join(model_dir, "clip_text.onnx"), intra_op_threads, inter_op_threads)
+
+    def image_features(self, pixel_values):
+        return self.vision.run(None, {"pixel_values": np.asarray(pixel_values, dtype=np.float32)})[0]
+
+    def text_features(self, input_ids, attention_mask):
+        return self.text.run(None, {
+            "input_ids": np.asarray(input_ids, dtype=np.int64),
+            "attention_mask": np.asarray(attention_mask, dtype=np.int64),
+        })[0]
+
+
+class OnnxBlip:
+    """BLIP vision encoder and text decoder exported by export_onnx.py, with greedy and beam search decoding.
+
+    The exported decoder has no KV cache, so every step re-runs the decoder over the whole prefix and a
+    caption costs O(length^2) decoder work against O(length) for the PyTorch backend. Greedy and beam
+    search are batched across images to at least run one decoder call per step.
+    """
+
+    def __init__(self, model_dir, intra_op_threads=0, inter_op_threads=0):
+        self.vision = create_session(os.path.join(model_dir, "blip_vision.onnx"), intra_op_threads, inter_op_threads)
+        self.decoder = create_session(os.path.join(model_dir, "blip_text_decoder.onnx"), intra_op_threads, inter_op_threads)
+        with open(os.path.join(model_dir, "blip_tokens.json")) as f:
+            tokens = json.load(f)
+        self.bos_token_id = tokens["bos_token_id"]
+        self.eos_token_id = tokens["eos_token_id"]
+        self.pad_token_id = tokens["pad_token_id"]
+
+    def encode(self, pixel_values):
+        return self.vision.run(None, {"pixel_values": np.asarray(pixel_values, dtype=np.float32)})[0]
+
+    def next_token_logits(self, input_ids, image_embeds):
+        return self.decoder.run(None, {"input_ids": input_ids, "encoder_hidden_states": image_embeds})[0]
+
+    def generate(self, pixel_values, max_length=50, num_beams=1, length_penalty=1.0):
+        """Token id lists (starting with the BOS token) for each image; max_length includes the BOS token."""
+        image_embeds = self.encode(pixel_values)
+        if num_beams <= 1:
+            return self.greedy_search(image_embeds, max_length)
+        return self.beam_search(image_embeds, max_length, num_beams, length_penalty)
+
+    def greedy_search(self, image_embeds, max_length):
+        input_ids = np.full((len(image_embeds), 1), self.bos_token_id, dtype=np.int64)
+        done = np.zeros(len(image_embeds), dtype=bool)
+        while input_ids.shape[1] < max_length and not done.all():
+            next_ids = self.next_token_logits(input_ids, image_embeds).argmax(axis=-1)
+            next_ids = np.where(done, self.pad_token_id, next_ids)
+            input_ids = np.concatenate([input_ids, next_ids[:, None]], axis=1)
+            done |= next_ids == self.eos_token_id
+        return input_ids.tolist()
+
+    def beam_search(self, image_embeds, max_length, num_beams, length_penalty=1.0):
+        """Beam search for a batch of images with one decoder call per step over the beams of every unfinished image.
+
+        Finished hypotheses are scored by sum(logprobs) / generated_length ** length_penalty.
+        Returns one token id list per image.
+        """
+        n = len(image_embeds)
+        repeated_embeds = np.repeat(image_embeds, num_beams, axis=0).reshape(n, num_beams, *image_embeds.shape[1:])
+        beams = np.full((n, num_beams, 1), self.bos_token_id, dtype=np.int64)
+        beam_scores = np.full((n, num_beams), -1e9)
+        beam_scores[:, 0] = 0.0
+        finished = [[] for _ in range(n)]
+        results = [None] * n
+        for length in range(1, max_length):
+            active = [image for image in range(n) if results[image] is None]
+            if not active:
+                break
+            logits = self.next_token_logits(
+                beams[active].reshape(len(active) * num_beams, -1),
+                repeated_embeds[active].reshape(len(active) * num_beams, *image_embeds.shape[1:])
+            )
+            logprobs = log_softmax(logits).reshape(len(active), num_beams, -1) + beam_scores[active][:, :, None]
+            next_beams = np.full((n, num_beams, length + 1), self.pad_token_id, dtype=np.int64)
+            for row, image in enumerate(active):
+                flat = logprobs[row].ravel()
+                candidates = np.argpartition(-flat, 2 * num_beams)[:2 * num_beams]
+                candidates = candidates[np.argsort(-flat[candidates], kind="stable")]
+                kept = 0
+                for rank, candidate in enumerate(candidates):
+                    beam, token = divmod(int(candidate), logprobs.shape[2])
+                    if token == self.eos_token_id:
+                        if rank < num_beams:
+                            finished[image].append((flat[candidate] / length ** length_penalty, beams[image, beam].tolist() + [token]))
+                        continue
+                    next_beams[image, kept, :length] = beams[image, beam]
+                    next_beams[image, kept, length] = token
+                    beam_scores[image, kept] = flat[candidate]
+                    kept += 1
+                    if kept == num_beams:
+                        break
+                if len(finished[image]) >= num_beams:
+                    finished[image] = sorted(finished[image], key=lambda hypothesis: hypothesis[0], reverse=True)[:num_beams]
+                    if finished[image][-1][0] >= beam_scores[image].max() / length ** length_penalty:
+                        results[image] = finished[image][0][1]
+            beams = next_beams
+        generated = beams.shape[2] - 1
+        for image in range(n):
+            if results[image] is None:
+                finished[image].extend(
+                    (score / generated ** length_penalty, beam.tolist()) for score, beam in zip(beam_scores[image], beams[image])
+                )
+                results[image] = max(finished[image], key=lambda hypothesis: hypothesis[0])[1]
+        return results
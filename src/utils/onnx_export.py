@@ -0,0 +1,103 @@
+import json
+import os
+import torch
+
+OPSET_VERSION = 17
+
+
+class ClipImageEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+
+class ClipTextEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+
+class BlipVisionEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.vision_model(pixel_values=pixel_values, return_dict=True).last_hidden_state
+
+
+class BlipTextDecoder(torch.nn.Module):
+    """One decoding step: next-token logits for each sequence given the image embeddings."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, encoder_hidden_states):
+        outputs = self.model.text_decoder(
+            input_ids=input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            use_cache=False,
+            return_dict=True,
+        )
+        return outputs.logits[:, -1, :]
+
+
+def _export(module, args, path, input_names, output_names, dynamic_axes):
+    with torch.no_grad():
+        torch.onnx.export(
+            module.eval(),
+            args,
+            path,
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=OPSET_VERSION,
+        )
+    return path
+
+
+def export_clip(model, output_dir, image_size=224, max_text_length=77):
+    """Export the CLIP image and text towers to clip_vision.onnx and clip_text.onnx."""
+    os.makedirs(output_dir, exist_ok=True)
+    pixel_values = torch.zeros(1, 3, image_size, image_size)
+    input_ids = torch.zeros(1, min(8, max_text_length), dtype=torch.long)
+    attention_mask = torch.ones_like(input_ids)
+    return [
+        _export(ClipImageEncoder(model), (pixel_values,), os.path.join(output_dir, "clip_vision.onnx"),
+                ["pixel_values"], ["image_embeds"], {"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}}),
+        _export(ClipTextEncoder(model), (input_ids, attention_mask), os.path.join(output_dir, "clip_text.onnx"),
+                ["input_ids", "attention_mask"], ["text_embeds"],
+                {"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"},
+                 "text_embeds": {0: "batch"}}),
+    ]
+
+
+def export_blip(model, output_dir, image_size=384):
+    """Export the BLIP vision encoder and text decoder, plus the token ids needed to drive generation."""
+    os.makedirs(output_dir, exist_ok=True)
+    text_config = model.config.text_config
+    pixel_values = torch.zeros(1, 3, image_size, image_size)
+    with torch.no_grad():
+        image_embeds = BlipVisionEncoder(model)(pixel_values)
+    input_ids = torch.full((1, 2), text_config.bos_token_id, dtype=torch.long)
+    paths = [
+        _export(BlipVisionEncoder(model), (pixel_values,), os.path.join(output_dir, "blip_vision.onnx"),
+                ["pixel_values"], ["image_embeds"], {"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}}),
+        _export(BlipTextDecoder(model), (input_ids, image_embeds), os.path.join(output_dir, "blip_text_decoder.onnx"),
+                ["input_ids", "encoder_hidden_states"], ["logits"],
+                {"input_ids": {0: "batch", 1: "sequence"}, "encoder_hidden_states": {0: "batch"}, "logits": {0: "batch"}}),
+    ]
+    with open(os.path.join(output_dir, "blip_tokens.json"), "w") as f:
+        json.dump({
+            "bos_token_id": text_config.bos_token_id,
+            "eos_token_id": text_config.sep_token_id,
+            "pad_token_id": text_config.pad_token_id,
+        }, f)
+    return paths
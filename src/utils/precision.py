@@ -0,0 +1,46 @@
+import logging
+import torch
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("fp32", "int8", "bf16")
+
+
+def cpu_supports_bf16():
+    """True when the CPU has native bf16 instructions (AVX512-BF16 or AMX); emulated bf16 is slower than fp32."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def resolve_precision(precision):
+    precision = (precision or "fp32").lower()
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown inference precision: {precision} (expected one of {', '.join(PRECISIONS)})")
+    if precision == "bf16" and not cpu_supports_bf16():
+        logger.warning("CPU has no native bf16 support, falling back to fp32")
+        return "fp32"
+    return precision
+
+
+def apply_precision(model, precision):
+    """Return the model converted for CPU inference in the given precision mode."""
+    if precision == "int8":
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+    return model
+
+
+def cast_inputs(inputs, model):
+    """Cast floating-point processor outputs (pixel_values) to the model's parameter dtype."""
+    dtype = next(model.parameters()).dtype
+    if dtype == torch.float32:
+        return inputs
+    for key, value in inputs.items():
+        if torch.is_tensor(value) and value.is_floating_point():
+            inputs[key] = value.to(dtype)
+    return inputs
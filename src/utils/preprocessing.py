@@ -0,0 +1,72 @@
+import io
+import math
+import numpy as np
+from PIL import Image
+
+PREPROCESS_RESAMPLE = Image.Resampling.BICUBIC
+
+
+def load_image(image_data, min_side=None):
+    """Decode image bytes to RGB, shrunk so the shorter side is min_side (None keeps full size).
+
+    JPEGs are decoded directly at a reduced scale via draft(), so a 12-megapixel photo never
+    exists in memory at full resolution; other formats are shrunk with a fast box reduction
+    followed by a bicubic resize.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    width, height = image.size
+    if not min_side or min(width, height) <= min_side:
+        return image.convert('RGB')
+    scale = min_side / min(width, height)
+    target = (max(min_side, math.ceil(width * scale)), max(min_side, math.ceil(height * scale)))
+    image.draft('RGB', target)
+    image = image.convert('RGB')
+    if image.size != target:
+        image = image.resize(target, PREPROCESS_RESAMPLE, reducing_gap=3.0)
+    return image
+
+
+def image_metadata(image_data):
+    """(width, height, mime_type) read from the image header, without decoding pixels."""
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            width, height = image.size
+            return width, height, Image.MIME.get(image.format)
+    except Exception:
+        return None, None, None
+
+
+def resize_for(image, image_processor):
+    """Resize (and center-crop) one image the way a transformers BLIP/CLIP image processor does."""
+    size = image_processor.size
+    if "shortest_edge" not in size:
+        return image.resize((size["width"], size["height"]), PREPROCESS_RESAMPLE)
+    shortest_edge = size["shortest_edge"]
+    width, height = image.size
+    if width <= height:
+        resized = (shortest_edge, int(shortest_edge * height / width))
+    else:
+        resized = (int(shortest_edge * width / height), shortest_edge)
+    image = image.resize(resized, PREPROCESS_RESAMPLE)
+    crop = image_processor.crop_size
+    left = (resized[0] - crop["width"]) // 2
+    top = (resized[1] - crop["height"]) // 2
+    return image.crop((left, top, left + crop["width"], top + crop["height"]))
+
+
+def pixel_values(images, image_processor):
+    """Model-ready (N, 3, H, W) float32 pixels for the given image processor's size, mean and std.
+
+    Each resized image is written straight into one preallocated channels-first array and
+    normalized in place, instead of the per-image float copies the processors make.
+    """
+    resized = [resize_for(image, image_processor) for image in images]
+    width, height = resized[0].size
+    batch = np.empty((len(resized), 3, height, width), dtype=np.float32)
+    for i, image in enumerate(resized):
+        batch[i] = np.asarray(image).transpose(2, 0, 1)
+    mean = np.asarray(image_processor.image_mean, dtype=np.float32)[:, None, None]
+    std = np.asarray(image_processor.image_std, dtype=np.float32)[:, None, None]
+    batch *= image_processor.rescale_factor / std
+    batch -= mean / std
+    return batch
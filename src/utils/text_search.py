@@ -0,0 +1,42 @@
+import re
+
+TOKEN = re.compile(r"\w+\*?")
+
+
+def fts_query(text, prefix=True):
+    """Turn free text into an FTS5 MATCH expression, or None when it has no searchable terms.
+
+    Every word is quoted, so FTS5 operators and punctuation in user input cannot cause
+    syntax errors. Words are ANDed together. A word written with a trailing * is a
+    prefix query, and with prefix=True so is the last word, which suits search-as-you-type.
+    """
+    terms = TOKEN.findall(text)
+    if not terms:
+        return None
+    parts = []
+    for position, term in enumerate(terms):
+        word = term.rstrip("*")
+        star = term.endswith("*") or (prefix and position == len(terms) - 1)
+        parts.append(f'"{word}"' + ("*" if star else ""))
+    return " ".join(parts)
+
+
+def keyword_search(conn, text, limit=3, prefix=True, where="", params=()):
+    """Top captions for text by BM25, as (score, id, filename, caption, snippet) tuples; higher scores are better.
+
+    where is an extra SQL condition over images (see utils.filters.metadata_filter) with its params.
+    """
+    query = fts_query(text, prefix)
+    if query is None:
+        return []
+    condition = f" AND {where}" if where else ""
+    rows = conn.execute(f"""
+        SELECT images.id, images.filename, images.caption, bm25(images_fts) AS rank,
+               snippet(images_fts, 0, '<b>', '</b>', '...', 16)
+        FROM images_fts JOIN images ON images.id = images_fts.rowid
+        WHERE images_fts MATCH ?{condition}
+        ORDER BY rank
+        LIMIT ?
+    """, (query, *params, limit)).fetchall()
+    # bm25() is lower-is-better; negate it so scores sort like similarities
+    return [(-rank, image_id, filename, caption, snippet) for image_id, filename, caption, rank, snippet in rows]
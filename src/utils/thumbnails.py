@@ -0,0 +1,55 @@
+import io
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "data/thumbnails")
+THUMBNAIL_SIZES = tuple(int(size) for size in os.getenv("THUMBNAIL_SIZES", "128,256").split(","))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+
+executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+
+
+def thumbnail_path(content_hash, size):
+    """Content-addressed location: <THUMBNAIL_DIR>/<first two hex chars>/<hash>_<size>.webp"""
+    return os.path.join(THUMBNAIL_DIR, content_hash[:2], f"{content_hash}_{size}.webp")
+
+
+def generate_thumbnails(image_data, content_hash, sizes=THUMBNAIL_SIZES):
+    """Write any missing WebP thumbnails for the image and return {size: path}."""
+    paths = {size: thumbnail_path(content_hash, size) for size in sizes}
+    missing = sorted((size for size, path in paths.items() if not os.path.exists(path)), reverse=True)
+    if not missing:
+        return paths
+    image = Image.open(io.BytesIO(image_data))
+    # For JPEGs this makes the decoder scale down by up to 8x while decoding
+    image.draft('RGB', (missing[0], missing[0]))
+    image = image.convert('RGB')
+    os.makedirs(os.path.dirname(paths[missing[0]]), exist_ok=True)
+    for size in missing:
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        # A unique temp file per call: two threads making the same thumbnail must not share one
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(paths[size]), suffix=".tmp", delete=False) as tmp:
+            try:
+                image.save(tmp, format='WEBP', quality=THUMBNAIL_QUALITY, method=4)
+            except BaseException:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+        os.replace(tmp.name, paths[size])
+    return paths
+
+
+def schedule_thumbnails(image_data, content_hash):
+    """Generate thumbnails off the request path; failures are logged and retried lazily on first fetch."""
+    def run():
+        try:
+            generate_thumbnails(image_data, content_hash)
+        except Exception as e:
+            logger.warning("Thumbnail error", extra={"content_hash": content_hash, "error": str(e)})
+    return executor.submit(run)
@@ -31,6 +31,22 @@ def get_auth_headers():
         return {"Authorization": f"Bearer {st.session_state.auth_token}"}
     return {}
 
+@st.cache_data(show_spinner=False, max_entries=512)
+def fetch_thumbnail(image_id, size, token):
+    """Fetch a server-generated WebP thumbnail; cached per image, size and session token"""
+    if image_id is None:
+        return None
+    try:
+        response = requests.get(
+            f"{API_BASE_URL}/thumbnails/{image_id}",
+            params={"size": size},
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=10
+        )
+        return response.content if response.status_code == 200 else None
+    except Exception:
+        return None
+
 def check_api_status():
     try:
         response = requests.get(f"{API_BASE_URL}/", timeout=5)
@@ -171,46 +187,78 @@ def upload_images_tab():
         accept_multiple_files=True,
         help="Select one or more images to upload"
     )
+    caption_tier = st.radio(
+        "Caption quality",
+        options=["fast", "quality"],
+        horizontal=True,
+        help="fast uses greedy decoding; quality uses beam search and is several times slower"
+    )
     
     if uploaded_files:
         st.markdown("### Upload Progress")
+        progress = st.progress(0.0)
+        result_slots = {}
         for uploaded_file in uploaded_files:
-            with st.spinner(f"Processing {uploaded_file.name}..."):
+            col1, col2 = st.columns([1, 2])
+            with col1:
                 try:
-                    col1, col2 = st.columns([1, 2])
-                    
-                    with col1:
-                        image = Image.open(uploaded_file)
-                        st.image(image, caption=uploaded_file.name, use_column_width=True)
-                    
-                    with col2:
-                        files = {'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-                        headers = get_auth_headers()
-                        response = requests.post(f"{API_BASE_URL}/upload/", files=files, headers=headers)
-                        
-                        if response.status_code == 200:
-                            data = response.json()
-                            st.markdown(f"""
+                    image = Image.open(uploaded_file)
+                    st.image(image, caption=uploaded_file.name, use_column_width=True)
+                except Exception as e:
+                    st.error(f"Error previewing {uploaded_file.name}: {str(e)}")
+            with col2:
+                result_slots[uploaded_file.name] = st.empty()
+                result_slots[uploaded_file.name].info(f"Processing {uploaded_file.name}...")
+        
+        try:
+            files = [('files', (f.name, f.getvalue(), f.type)) for f in uploaded_files]
+            headers = get_auth_headers()
+            with st.spinner(f"Uploading {len(uploaded_files)} images..."):
+                response = requests.post(f"{API_BASE_URL}/upload/batch", params={"tier": caption_tier}, files=files, headers=headers, stream=True)
+                
+                if response.status_code == 200:
+                    done = 0
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        data = json.loads(line)
+                        slot = result_slots.get(data.get('filename'))
+                        if data.get('status') == 'processed' and slot is not None:
+                            done += 1
+                            slot.markdown(f"""
                             <div class="success-box">
                                 <h4>Upload Successful!</h4>
                                 <p><strong>Filename:</strong> {data.get('filename', 'N/A')}</p>
                                 <p><strong>Caption:</strong> {data.get('caption', 'N/A')}</p>
                             </div>
                             """, unsafe_allow_html=True)
-                        elif response.status_code == 401:
-                            st.error("Authentication failed. Please login again.")
-                            del st.session_state.auth_token
-                            st.rerun()
-                        else:
-                            st.markdown(f"""
+                        elif data.get('status') == 'error' and slot is not None:
+                            done += 1
+                            slot.markdown(f"""
                             <div class="error-box">
                                 <h4>Upload Failed</h4>
-                                <p>{response.text}</p>
+                                <p>{data.get('error', 'Unknown error')}</p>
                             </div>
                             """, unsafe_allow_html=True)
-                
-                except Exception as e:
-                    st.error(f"Error processing {uploaded_file.name}: {str(e)}")
+                        elif data.get('status') == 'complete':
+                            st.success(f"Saved {data.get('uploaded', 0)} images")
+                        elif data.get('status') == 'error':
+                            st.error(f"Upload failed: {data.get('error', 'Unknown error')}")
+                        progress.progress(min(done / len(uploaded_files), 1.0))
+                elif response.status_code == 401:
+                    st.error("Authentication failed. Please login again.")
+                    del st.session_state.auth_token
+                    st.rerun()
+                else:
+                    st.markdown(f"""
+                    <div class="error-box">
+                        <h4>Upload Failed</h4>
+                        <p>{response.text}</p>
+                    </div>
+                    """, unsafe_allow_html=True)
+        
+        except Exception as e:
+            st.error(f"Error uploading images: {str(e)}")
 
 def search_images_tab():
     """Search images tab"""
@@ -226,13 +274,23 @@ def search_images_tab():
         placeholder="e.g., red image, cat, landscape, etc.",
         help="Describe what you're looking for in the images"
     )
+    search_mode = st.radio(
+        "Search mode",
+        ["semantic", "keyword", "hybrid"],
+        horizontal=True,
+        help="semantic matches meaning with CLIP; keyword matches caption words with BM25; hybrid fuses both"
+    )
     
     if search_query:
         if st.button("Search Images", type="primary"):
             with st.spinner("Searching images..."):
                 try:
                     headers = get_auth_headers()
-                    response = requests.get(f"{API_BASE_URL}/search/?query={search_query}", headers=headers)
+                    response = requests.get(
+                        f"{API_BASE_URL}/search/",
+                        params={"query": search_query, "mode": search_mode},
+                        headers=headers
+                    )
                     
                     if response.status_code == 200:
                         data = response.json()
@@ -249,42 +307,15 @@ def search_images_tab():
                                         <p><strong>Filename:</strong> {result['filename']}</p>
                                         <p><strong>Caption:</strong> {result['caption']}</p>
                                         <p><strong>Similarity Score:</strong> {result['similarity']:.3f}</p>
+                                        {f"<p><strong>Match:</strong> {result['snippet']}</p>" if result.get('snippet') else ""}
                                     </div>
                                     """, unsafe_allow_html=True)
                                     
-                                    try:
-                                        possible_paths = [
-                                            f"src/data/raw/{result['filename']}",
-                                            f"data/raw/{result['filename']}",
-                                            f"../src/data/raw/{result['filename']}",
-                                            os.path.join(os.getcwd(), "src", "data", "raw", result['filename'])
-                                        ]                                        
-                                        image = None
-                                        used_path = None
-                                        for path in possible_paths:
-                                            try:
-                                                if os.path.exists(path):
-                                                    image = Image.open(path)
-                                                    used_path = path
-                                                    break
-                                            except:
-                                                continue                                        
-                                        if image:
-                                            max_width = 300
-                                            max_height = 300
-                                            width, height = image.size
-                                            if width > height:
-                                                new_width = max_width
-                                                new_height = int(height * max_width / width)
-                                            else:
-                                                new_height = max_height
-                                                new_width = int(width * max_height / height)
-                                            resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                                            st.image(resized_image, caption=result['filename'], use_column_width=False)
-                                        else:
-                                            st.info(f"Image file not found. Tried paths: {', '.join(possible_paths)}")
-                                    except Exception as e:
-                                        st.info(f"Error loading image: {str(e)}")
+                                    thumbnail = fetch_thumbnail(result.get('id'), 256, st.session_state.auth_token)
+                                    if thumbnail:
+                                        st.image(thumbnail, caption=result['filename'], use_column_width=False)
+                                    else:
+                                        st.info("Thumbnail not available")
                         else:
                             st.markdown("""
                             <div class="info-box">
@@ -302,26 +333,47 @@ def search_images_tab():
                 except Exception as e:
                     st.error(f"Error during search: {str(e)}")
 
+HISTORY_PAGE_SIZE = 24
+
+def reset_history():
+    st.session_state.history_cursors = [0]
+    st.session_state.history_loaded = True
+
+def next_history_page(cursor):
+    st.session_state.history_cursors.append(cursor)
+
+def previous_history_page():
+    if len(st.session_state.history_cursors) > 1:
+        st.session_state.history_cursors.pop()
+
 def view_history_tab():
     st.markdown('<h2 class="sub-header">📋 Image History</h2>', unsafe_allow_html=True)
     
     st.markdown("""
     View all images that have been uploaded to the system.
-    This shows the complete history of your image uploads.
+    This shows the complete history of your image uploads, one page at a time.
     """)
     
-    if st.button("🔄 Refresh History", type="primary"):
+    if "history_cursors" not in st.session_state:
+        st.session_state.history_cursors = [0]
+    
+    st.button("🔄 Refresh History", type="primary", on_click=reset_history)
+    
+    if st.session_state.get("history_loaded"):
         with st.spinner("Loading image history..."):
             try:
                 headers = get_auth_headers()
-                response = requests.get(f"{API_BASE_URL}/history/", headers=headers)
+                params = {"limit": HISTORY_PAGE_SIZE, "cursor": st.session_state.history_cursors[-1]}
+                response = requests.get(f"{API_BASE_URL}/history/", params=params, headers=headers)
                 
                 if response.status_code == 200:
                     data = response.json()
                     images = data.get('images', [])
+                    next_cursor = data.get('next_cursor')
+                    page = len(st.session_state.history_cursors)
                     
                     if images:
-                        st.markdown(f"### 📊 Image History ({len(images)} images)")
+                        st.markdown(f"### 📊 Image History (page {page}, {len(images)} images)")
                         
                         cols = st.columns(3)
                         for i, image_data in enumerate(images):
@@ -334,43 +386,17 @@ def view_history_tab():
                                 </div>
                                 """, unsafe_allow_html=True)
                                 
-                                try:
-                                    possible_paths = [
-                                        f"src/data/raw/{image_data['filename']}",
-                                        f"data/raw/{image_data['filename']}",
-                                        f"../src/data/raw/{image_data['filename']}",
-                                        os.path.join(os.getcwd(), "src", "data", "raw", image_data['filename'])
-                                    ]
-                                    
-                                    image = None
-                                    used_path = None
-                                    
-                                    for path in possible_paths:
-                                        try:
-                                            if os.path.exists(path):
-                                                image = Image.open(path)
-                                                used_path = path
-                                                break
-                                        except:
-                                            continue
-                                    
-                                    if image:
-                                        max_width = 250
-                                        max_height = 250                                        
-                                        width, height = image.size
-                                        if width > height:
-                                            new_width = max_width
-                                            new_height = int(height * max_width / width)
-                                        else:
-                                            new_height = max_height
-                                            new_width = int(width * max_height / height)
-                                        
-                                        resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                                        st.image(resized_image, caption=image_data['filename'], use_column_width=False)
-                                    else:
-                                        st.info(f"Image file not found. Tried paths: {', '.join(possible_paths)}")
-                                except Exception as e:
-                                    st.info(f"Error loading image: {str(e)}")
+                                thumbnail = fetch_thumbnail(image_data.get('id'), 256, st.session_state.auth_token)
+                                if thumbnail:
+                                    st.image(thumbnail, caption=image_data['filename'], use_column_width=False)
+                                else:
+                                    st.info("Thumbnail not available")
+                        
+                        col_prev, col_next = st.columns(2)
+                        with col_prev:
+                            st.button("⬅️ Previous page", disabled=page == 1, on_click=previous_history_page)
+                        with col_next:
+                            st.button("Next page ➡️", disabled=next_cursor is None, on_click=next_history_page, args=(next_cursor,))
                     else:
                         st.markdown("""
                         <div class="info-box">
@@ -142,6 +142,716 @@ class TestDatabase:
         except ImportError:
             pytest.skip("Database module not available")
 
+class TestDatabasePool:
+    def test_group_commit_isolates_failing_jobs(self, tmp_path):
+        from concurrent.futures import ThreadPoolExecutor
+        from src.utils.database import connection, ReadPool, WriteQueue
+        
+        db_path = str(tmp_path / "pool.db")
+        conn = connection(db_path)
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER UNIQUE)")
+        conn.commit()
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        conn.close()
+        
+        writer = WriteQueue(batch_size=16, wait_ms=20, db_path=db_path)
+        
+        def insert(value):
+            return writer.execute(lambda c: c.execute("INSERT INTO items (value) VALUES (?)", (value,)).lastrowid)
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [pool.submit(insert, value) for value in [1, 2, 3, 1, 4, 5, 6, 7]]
+        outcomes = [future.exception() for future in futures]
+        assert sum(outcome is not None for outcome in outcomes) == 1
+        assert writer.stats()["commits"] < 8
+        
+        readers = ReadPool(2, db_path=db_path)
+        with readers.connection() as reader:
+            assert reader.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 7
+
+class TestKeywordSearch:
+    def test_fts_index_follows_captions_and_ranks_by_bm25(self, tmp_path):
+        from src.utils.database import connection, create_caption_index
+        from src.utils.text_search import fts_query, keyword_search
+        
+        conn = connection(str(tmp_path / "fts.db"))
+        conn.execute("CREATE TABLE images (id INTEGER PRIMARY KEY, filename TEXT, caption TEXT)")
+        conn.execute("INSERT INTO images (filename, caption) VALUES ('old.jpg', 'a red bicycle leaning on a wall')")
+        create_caption_index(conn.cursor())
+        conn.executemany("INSERT INTO images (filename, caption) VALUES (?, ?)", [
+            ("dogs.jpg", "two dogs playing with a dog toy"),
+            ("beach.jpg", "a dog running on the beach"),
+            ("cat.jpg", "a cat sleeping on a sofa"),
+        ])
+        conn.execute("UPDATE images SET caption = 'a cat sleeping next to a dog' WHERE filename = 'cat.jpg'")
+        conn.execute("DELETE FROM images WHERE filename = 'beach.jpg'")
+        conn.commit()
+        
+        assert fts_query('dog" OR cat*', prefix=False) == '"dog" "OR" "cat"*'
+        assert fts_query("!!") is None
+        results = keyword_search(conn, "dog", limit=5)
+        assert [filename for _, _, filename, _, _ in results] == ["dogs.jpg", "cat.jpg"]
+        assert results[0][0] > results[1][0]
+        assert results[1][4] == "a cat sleeping next to a <b>dog</b>"
+        assert [r[2] for r in keyword_search(conn, "bicyc")] == ["old.jpg"]
+        assert keyword_search(conn, "bicyc", prefix=False) == []
+        conn.close()
+
+class TestFusion:
+    def test_rrf_and_weighted_fusion(self):
+        from src.utils.fusion import fuse, min_max
+        
+        vector = [(0.31, 2, "b.jpg", "b"), (0.30, 1, "a.jpg", "a"), (0.10, 3, "c.jpg", "c")]
+        keyword = [(4.0, 1, "a.jpg", "a", "<b>a</b>"), (1.0, 4, "d.jpg", "d", "<b>d</b>")]
+        
+        rrf = fuse(vector, keyword, k=3, method="rrf", rrf_k=60)
+        assert [entry["id"] for entry in rrf] == [1, 2, 4]
+        assert rrf[0]["similarity"] == pytest.approx(0.5 / 62 + 0.5 / 61)
+        assert rrf[0]["snippet"] == "<b>a</b>" and rrf[1]["keyword_score"] is None
+        
+        assert min_max([2.0, 4.0, 3.0]) == [0.0, 1.0, 0.5]
+        vector_only = fuse(vector, keyword, k=4, method="weighted", vector_weight=1.0)
+        assert [entry["id"] for entry in vector_only][:3] == [2, 1, 3]
+        keyword_heavy = fuse(vector, keyword, k=1, method="weighted", vector_weight=0.2)
+        assert keyword_heavy[0]["id"] == 1
+
+class TestJobQueue:
+    def test_claims_retries_and_requeues_jobs(self, tmp_path):
+        from src.utils.database import connection, create_jobs_table, ReadPool, WriteQueue
+        from src.utils.jobs import JobQueue
+
+        db_path = str(tmp_path / "jobs.db")
+        conn = connection(db_path)
+        create_jobs_table(conn.cursor())
+        conn.commit()
+        conn.close()
+
+        writer = WriteQueue(db_path=db_path)
+        jobs = JobQueue(max_attempts=2, write=writer.execute, read_connection=ReadPool(1, db_path).connection)
+        first = jobs.create("admin", "a.jpg", "/tmp/a", "hash-a", "fast")
+        second = jobs.create("admin", "b.jpg", "/tmp/b", "hash-b", "quality", "http://example.com/hook")
+
+        claimed = jobs.claim()
+        assert (claimed["id"], claimed["attempts"]) == (first, 1)
+        assert jobs.fail(first, "boom", claimed["attempts"]) == "pending"
+        assert jobs.claim()["id"] == first
+        assert jobs.fail(first, "boom", 2) == "failed"
+
+        assert jobs.claim()["webhook_url"] == "http://example.com/hook"
+        assert jobs.claim() is None
+        assert jobs.requeue_interrupted() == (1, [])
+        # Interrupted again on its last attempt: failed instead of retried forever
+        assert jobs.claim()["attempts"] == 2
+        requeued, failed = jobs.requeue_interrupted()
+        assert requeued == 0 and [job["id"] for job in failed] == [second]
+        assert jobs.get(second)["status"] == "failed"
+        third = jobs.create("admin", "c.jpg", "/tmp/c", "hash-c", "fast")
+        jobs.complete(jobs.claim()["id"], image_id=7, caption="a cat")
+        assert jobs.get(third)["status"] == "done" and jobs.get(third)["image_id"] == 7
+        assert jobs.counts() == {"pending": 0, "processing": 0, "done": 1, "failed": 2}
+    
+    def test_webhook_allowlist(self):
+        from src.utils.jobs import webhook_allowed
+        
+        allowed = ["hooks.example.com", ".internal.example.org"]
+        assert webhook_allowed("https://hooks.example.com/done", allowed)
+        assert webhook_allowed("http://ci.internal.example.org:8080/x", allowed)
+        assert not webhook_allowed("http://169.254.169.254/latest/meta-data", allowed)
+        assert not webhook_allowed("https://hooks.example.com.evil.net/", allowed)
+        assert not webhook_allowed("file:///etc/passwd", allowed)
+        assert not webhook_allowed("https://hooks.example.com/done", [])
+
+class TestEmbeddingIndex:
+    def test_search_matches_brute_force(self):
+        try:
+            import numpy as np
+            from src.utils.embedding_index import EmbeddingIndex
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((50, 16)).astype(np.float32)
+        index = EmbeddingIndex(initial_capacity=4)
+        index.load([(i + 1, f"img{i}.jpg", f"caption {i}", vectors[i].tobytes()) for i in range(40)])
+        for i in range(40, 50):
+            assert index.add(i + 1, f"img{i}.jpg", f"caption {i}", vectors[i].tobytes())
+        assert len(index) == 50
+        
+        query = rng.standard_normal(16).astype(np.float32)
+        expected = (vectors @ query) / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query))
+        results = index.search(query, k=5)
+        
+        assert [image_id for _, image_id, _, _ in results] == list(np.argsort(-expected)[:5] + 1)
+        assert np.allclose([score for score, _, _, _ in results], np.sort(expected)[::-1][:5], atol=1e-5)
+    
+    def test_rejects_mismatched_embeddings(self):
+        try:
+            import numpy as np
+            from src.utils.embedding_index import EmbeddingIndex
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        index = EmbeddingIndex()
+        assert index.add(1, "a.jpg", "a", np.ones(8, dtype=np.float32).tobytes())
+        assert not index.add(2, "b.jpg", "b", b"")
+        assert not index.add(3, "c.jpg", "c", np.ones(4, dtype=np.float32).tobytes())
+        assert len(index) == 1
+
+    def test_search_batch_matches_sequential_search(self):
+        try:
+            import numpy as np
+            from src.utils.embedding_index import EmbeddingIndex
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        rng = np.random.default_rng(6)
+        vectors = rng.standard_normal((300, 16)).astype(np.float32)
+        index = EmbeddingIndex()
+        index.load([(i + 1, f"img{i}.jpg", "", vectors[i].tobytes()) for i in range(300)])
+        queries = rng.standard_normal((9, 16)).astype(np.float32)
+        allowed = np.arange(1, 301, 3)
+        
+        # A small score budget forces several query blocks
+        batched = index.search_batch(queries, k=4, max_scores=1000)
+        filtered = index.search_batch(queries, k=4, ids=allowed)
+        for query, matches, filtered_matches in zip(queries, batched, filtered):
+            assert [m[1] for m in matches] == [m[1] for m in index.search(query, k=4)]
+            assert [m[1] for m in filtered_matches] == [m[1] for m in index.search(query, k=4, ids=allowed)]
+        assert index.search_batch(np.empty((0, 16), dtype=np.float32)) == []
+
+    def test_prefiltered_search_scores_only_allowed_ids(self):
+        try:
+            import numpy as np
+            from src.utils.embedding_index import EmbeddingIndex
+            from src.utils.ann_index import IVFFlatIndex
+            from src.utils.filters import metadata_filter
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        rng = np.random.default_rng(5)
+        vectors = rng.standard_normal((100, 16)).astype(np.float32)
+        index = EmbeddingIndex()
+        index.load([(i + 1, f"img{i}.jpg", "", vectors[i].tobytes()) for i in range(100)])
+        index.attach_ann(IVFFlatIndex(nlist=4, nprobe=1))
+        allowed = np.arange(2, 101, 2)
+        
+        query = rng.standard_normal(16).astype(np.float32)
+        scores = vectors @ query / np.linalg.norm(vectors, axis=1)
+        expected = [int(i) + 1 for i in np.argsort(-scores) if (i + 1) % 2 == 0][:5]
+        assert [image_id for _, image_id, _, _ in index.search(query, k=5, ids=allowed)] == expected
+        assert index.search(query, k=5, ids=np.empty(0, dtype=np.int64)) == []
+        
+        where, params = metadata_filter(uploader="alice", min_width=100, mime_types=["image/png", "image/jpeg"])
+        assert where == "images.uploader = ? AND images.width >= ? AND images.mime_type IN (?, ?)"
+        assert params == ["alice", 100, "image/png", "image/jpeg"]
+        assert metadata_filter() == ("", [])
+
+    def test_filter_times_are_normalized_to_utc(self):
+        from datetime import datetime, timedelta, timezone
+        from src.utils.filters import utc_timestamp
+        
+        naive = datetime(2024, 5, 1, 12, 0)
+        aware = datetime(2024, 5, 1, 14, 0, tzinfo=timezone(timedelta(hours=2)))
+        assert utc_timestamp(naive) == utc_timestamp(aware) == 1714564800.0
+        assert utc_timestamp(datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)) == 1714564800.0
+
+    def test_vector_returns_indexed_embedding_by_id(self, tmp_path):
+        try:
+            import numpy as np
+            from src.utils.embedding_index import EmbeddingIndex, normalize
+            from src.utils.embedding_store import EmbeddingStore
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        vectors = np.random.default_rng(6).standard_normal((5, 8)).astype(np.float32)
+        index = EmbeddingIndex()
+        index.load([(i + 10, f"img{i}.jpg", "", vectors[i].tobytes()) for i in range(5)])
+        np.testing.assert_allclose(index.vector(12), normalize(vectors[2]), atol=1e-6)
+        assert index.vector(99) is None
+        assert index.search(index.vector(13), k=1)[0][1] == 13
+        
+        store = EmbeddingStore(str(tmp_path / "images.int8.embeddings"), "int8")
+        store.append([10, 11, 12], vectors[:3])
+        stored = EmbeddingIndex()
+        stored.attach_store(store, [(10, "a.jpg", ""), (11, "b.jpg", "")])
+        np.testing.assert_allclose(stored.vector(11), normalize(vectors[1]), atol=2e-2)
+        assert stored.vector(12) is None
+
+class TestAnnIndex:
+    def test_attach_ann_adds_snapshot_rows_outside_the_lock(self):
+        try:
+            import numpy as np
+            from src.utils.embedding_index import EmbeddingIndex
+            from src.utils.ann_index import IVFFlatIndex
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        vectors = np.random.default_rng(9).standard_normal((200, 16)).astype(np.float32)
+        index = EmbeddingIndex()
+        index.load([(i + 1, f"img{i}.jpg", "", vectors[i].tobytes()) for i in range(200)])
+        added = []
+        
+        class RecordingIndex(IVFFlatIndex):
+            def add(self, vectors, chunk_size=64):
+                locked = not index._lock.acquire(blocking=False)
+                if not locked:
+                    index._lock.release()
+                added.append((vectors.shape[0], locked))
+                super().add(vectors, chunk_size)
+        
+        ann = RecordingIndex(nlist=4)
+        assert index.attach_ann(ann) == "built"
+        assert added == [(200, False)]
+        assert ann.ntotal == 200
+        matrix = index.snapshot()[0]
+        full = IVFFlatIndex(nlist=4)
+        full.train(matrix)
+        full.add(matrix)
+        assert all(np.array_equal(a, b) for a, b in zip(ann.lists, full.lists))
+
+    def test_ivf_full_probe_matches_exact_and_round_trips(self, tmp_path):
+        try:
+            import numpy as np
+            from src.utils.embedding_index import EmbeddingIndex
+            from src.utils.ann_index import IVFFlatIndex
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        rng = np.random.default_rng(1)
+        vectors = rng.standard_normal((300, 16)).astype(np.float32)
+        rows = [(i + 1, f"img{i}.jpg", "", vectors[i].tobytes()) for i in range(300)]
+        index = EmbeddingIndex()
+        index.load(rows[:250])
+        assert index.attach_ann(IVFFlatIndex(nlist=8)) == "built"
+        for row in rows[250:]:
+            index.add(*row)
+        
+        query = rng.standard_normal(16).astype(np.float32)
+        exact = [image_id for _, image_id, _, _ in index.search(query, k=10, exact=True)]
+        assert [image_id for _, image_id, _, _ in index.search(query, k=10, nprobe=8)] == exact
+        
+        path = str(tmp_path / "images.ivf.index")
+        index.save_ann(path)
+        reloaded = EmbeddingIndex()
+        reloaded.load(rows)
+        assert reloaded.attach_ann(IVFFlatIndex(), path, train=False) == "loaded"
+        assert [image_id for _, image_id, _, _ in reloaded.search(query, k=10, nprobe=8)] == exact
+
+    def test_ivf_reports_outgrown_after_catalog_growth(self, tmp_path):
+        try:
+            import numpy as np
+            from src.utils.ann_index import IVFFlatIndex
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        vectors = np.random.default_rng(3).standard_normal((500, 8)).astype(np.float32)
+        ivf = IVFFlatIndex(nprobe=2)
+        ivf.train(vectors[:100])
+        ivf.add(vectors[:100])
+        assert (ivf.trained_size, ivf.nlist) == (100, 40)
+        ivf.add(vectors[100:400])
+        assert not ivf.outgrown(4)
+        ivf.add(vectors[400:])
+        assert ivf.outgrown(4) and not ivf.outgrown(0)
+        
+        path = str(tmp_path / "ivf.index")
+        ivf.save(path, np.arange(500))
+        reloaded = IVFFlatIndex()
+        assert reloaded.load(path, np.arange(500))
+        assert reloaded.trained_size == 100 and reloaded.outgrown(4)
+
+    def test_pq_settings_do_not_change_hnsw_degree(self):
+        try:
+            from src.utils import ann_index
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        settings = {"nlist": 16, "nprobe": 4, "ef_search": 64, "pq_m": 8, "rerank": 10, "opq": False}
+        assert ann_index.create_ann_index("ivfpq", **settings).m == 8
+        if ann_index.faiss is None:
+            pytest.skip("faiss not available")
+        assert ann_index.create_ann_index("faiss", **settings).m == 32
+        assert ann_index.create_ann_index("faiss", m=16, **settings).m == 16
+
+    def test_ivfpq_rerank_recovers_exact_results_and_round_trips(self, tmp_path):
+        try:
+            import numpy as np
+            from src.utils.embedding_index import EmbeddingIndex
+            from src.utils.ann_index import IVFPQIndex
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        rng = np.random.default_rng(4)
+        vectors = rng.standard_normal((1000, 32)).astype(np.float32)
+        rows = [(i + 1, f"img{i}.jpg", "", vectors[i].tobytes()) for i in range(1000)]
+        index = EmbeddingIndex()
+        index.load(rows[:900])
+        ann = IVFPQIndex(nlist=4, m=8, opq=True, opq_iterations=2, iterations=5)
+        assert index.attach_ann(ann) == "built"
+        for row in rows[900:]:
+            index.add(*row)
+        assert ann.ntotal == 1000 and ann.bytes_per_vector == 16
+        
+        query = rng.standard_normal(32).astype(np.float32)
+        exact = index.search(query, k=10, exact=True)
+        reranked = index.search(query, k=10, nprobe=4, rerank=1000)
+        assert [r[1] for r in reranked] == [r[1] for r in exact]
+        assert np.allclose([r[0] for r in reranked], [r[0] for r in exact], atol=1e-5)
+        assert len(index.search(query, k=10, nprobe=4, rerank=0)) == 10
+        
+        path = str(tmp_path / "images.ivfpq.index")
+        index.save_ann(path)
+        reloaded = EmbeddingIndex()
+        reloaded.load(rows)
+        assert reloaded.attach_ann(IVFPQIndex(), path, train=False) == "loaded"
+        assert reloaded.ann.m == 8 and reloaded.ann.rotation is not None
+        assert [r[1] for r in reloaded.search(query, k=10, nprobe=4, rerank=0)] == [r[1] for r in index.search(query, k=10, nprobe=4, rerank=0)]
+
+class TestEmbeddingStore:
+    def test_quantized_store_search_and_reopen(self, tmp_path):
+        try:
+            import numpy as np
+            from src.utils.embedding_index import EmbeddingIndex, normalize
+            from src.utils.embedding_store import EmbeddingStore
+            from src.utils.ann_index import IVFFlatIndex
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        rng = np.random.default_rng(2)
+        vectors = rng.standard_normal((200, 32)).astype(np.float32)
+        query = rng.standard_normal(32).astype(np.float32)
+        expected = normalize(vectors) @ normalize(query)
+        for dtype, tolerance in (("float16", 1e-3), ("int8", 2e-2)):
+            path = str(tmp_path / f"images.{dtype}.embeddings")
+            store = EmbeddingStore(path, dtype)
+            store.append(list(range(1, 151)), vectors[:150])
+            index = EmbeddingIndex()
+            index.attach_store(store, [(i + 1, f"img{i}.jpg", "") for i in range(150)])
+            for i in range(150, 200):
+                store.append([i + 1], vectors[i:i + 1])
+                assert index.add(i + 1, f"img{i}.jpg", "", vectors[i].tobytes())
+            
+            np.testing.assert_allclose(store.get(7), normalize(vectors[6]), atol=tolerance)
+            results = index.search(query, k=5, exact=True)
+            assert np.allclose([score for score, _, _, _ in results], np.sort(expected)[::-1][:5], atol=tolerance)
+            assert index.attach_ann(IVFFlatIndex(nlist=4)) == "built"
+            assert [r[1] for r in index.search(query, k=5, nprobe=4)] == [r[1] for r in results]
+            
+            reopened = EmbeddingStore(path, dtype)
+            assert len(reopened) == 200 and reopened.dim == 32
+            np.testing.assert_array_equal(reopened.get(200), store.get(200))
+    
+    def test_migrates_blobs_and_compacts_orphans(self, tmp_path):
+        try:
+            import numpy as np
+            import sqlite3
+            from src.utils.embedding_store import EmbeddingStore, migrate_sqlite_embeddings
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        db_path = str(tmp_path / "images.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE images (id INTEGER PRIMARY KEY, embedding BLOB)")
+        vectors = np.random.default_rng(3).standard_normal((10, 8)).astype(np.float32)
+        conn.executemany("INSERT INTO images VALUES (?, ?)", [(i + 1, vectors[i].tobytes()) for i in range(10)])
+        conn.commit()
+        
+        store = EmbeddingStore(str(tmp_path / "images.float16.embeddings"))
+        assert migrate_sqlite_embeddings(store, db_path, clear=True, vacuum=True) == (10, 10)
+        assert conn.execute("SELECT COUNT(*) FROM images WHERE length(embedding) > 0").fetchone()[0] == 0
+        assert migrate_sqlite_embeddings(store, db_path) == (0, 0)
+        conn.close()
+        
+        store.append([99, 3], vectors[:2])
+        assert store.compact(range(1, 11)) == 2
+        assert len(store) == 10 and 99 not in store
+        np.testing.assert_allclose(store.get(3), vectors[1] / np.linalg.norm(vectors[1]), atol=1e-3)
+
+class TestBatchScheduler:
+    def test_batches_concurrent_requests(self):
+        import asyncio
+        from src.utils.batching import BatchScheduler
+        
+        batch_sizes = []
+        
+        def process(items):
+            batch_sizes.append(len(items))
+            return [item * 2 for item in items]
+        
+        async def run():
+            scheduler = BatchScheduler(process, max_batch_size=4, max_wait_ms=50)
+            results = await asyncio.gather(*(scheduler.submit(i) for i in range(5)))
+            await scheduler.stop()
+            return results, scheduler.stats()
+        
+        results, stats = asyncio.run(run())
+        assert results == [0, 2, 4, 6, 8]
+        assert batch_sizes == [4, 1]
+        assert stats["batches"] == 2
+        assert stats["items"] == 5
+        assert stats["batch_fill_ratio"] == 5 / 8
+    
+    def test_batch_failure_propagates_to_every_caller(self):
+        import asyncio
+        from src.utils.batching import BatchScheduler
+        
+        def process(items):
+            raise RuntimeError("model failure")
+        
+        async def run():
+            scheduler = BatchScheduler(process, max_batch_size=2, max_wait_ms=10)
+            results = await asyncio.gather(scheduler.submit(1), scheduler.submit(2), return_exceptions=True)
+            await scheduler.stop()
+            return results
+        
+        assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
+
+class TestInferencePool:
+    def test_rejects_requests_beyond_max_pending(self):
+        from src.utils.inference import InferencePool, InferenceQueueFull
+        
+        pool = InferencePool(workers=1, max_pending=2, retry_after=3)
+        with pool.admit(), pool.admit():
+            with pytest.raises(InferenceQueueFull) as exc_info:
+                with pool.admit():
+                    pass
+            assert exc_info.value.retry_after == 3
+        assert pool.pending == 0
+        assert pool.stats()["rejected"] == 1
+        pool.shutdown()
+
+class TestDeduplication:
+    def test_dhash_matches_reencoded_image(self):
+        try:
+            import numpy as np
+            from src.utils.dedup import dhash, PerceptualHashIndex
+        except ImportError:
+            pytest.skip("numpy not available")
+        
+        gradient = np.tile(np.linspace(0, 255, 128, dtype=np.uint8), (96, 1))
+        image = Image.fromarray(np.stack([gradient, gradient.T[:96, :96].repeat(2, axis=1)[:, :128], gradient], axis=2))
+        reencoded = io.BytesIO()
+        image.save(reencoded, format='JPEG', quality=50)
+        other = Image.fromarray(255 - np.asarray(image))
+        
+        index = PerceptualHashIndex()
+        index.add(1, dhash(image))
+        assert index.find(dhash(Image.open(reencoded)), max_distance=4) == 1
+        assert index.find(dhash(other), max_distance=4) is None
+    
+    def test_content_hash_is_sha256(self):
+        import hashlib
+        from src.utils.dedup import content_hash
+        
+        assert content_hash(b"image bytes") == hashlib.sha256(b"image bytes").hexdigest()
+
+class TestLRUCache:
+    def test_evicts_least_recently_used_and_counts_hits(self):
+        from src.utils.cache import LRUCache
+        
+        cache = LRUCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["size"]) == (2, 1, 2)
+    
+    def test_expires_entries_after_ttl(self):
+        from src.utils.cache import LRUCache
+        
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.put("a", 1)
+        time.sleep(0.02)
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+class TestObservability:
+    def test_stage_timer_and_registered_queues_appear_in_metrics(self):
+        try:
+            from src.utils import metrics
+        except ImportError:
+            pytest.skip("prometheus_client not available")
+        
+        with metrics.stage_timer("scoring"):
+            pass
+        metrics.register_queue("test_queue", lambda: 7)
+        metrics.register_cache("test_cache", lambda: (3, 1))
+        body, content_type = metrics.render()
+        text = body.decode()
+        assert content_type.startswith("text/plain")
+        assert 'image_api_stage_seconds_count{stage="scoring"} 1.0' in text
+        assert 'image_api_queue_depth{queue="test_queue"} 7.0' in text
+        assert 'image_api_cache_hits_total{cache="test_cache"} 3.0' in text
+    
+    def test_structured_formatter_emits_extra_fields_as_json(self):
+        import json
+        import logging
+        from src.utils.logs import StructuredFormatter
+        
+        record = logging.getLogger("image_api").makeRecord(
+            "image_api", logging.INFO, __file__, 1, "Job failed", (), None, extra={"job_id": 4}
+        )
+        entry = json.loads(StructuredFormatter().format(record))
+        assert (entry["level"], entry["logger"], entry["message"], entry["job_id"]) == ("INFO", "image_api", "Job failed", 4)
+        assert "lineno" not in entry
+
+class TestThumbnails:
+    def test_generates_content_addressed_webp_thumbnails(self, tmp_path, monkeypatch):
+        from src.utils import thumbnails
+        
+        monkeypatch.setattr(thumbnails, "THUMBNAIL_DIR", str(tmp_path))
+        img_bytes = io.BytesIO()
+        Image.new('RGB', (1200, 800), color='green').save(img_bytes, format='JPEG')
+        
+        paths = thumbnails.generate_thumbnails(img_bytes.getvalue(), "ab" + "0" * 62, sizes=(128, 256))
+        assert paths[128] == os.path.join(str(tmp_path), "ab", "ab" + "0" * 62 + "_128.webp")
+        for size, path in paths.items():
+            thumbnail = Image.open(path)
+            assert thumbnail.format == "WEBP"
+            assert max(thumbnail.size) == size
+
+class TestOnnxBackend:
+    def test_beam_search_finds_more_likely_caption_than_greedy(self):
+        import numpy as np
+        from src.utils.onnx_backend import OnnxBlip
+
+        # Token 3 then EOS (2) is the most likely caption; greedy takes token 4 first and never recovers.
+        # A second image (embeddings of ones) always captions as token 5 then EOS.
+        def next_token_logits(input_ids, image_embeds):
+            logits = np.full((len(input_ids), 6), -10.0)
+            for row, ids in enumerate(input_ids.tolist()):
+                if image_embeds[row].flat[0] == 1:
+                    logits[row, 5 if len(ids) == 1 else 2] = 0.0
+                elif len(ids) == 1:
+                    logits[row, [3, 4]] = [np.log(0.45), np.log(0.55)]
+                elif ids[1] == 3:
+                    logits[row, 2] = 0.0
+                else:
+                    logits[row, [2, 5]] = [np.log(0.3), np.log(0.7)]
+            return logits
+
+        blip = OnnxBlip.__new__(OnnxBlip)
+        blip.bos_token_id, blip.eos_token_id, blip.pad_token_id = 1, 2, 0
+        blip.next_token_logits = next_token_logits
+        embeds = np.zeros((1, 4, 8), dtype=np.float32)
+        assert blip.greedy_search(embeds, max_length=3) == [[1, 4, 5]]
+        assert blip.beam_search(embeds, max_length=3, num_beams=2) == [[1, 3, 2]]
+        batch = np.concatenate([embeds, np.ones_like(embeds), embeds])
+        assert blip.beam_search(batch, max_length=3, num_beams=2) == [[1, 3, 2], [1, 5, 2], [1, 3, 2]]
+
+    def test_onnx_matches_pytorch(self, tmp_path):
+        try:
+            import numpy as np
+            import torch
+            from transformers import BlipConfig, BlipForConditionalGeneration, CLIPConfig, CLIPModel
+            from src.utils.onnx_export import export_blip, export_clip
+            from src.utils.onnx_backend import OnnxBlip, OnnxClip, ort
+        except ImportError:
+            pytest.skip("torch, transformers or onnx not available")
+        if ort is None:
+            pytest.skip("onnxruntime not available")
+
+        torch.manual_seed(0)
+        layers = dict(hidden_size=32, intermediate_size=37, num_hidden_layers=2, num_attention_heads=4)
+        clip_model = CLIPModel(CLIPConfig(
+            text_config=dict(vocab_size=99, max_position_embeddings=16, **layers),
+            vision_config=dict(image_size=32, patch_size=8, **layers),
+            projection_dim=16,
+        )).eval()
+        blip_model = BlipForConditionalGeneration(BlipConfig(
+            text_config=dict(vocab_size=99, encoder_hidden_size=32, bos_token_id=1, sep_token_id=2, pad_token_id=0, **layers),
+            vision_config=dict(image_size=32, patch_size=8, **layers),
+        )).eval()
+        export_clip(clip_model, str(tmp_path), image_size=32, max_text_length=16)
+        export_blip(blip_model, str(tmp_path), image_size=32)
+
+        pixel_values = torch.randn(3, 3, 32, 32)
+        input_ids = torch.randint(3, 99, (3, 7))
+        attention_mask = torch.ones_like(input_ids)
+        onnx_clip = OnnxClip(str(tmp_path))
+        onnx_blip = OnnxBlip(str(tmp_path))
+        with torch.no_grad():
+            image_features = clip_model.get_image_features(pixel_values=pixel_values).numpy()
+            text_features = clip_model.get_text_features(input_ids=input_ids, attention_mask=attention_mask).numpy()
+            image_embeds = blip_model.vision_model(pixel_values=pixel_values).last_hidden_state
+            logits = blip_model.text_decoder(input_ids=input_ids, encoder_hidden_states=image_embeds).logits[:, -1].numpy()
+            generated = blip_model.generate(pixel_values=pixel_values, max_length=8, num_beams=1, min_length=0).tolist()
+
+        np.testing.assert_allclose(onnx_clip.image_features(pixel_values.numpy()), image_features, atol=1e-4)
+        np.testing.assert_allclose(onnx_clip.text_features(input_ids.numpy(), attention_mask.numpy()), text_features, atol=1e-4)
+        np.testing.assert_allclose(onnx_blip.encode(pixel_values.numpy()), image_embeds.numpy(), atol=1e-4)
+        np.testing.assert_allclose(onnx_blip.next_token_logits(input_ids.numpy(), image_embeds.numpy()), logits, atol=1e-3)
+        special = {0, 1, 2}
+        assert ([[token for token in ids if token not in special] for ids in onnx_blip.generate(pixel_values.numpy(), max_length=8)]
+                == [[token for token in ids if token not in special] for ids in generated])
+
+class TestPreprocessing:
+    def test_load_image_decodes_large_jpeg_at_reduced_size(self):
+        from src.utils.preprocessing import load_image
+
+        img_bytes = io.BytesIO()
+        Image.new('RGB', (4000, 3000), color='blue').save(img_bytes, format='JPEG')
+        image = load_image(img_bytes.getvalue(), min_side=384)
+        assert image.mode == 'RGB'
+        assert image.size == (512, 384)
+        assert load_image(img_bytes.getvalue()).size == (4000, 3000)
+
+    def test_pixel_values_normalize_and_crop(self):
+        import numpy as np
+        from types import SimpleNamespace
+        from src.utils.preprocessing import pixel_values
+
+        mean, std = [0.5, 0.4, 0.3], [0.2, 0.25, 0.3]
+        clip_like = SimpleNamespace(size={"shortest_edge": 8}, crop_size={"height": 8, "width": 8},
+                                    image_mean=mean, image_std=std, rescale_factor=1 / 255)
+        blip_like = SimpleNamespace(size={"height": 12, "width": 12}, image_mean=mean, image_std=std, rescale_factor=1 / 255)
+        images = [Image.new('RGB', (40, 20), color=(255, 0, 51)), Image.new('RGB', (20, 40), color=(0, 255, 102))]
+
+        clip_pixels = pixel_values(images, clip_like)
+        assert clip_pixels.shape == (2, 3, 8, 8) and clip_pixels.dtype == np.float32
+        expected = (np.array([1.0, 0.0, 0.2]) - mean) / std
+        np.testing.assert_allclose(clip_pixels[0, :, 4, 4], expected, atol=1e-5)
+        assert pixel_values(images, blip_like).shape == (2, 3, 12, 12)
+
+    def test_pixel_values_match_transformers_processors(self):
+        try:
+            import numpy as np
+            from transformers import BlipImageProcessor, CLIPImageProcessor
+        except ImportError:
+            pytest.skip("transformers not available")
+        from src.utils.preprocessing import pixel_values
+
+        rng = np.random.default_rng(0)
+        image = Image.fromarray(rng.integers(0, 256, (300, 500, 3), dtype=np.uint8))
+        for processor in (BlipImageProcessor(), CLIPImageProcessor()):
+            expected = processor(images=[image], return_tensors="np")["pixel_values"]
+            np.testing.assert_allclose(pixel_values([image], processor), expected, atol=1e-4)
+
+class TestDecoding:
+    def test_decoding_strategies(self):
+        from src.utils.decoding import decoding_config
+
+        assert decoding_config("greedy", max_length=30) == {"max_length": 30, "num_beams": 1}
+        assert decoding_config("beam", num_beams=4)["num_beams"] == 4
+        assert decoding_config("length_penalty", num_beams=3, length_penalty=1.5)["length_penalty"] == 1.5
+        with pytest.raises(ValueError):
+            decoding_config("sampling")
+
+    def test_check_kv_cache_compares_outputs(self):
+        from src.utils.decoding import check_kv_cache
+
+        calls = []
+        def generate(use_cache, max_length):
+            calls.append(use_cache)
+            return [[1, 5, 2]]
+
+        result = check_kv_cache(generate)
+        assert calls == [True, False]
+        assert result["matches"] is True
+
 class TestMLModels:    
     def test_model_loading(self):
         try:
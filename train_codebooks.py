@@ -0,0 +1,67 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+from utils.database import DB_PATH
+from utils.embedding_index import EmbeddingIndex
+from utils.embedding_store import EmbeddingStore, default_store_path
+from utils.ann_index import IVFPQIndex
+
+
+def load_index(db_path, store_dtype, store_path):
+    """The same search index the API builds at startup, from the store or from BLOBs."""
+    conn = sqlite3.connect(db_path)
+    try:
+        index = EmbeddingIndex()
+        if store_dtype == "sqlite":
+            index.load(conn.execute("SELECT id, filename, caption, embedding FROM images ORDER BY id"))
+        else:
+            rows = conn.execute("SELECT id, filename, caption FROM images ORDER BY id").fetchall()
+            index.attach_store(EmbeddingStore(store_path, store_dtype), rows)
+        return index
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train OPQ/PQ codebooks and encode every embedding into an IVF-PQ index",
+        epilog="Reads the EMBEDDING_STORE the API uses, which must be float16 or int8 for IVF-PQ to save memory "
+               "(run migrate_embeddings.py --dtype float16 first); with sqlite the API keeps the float32 matrix too."
+    )
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--m", type=int, default=int(os.getenv("ANN_PQ_M", "64")), help="sub-quantizers (bytes per vector)")
+    parser.add_argument("--nlist", type=int, default=int(os.getenv("ANN_NLIST", "0")), help="coarse lists (0 = 4 * sqrt(n))")
+    parser.add_argument("--no-opq", action="store_true", help="train plain PQ without the OPQ rotation")
+    parser.add_argument("--train-points", type=int, default=65536, help="vectors sampled for codebook training")
+    parser.add_argument("--output", help="index file (default: the ANN_BACKEND=ivfpq path next to the database)")
+    args = parser.parse_args()
+
+    store_dtype = os.getenv("EMBEDDING_STORE", "sqlite").lower()
+    store_path = os.getenv("EMBEDDING_STORE_PATH") or default_store_path(args.db, store_dtype)
+    if store_dtype == "sqlite":
+        print("Warning: EMBEDDING_STORE=sqlite keeps the float32 matrix in RAM next to the PQ codes; "
+              "migrate to EMBEDDING_STORE=float16 or int8 so IVF-PQ actually saves memory")
+    output = args.output or os.path.splitext(args.db)[0] + ".ivfpq.index"
+
+    index = load_index(args.db, store_dtype, store_path)
+    if len(index) == 0:
+        print("No embeddings to train on")
+        return 1
+    ann = IVFPQIndex(nlist=args.nlist or None, m=args.m, opq=not args.no_opq, max_pq_train_points=args.train_points)
+    print(f"Training {'OPQ' if ann.opq else 'PQ'} m={ann.m} on {min(len(index), args.train_points)} of {len(index)} embeddings")
+    start = time.perf_counter()
+    index.attach_ann(ann)
+    index.save_ann(output)
+    print(f"Encoded {ann.ntotal} vectors into {ann.nlist} lists in {time.perf_counter() - start:.1f}s; "
+          f"{ann.bytes_per_vector} bytes per vector, saved to {output}")
+    print("Start the API with ANN_BACKEND=ivfpq to use it")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())